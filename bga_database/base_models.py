@@ -9,7 +9,7 @@ class SluggedModel(models.Model):
 
 
 class AliasModel(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     preferred = models.BooleanField(default=False)
 
     class Meta:
@@ -21,6 +21,9 @@ class AliasModel(models.Model):
     def clean(self):
         super().clean()
 
+        # Incoming data is matched to aliases by exact name.
+        self.name = self.name.strip()
+
         entity = getattr(self, self.entity_type)
         preferred_alias = entity.aliases.filter(preferred=True)
 
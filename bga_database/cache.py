@@ -0,0 +1,377 @@
+import collections
+import logging
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+import redis
+
+
+logger = logging.getLogger(__name__)
+
+# Redis clients, and the in-process tiers of each cache, are shared by the
+# threads of a worker. Django creates cache instances per thread.
+_clients = {}
+_local_tiers = {}
+_lock = threading.Lock()
+
+# Values are stored in Redis as a header, holding the time the value expires,
+# or 0 if it never expires, and whether it is compressed, followed by the
+# pickled value.
+HEADER = struct.Struct('!d?')
+
+# Store a value unless the key holds a value that has not expired, i.e., add
+# a value, treating stale values as missing, in a single round trip, so two
+# workers cannot both add the same key. KEYS are the key and its refresh
+# key, and ARGV the record, the current time, and the TTL of the record, or
+# an empty string if it should not expire.
+ADD_SCRIPT = '''
+local record = redis.call('GET', KEYS[1])
+
+if record then
+  local expires_at = struct.unpack('>d', record)
+
+  if expires_at == 0 or expires_at > tonumber(ARGV[2]) then
+    return 0
+  end
+end
+
+if ARGV[3] == '' then
+  redis.call('SET', KEYS[1], ARGV[1])
+else
+  redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+end
+
+redis.call('DEL', KEYS[2])
+
+return 1
+'''
+
+
+class LocalTier(object):
+    '''
+    Size-bounded LRU cache of pickled values, shared by the threads of a
+    worker. Values are pickled, like LocMemCache, so requests cannot change
+    each other's copies.
+    '''
+    def __init__(self, max_entries, max_value_size):
+        self.max_entries = max_entries
+        self.max_value_size = max_value_size
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            try:
+                local_expires_at, expires_at, pickled = self._values[key]
+            except KeyError:
+                return None
+
+            if local_expires_at <= now:
+                del self._values[key]
+                return None
+
+            self._values.move_to_end(key)
+
+            return expires_at, pickled
+
+    def set(self, key, expires_at, pickled, local_expires_at):
+        if expires_at:
+            local_expires_at = min(expires_at, local_expires_at)
+
+        with self._lock:
+            if len(pickled) > self.max_value_size or not self.max_entries:
+                self._values.pop(key, None)
+                return
+
+            self._values[key] = (local_expires_at, expires_at, pickled)
+            self._values.move_to_end(key)
+
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class TieredCache(BaseCache):
+    '''
+    Cache backend with a small, in-process LRU cache in front of a cache in
+    Redis shared by every worker, so hot values are served without a network
+    round trip, and other hits without touching Postgres.
+
+    Values larger than COMPRESS_MIN_SIZE bytes, pickled, are compressed in
+    Redis. Expired values are kept in Redis for another STALE_TIMEOUT
+    seconds. get() treats them as missing, like other backends, while
+    get_stale() lets the first worker to ask for an expired value recompute
+    it, and serves the stale value to other workers for up to
+    REFRESH_TIMEOUT seconds in the meantime, rather than all recomputing it
+    at once. Use get_stale() only where a miss leads to recomputing and
+    setting the value, e.g., in StaleCacheMiddleware.
+
+    A worker serves values from its own tier for at most LOCAL_TIMEOUT
+    seconds, so values deleted or replaced by other workers may be served
+    for that long, unless they are read with get_shared(). Values larger than
+    LOCAL_MAX_VALUE_SIZE bytes are only cached in Redis.
+
+    LOCATION is the URL of the Redis database. Give each cache a KEY_PREFIX,
+    since clear() deletes the keys with the cache's prefix.
+    '''
+    def __init__(self, location, params):
+        super().__init__(params)
+
+        options = params.get('OPTIONS', {})
+
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 10)
+        self.compress_min_size = options.get('COMPRESS_MIN_SIZE', 16 * 1024)
+        self.stale_timeout = options.get('STALE_TIMEOUT', 5 * 60)
+        self.refresh_timeout = options.get('REFRESH_TIMEOUT', 30)
+
+        with _lock:
+            if location not in _clients:
+                _clients[location] = redis.StrictRedis.from_url(location)
+
+            local_key = (location, self.key_prefix)
+
+            if local_key not in _local_tiers:
+                _local_tiers[local_key] = LocalTier(
+                    options.get('LOCAL_MAX_ENTRIES', 500),
+                    options.get('LOCAL_MAX_VALUE_SIZE', 1024 * 1024)
+                )
+
+        self.client = _clients[location]
+        self.local = _local_tiers[local_key]
+        self.add_script = self.client.register_script(ADD_SCRIPT)
+
+    def _refresh_key(self, key):
+        return 'refresh:{}'.format(key)
+
+    def _encode(self, expires_at, pickled):
+        compressed = len(pickled) > self.compress_min_size
+
+        if compressed:
+            pickled = zlib.compress(pickled)
+
+        return HEADER.pack(expires_at or 0, compressed) + pickled
+
+    def _decode(self, record):
+        expires_at, compressed = HEADER.unpack_from(record)
+        pickled = record[HEADER.size:]
+
+        if compressed:
+            pickled = zlib.decompress(pickled)
+
+        return expires_at or None, pickled
+
+    def _prepare(self, value, timeout):
+        '''
+        Return the expiry of the given value, the value pickled, the record
+        to store in Redis, and the TTL of the record, or None if the value
+        has already expired.
+        '''
+        expires_at = self.get_backend_timeout(timeout)
+        now = time.time()
+
+        if expires_at is not None and expires_at <= now:
+            return None
+
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        record = self._encode(expires_at, pickled)
+
+        # Keep expired values around to serve while they are recomputed.
+        if expires_at is None:
+            ttl = None
+        else:
+            ttl = int(expires_at - now + self.stale_timeout) + 1
+
+        return expires_at, pickled, record, ttl
+
+    def _store(self, key, value, timeout):
+        '''
+        Store the given value in Redis, and in the local tier. Return whether
+        the value was stored.
+        '''
+        prepared = self._prepare(value, timeout)
+
+        if prepared is None:
+            self._delete(key)
+            return False
+
+        expires_at, pickled, record, ttl = prepared
+
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.set(key, record, ex=ttl)
+        pipeline.delete(self._refresh_key(key))
+        pipeline.execute()
+
+        self.local.set(key, expires_at, pickled, time.time() + self.local_timeout)
+
+        return True
+
+    def _get(self, key, default, stale, refresh, local=True):
+        '''
+        Return the value of the given key, from the local tier or Redis.
+        Expired values are returned if stale is set, per get_stale(). The
+        local tier is skipped if local is not set, per get_shared().
+        '''
+        now = time.time()
+
+        if local:
+            cached = self.local.get(key, now)
+
+            if cached:
+                _, pickled = cached
+                return pickle.loads(pickled)
+
+        try:
+            record = self.client.get(key)
+        except redis.RedisError as e:
+            logger.warning('Could not get {0} from Redis: {1}'.format(key, e))
+            return default
+
+        if record is None:
+            return default
+
+        expires_at, pickled = self._decode(record)
+
+        if expires_at is None or expires_at > now:
+            if local:
+                self.local.set(key, expires_at, pickled, now + self.local_timeout)
+
+            return pickle.loads(pickled)
+
+        if not stale:
+            return default
+
+        if refresh:
+            # Let the first worker to ask recompute the value, and serve the
+            # stale value to the rest in the meantime.
+            try:
+                claimed = self.client.set(self._refresh_key(key), 1, ex=self.refresh_timeout, nx=True)
+            except redis.RedisError as e:
+                logger.warning('Could not claim refresh of {0}: {1}'.format(key, e))
+                claimed = True
+
+            if claimed:
+                return default
+
+        return pickle.loads(pickled)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        return self._get(key, default, stale=False, refresh=False)
+
+    def get_stale(self, key, default=None, version=None, refresh=True):
+        '''
+        Like get(), but return values that have expired, but are still kept
+        in Redis. If refresh is set, the first caller to ask for an expired
+        value claims its refresh, and gets the default, and is expected to
+        recompute and set the value, while other callers get the stale value
+        until it is set, or for up to REFRESH_TIMEOUT seconds.
+        '''
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        return self._get(key, default, stale=True, refresh=refresh)
+
+    def get_shared(self, key, default=None, version=None):
+        '''
+        Like get(), but read the value from Redis, without the local tier,
+        e.g., for locks that other workers release.
+        '''
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        return self._get(key, default, stale=False, refresh=False, local=False)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        try:
+            self._store(key, value, timeout)
+        except redis.RedisError as e:
+            logger.warning('Could not set {0} in Redis: {1}'.format(key, e))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        prepared = self._prepare(value, timeout)
+
+        if prepared is None:
+            return False
+
+        expires_at, pickled, record, ttl = prepared
+
+        try:
+            added = self.add_script(
+                keys=[key, self._refresh_key(key)],
+                args=[record, repr(time.time()), ttl or ''],
+            )
+        except redis.RedisError as e:
+            logger.warning('Could not add {0} to Redis: {1}'.format(key, e))
+            return False
+
+        if added:
+            self.local.set(key, expires_at, pickled, time.time() + self.local_timeout)
+
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_key(key, version=version)
+        self.validate_key(made_key)
+
+        try:
+            record = self.client.get(made_key)
+        except redis.RedisError as e:
+            logger.warning('Could not touch {0} in Redis: {1}'.format(made_key, e))
+            return False
+
+        if record is None:
+            return False
+
+        _, pickled = self._decode(record)
+
+        return self._store(made_key, pickle.loads(pickled), timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        self._delete(key)
+
+    def _delete(self, key):
+        self.local.delete(key)
+
+        try:
+            self.client.delete(key, self._refresh_key(key))
+        except redis.RedisError as e:
+            logger.warning('Could not delete {0} from Redis: {1}'.format(key, e))
+
+    def clear(self):
+        self.local.clear()
+
+        pattern = '{}:*'.format(self.key_prefix)
+
+        keys = []
+
+        for key in self.client.scan_iter(match=pattern, count=1000):
+            keys.append(key)
+
+            if len(keys) >= 1000:
+                self.client.delete(*keys)
+                keys = []
+
+        if keys:
+            self.client.delete(*keys)
@@ -143,6 +143,12 @@ LOGIN_URL = '/admin/login/'
 
 SEARCH_LIMIT = 1
 
+# Seconds to wait for a response from Solr, and the maximum number of
+# concurrent requests to Solr per web worker when entity types are searched
+# separately. See payroll.search.
+SOLR_TIMEOUT = 10
+SOLR_SEARCH_WORKERS = 3
+
 # Remote storage options
 if not DEBUG:  # noqa
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
@@ -153,6 +159,33 @@ try:
 except NameError:
     DATA_YEAR = 2017
 
+# Stream salary downloads with COPY ... TO STDOUT, rather than fetching rows
+# from a server-side cursor DOWNLOAD_FETCH_SIZE at a time. See payroll.exports.
+try:
+    DOWNLOAD_USE_COPY  # noqa
+except NameError:
+    DOWNLOAD_USE_COPY = False
+
+DOWNLOAD_FETCH_SIZE = 2000
+
+# Maximum number of bytes of a standardized file to read when detecting its
+# encoding. See data_import.utils.CsvMeta.
+ENCODING_DETECTION_BYTES = 1024 * 1024
+
+# Log the output of EXPLAIN (ANALYZE, BUFFERS) for each statement in the
+# import run log. Roughly doubles import time. See data_import.utils.run_log.
+try:
+    IMPORT_EXPLAIN  # noqa
+except NameError:
+    IMPORT_EXPLAIN = False
+
+# Public URL of the site. warm_cache requests pages with its host and scheme,
+# so they are cached under the same keys as requests from visitors.
+try:
+    WARM_CACHE_URL  # noqa
+except NameError:
+    WARM_CACHE_URL = 'https://salary.bettergov.org'
+
 # Turn off default authentication and handle it on the viewsets. This turns
 # off basic authentication, which gets confused because Nginx is sending an
 # unrelated authorization header for the staging site.
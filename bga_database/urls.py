@@ -23,6 +23,7 @@ from data_import import views as import_views
 from payroll import views as payroll_views
 from payroll import api as api_views
 from payroll import sitemaps as payroll_sitemaps
+from payroll.utils import vintage_cache_page
 
 from rest_framework import routers
 
@@ -42,11 +43,11 @@ sitemaps = {
 
 urlpatterns = [
     # client
-    path('', cache_page(EIGHT_HOURS, cache='vary_on_setting')(payroll_views.IndexView.as_view()), name='home'),
+    path('', vintage_cache_page(EIGHT_HOURS, 'data', cache='vary_on_setting')(payroll_views.IndexView.as_view()), name='home'),
     path('user-guide/', cache_page(EIGHT_HOURS)(payroll_views.UserGuideView.as_view()), name='user_guide'),
-    path('unit/<str:slug>/', cache_page(EIGHT_HOURS)(payroll_views.UnitView.as_view()), name='unit'),
-    path('department/<str:slug>/', cache_page(EIGHT_HOURS)(payroll_views.DepartmentView.as_view()), name='department'),
-    path('person/<str:slug>/', cache_page(EIGHT_HOURS)(payroll_views.PersonView.as_view()), name='person'),
+    path('unit/<str:slug>/', vintage_cache_page(EIGHT_HOURS, 'unit')(payroll_views.UnitView.as_view()), name='unit'),
+    path('department/<str:slug>/', vintage_cache_page(EIGHT_HOURS, 'unit')(payroll_views.DepartmentView.as_view()), name='department'),
+    path('person/<str:slug>/', vintage_cache_page(EIGHT_HOURS, 'data')(payroll_views.PersonView.as_view()), name='person'),
     path('entity-lookup/', payroll_views.EntityLookup.as_view(), name='entity-lookup'),
     path('search/', payroll_views.SearchView.as_view(), name='search'),
     path('story-feed/', cache_page(EIGHT_HOURS)(payroll_views.StoryFeed.as_view()), name='story-feed'),
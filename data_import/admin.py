@@ -4,7 +4,8 @@ from django import forms
 from django.contrib import admin
 from django.core.exceptions import ValidationError
 
-from data_import.models import SourceFile, Upload, RespondingAgency, StandardizedFile
+from data_import.models import SourceFile, Upload, RespondingAgency, StandardizedFile, \
+    ImportRunLog
 from data_import.forms import UploadForm
 
 
@@ -80,9 +81,38 @@ class AdminSourceFile(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class ImportRunLogInline(admin.TabularInline):
+    '''
+    Read-only run log of the import of a standardized file.
+    '''
+    model = ImportRunLog
+    fields = ('stage', 'started', 'duration', 'row_count', 'explain')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class AdminStandardizedFile(admin.ModelAdmin):
     form = UploadForm
     change_form_template = 'data_import/change_form.html'
+    inlines = [ImportRunLogInline]
+    actions = ['resume_import']
+
+    def resume_import(self, request, queryset):
+        '''
+        Resume interrupted imports from their last completed stage.
+        '''
+        resumed = [s_file for s_file in queryset if s_file.resume_import()]
+
+        message = 'Resumed {} import(s). Imports awaiting review resume when ' \
+                  'the review is finished.'.format(len(resumed))
+
+        self.message_user(request, message)
+
+    resume_import.short_description = 'Resume selected imports'
 
     def get_readonly_fields(self, request, obj=None):
         '''
@@ -93,6 +123,15 @@ class AdminStandardizedFile(admin.ModelAdmin):
         else:
             return []
 
+    def get_inline_instances(self, request, obj=None):
+        '''
+        Only show the run log for existing standardized files.
+        '''
+        if obj:
+            return super().get_inline_instances(request, obj)
+        else:
+            return []
+
     def change_view(self, request, object_id, form_url='', extra_context=None):
         extra_context = extra_context or {}
 
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_import', '0009_index_alias_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRunLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=255)),
+                ('started', models.DateTimeField()),
+                ('duration', models.DurationField()),
+                ('row_count', models.IntegerField(null=True)),
+                ('explain', models.TextField(blank=True)),
+                ('standardized_file', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='run_log',
+                    to='data_import.StandardizedFile'
+                )),
+            ],
+            options={
+                'ordering': ('started',),
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_import', '0010_importrunlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=255)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+                ('standardized_file', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='checkpoints',
+                    to='data_import.StandardizedFile'
+                )),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importcheckpoint',
+            constraint=models.UniqueConstraint(fields=('standardized_file', 'stage'), name='unique_checkpoint'),
+        ),
+    ]
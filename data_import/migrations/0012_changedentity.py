@@ -0,0 +1,31 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_import', '0011_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedEntity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(choices=[('unit', 'unit'), ('department', 'department'), ('person', 'person')], max_length=255)),
+                ('entity_id', models.IntegerField()),
+                ('standardized_file', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='changed_entities',
+                    to='data_import.StandardizedFile'
+                )),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='changedentity',
+            constraint=models.UniqueConstraint(fields=('standardized_file', 'entity_type', 'entity_id'), name='unique_changed_entity'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_import', '0012_changedentity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changedentity',
+            index=models.Index(fields=['entity_type', 'entity_id', 'standardized_file'], name='data_import_entity__1b294d_idx'),
+        ),
+    ]
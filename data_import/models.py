@@ -8,11 +8,13 @@ from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import connection, models
+from django.db.models import UniqueConstraint
 from django.utils.text import slugify
 from django_fsm import FSMField, transition
 
 from bga_database.base_models import AliasModel, SluggedModel
 from data_import import tasks
+from data_import.utils import data_vintage
 
 
 def set_deleted_user():
@@ -144,6 +146,31 @@ class StandardizedFile(models.Model):
     )
     status = FSMField(default=State.UPLOADED)
 
+    # Tasks run by each transition, in order. Tasks skip stages of the import
+    # that have already been completed, so the tasks for a transition can be
+    # run again to resume an interrupted import.
+    PIPELINES = {
+        'copy_to_database': (
+            'copy_to_database',
+            'select_unseen_responding_agency',
+        ),
+        'select_unseen_parent_employer': (
+            'insert_responding_agency',
+            'select_unseen_parent_employer',
+        ),
+        'select_unseen_child_employer': (
+            'insert_parent_employer',
+            'select_unseen_child_employer',
+        ),
+        'insert_salaries': (
+            'insert_child_employer',
+            'insert_salaries',
+            'build_solr_index',
+            'build_exports',
+            'warm_cache',
+        ),
+    }
+
     def __str__(self):
         return str(self.standardized_file)
 
@@ -179,50 +206,54 @@ class StandardizedFile(models.Model):
                 if kw_args.get('s_file_id') == self.id:
                     return self._add_runtime(task)
 
+    def _run_pipeline(self, transition):
+        work = chain(*[
+            getattr(tasks, task).si(s_file_id=self.id)
+            for task in self.PIPELINES[transition]
+        ])
+
+        work.apply_async()
+
     @transition(field=status,
                 source=State.UPLOADED,
                 target=State.RA_PENDING)
     def copy_to_database(self):
-        work = chain(
-            tasks.copy_to_database.si(s_file_id=self.id),
-            tasks.select_unseen_responding_agency.si(s_file_id=self.id)
-        )
-
-        work.apply_async()
+        self._run_pipeline('copy_to_database')
 
     @transition(field=status,
                 source=State.RA_PENDING,
                 target=State.P_EMP_PENDING)
     def select_unseen_parent_employer(self):
-        work = chain(
-            tasks.insert_responding_agency.si(s_file_id=self.id),
-            tasks.select_unseen_parent_employer.si(s_file_id=self.id)
-        )
-
-        work.apply_async()
+        self._run_pipeline('select_unseen_parent_employer')
 
     @transition(field=status,
                 source=State.P_EMP_PENDING,
                 target=State.C_EMP_PENDING)
     def select_unseen_child_employer(self):
-        work = chain(
-            tasks.insert_parent_employer.si(s_file_id=self.id),
-            tasks.select_unseen_child_employer.si(s_file_id=self.id)
-        )
-
-        work.apply_async()
+        self._run_pipeline('select_unseen_child_employer')
 
     @transition(field=status,
                 source=State.C_EMP_PENDING,
                 target=State.COMPLETE)
     def insert_salaries(self):
-        work = chain(
-            tasks.insert_child_employer.si(s_file_id=self.id),
-            tasks.insert_salaries.si(s_file_id=self.id),
-            tasks.build_solr_index.si(s_file_id=self.id)
-        )
+        self._run_pipeline('insert_salaries')
 
-        work.apply_async()
+    def resume_import(self):
+        '''
+        Run the tasks for the current step of the import again, e.g., after a
+        worker died. Completed stages are skipped. Return False if the import
+        is waiting for review, in which case finishing the review resumes it.
+        '''
+        if self.status in (self.State.UPLOADED, 'copied to database'):
+            self._run_pipeline('copy_to_database')
+
+        elif self.status == self.State.COMPLETE:
+            self._run_pipeline('insert_salaries')
+
+        else:
+            return False
+
+        return True
 
     def post_delete_handler(self):
         '''
@@ -247,6 +278,119 @@ class StandardizedFile(models.Model):
                 print('Dropping {}'.format(table_name))
                 cursor.execute('DROP TABLE IF EXISTS {}'.format(table_name))
 
+        data_vintage.bump()
+
+
+class ImportRunLog(models.Model):
+    '''
+    Wall time and rows affected by a stage of the import of a standardized
+    file, i.e., a task or an ImportUtility method, for spotting slow stages
+    and regressions.
+    '''
+    standardized_file = models.ForeignKey(
+        'StandardizedFile',
+        related_name='run_log',
+        on_delete=models.CASCADE
+    )
+    stage = models.CharField(max_length=255)
+    started = models.DateTimeField()
+    duration = models.DurationField()
+    row_count = models.IntegerField(null=True)
+    explain = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('started',)
+
+    def __str__(self):
+        return '{0} – {1}'.format(self.standardized_file, self.stage)
+
+
+class ImportCheckpoint(models.Model):
+    '''
+    Stage of the import of a standardized file that has been completed, so an
+    interrupted import can resume from the last completed stage. See
+    ImportUtility.run_stage.
+    '''
+    standardized_file = models.ForeignKey(
+        'StandardizedFile',
+        related_name='checkpoints',
+        on_delete=models.CASCADE
+    )
+    stage = models.CharField(max_length=255)
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['standardized_file', 'stage'],
+                name='unique_checkpoint'
+            )
+        ]
+
+
+class ChangedEntity(models.Model):
+    '''
+    Unit, department or person whose salaries were added or removed by the
+    import of a standardized file, so the search index can be updated for
+    just those entities. See the --s_file option of build_solr_index.
+
+    Entities are recorded by ID, rather than foreign key, so people and
+    departments deleted by an amendment can be removed from the index.
+    '''
+    ENTITY_TYPES = ('unit', 'department', 'person')
+
+    standardized_file = models.ForeignKey(
+        'StandardizedFile',
+        related_name='changed_entities',
+        on_delete=models.CASCADE
+    )
+    entity_type = models.CharField(
+        max_length=255,
+        choices=[(entity_type, entity_type) for entity_type in ENTITY_TYPES]
+    )
+    entity_id = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['standardized_file', 'entity_type', 'entity_id'],
+                name='unique_changed_entity'
+            )
+        ]
+        indexes = [
+            # For looking up the most recent file to change an entity. See
+            # DataVintageRegistry.unit_versions.
+            models.Index(fields=['entity_type', 'entity_id', 'standardized_file'])
+        ]
+
+    @classmethod
+    def record_salaries(cls, s_file_id, salaries):
+        '''
+        Record the people, departments and units of the given salaries, e.g.,
+        before they are deleted by an amendment.
+        '''
+        rows = salaries.values_list('job__person_id',
+                                    'job__position__employer_id',
+                                    'job__position__employer__parent_id')
+
+        entities = set()
+
+        for person_id, employer_id, parent_id in rows:
+            entities.add(('person', person_id))
+
+            if parent_id:
+                entities.add(('department', employer_id))
+                entities.add(('unit', parent_id))
+            else:
+                entities.add(('unit', employer_id))
+
+        cls.objects.bulk_create([
+            cls(standardized_file_id=s_file_id,
+                entity_type=entity_type,
+                entity_id=entity_id)
+            for entity_type, entity_id in entities
+        ], ignore_conflicts=True)
+
 
 def post_delete_handler(sender, instance, **kwargs):
     try:
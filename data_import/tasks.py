@@ -5,11 +5,11 @@ from io import StringIO
 import sys
 
 from celery import shared_task, Task
-from celery.signals import task_prerun
+from celery.signals import task_prerun, task_postrun
 from django.core.management import call_command
 from django.db import connection
 
-from data_import.utils import CsvMeta, ImportUtility
+from data_import.utils import CsvMeta, ImportUtility, RunLogStage, data_vintage
 
 
 logger = logging.getLogger(__name__)
@@ -83,6 +83,33 @@ def init_task(*args, **kwargs):
         s_file_id = kwargs['kwargs']['s_file_id']
         sender.setup(s_file_id=s_file_id)
 
+        # Record each task in the run log of its standardized file. Count
+        # rows affected by the ImportUtility stages the task runs, rather
+        # than every query, e.g., to update the status of the file.
+        sender.run_log_stage = RunLogStage(s_file_id,
+                                           sender.name.split('.')[-1],
+                                           record_queries=False)
+        sender.run_log_stage.start()
+
+
+@task_postrun.connect()
+def log_task(*args, **kwargs):
+    '''
+    Record the task in the run log, if it succeeded. This hooks into the
+    task_postrun signal, which is fired after each task is run.
+    '''
+    sender = kwargs['sender']
+
+    stage = getattr(sender, 'run_log_stage', None)
+
+    if isinstance(sender, DataImportTask) and stage:
+        sender.run_log_stage = None
+
+        if kwargs['state'] == 'SUCCESS':
+            stage.finish()
+        else:
+            stage.abandon()
+
 
 @shared_task(bind=True, base=DataImportTask)
 def copy_to_database(self, *, s_file_id):
@@ -110,31 +137,42 @@ def copy_to_database(self, *, s_file_id):
 
     create = 'CREATE TABLE {} ({})'.format(table_name, columns)
 
-    with connection.cursor() as cursor:
-        cursor.execute(create)
-
-    meta = CsvMeta(self.s_file.standardized_file)
-    formatted_data_file = meta.trim_extra_fields()
+    def copy_raw_data():
+        meta = CsvMeta(self.s_file.standardized_file)
 
-    with open(formatted_data_file, 'r', encoding='utf-8') as f:
         with connection.cursor() as cursor:
+            # Create the raw table in the same transaction as the copy, so an
+            # interrupted copy leaves nothing behind. Drop the table left by
+            # a copy interrupted before stages were checkpointed.
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+            cursor.execute(create)
+
+            # Stream the required fields from the standardized file straight
+            # into COPY, rather than writing them to a temp file first.
             copy_fmt = 'COPY "{table}" ({cols}) FROM STDIN CSV HEADER'
 
             copy = copy_fmt.format(table=table_name,
                                    cols=','.join(meta.REQUIRED_FIELDS))
 
-            cursor.copy_expert(copy, f)
+            cursor.copy_expert(copy, meta.trimmed_file())
+
+            self.run_log_stage.add_rows(cursor.rowcount)
+
+            # Values are trimmed as they are copied, so the import can match
+            # records to employers on the columns themselves.
+            cursor.execute('CREATE INDEX ON {} (employer, department)'.format(table_name))
+            cursor.execute('ANALYZE {}'.format(table_name))
 
-            cursor.execute('CREATE INDEX ON {} (TRIM(LOWER(employer)))'.format(table_name))
+    self.import_utility.run_stage('copy_to_database', copy_raw_data)
 
     self.update_status('copied to database')
 
-    return 'Copied {} to database'.format(formatted_data_file)
+    return 'Copied {} to database'.format(self.s_file.standardized_file.name)
 
 
 @shared_task(bind=True, base=DataImportTask)
 def select_unseen_responding_agency(self, *, s_file_id):
-    self.import_utility.select_unseen_responding_agency()
+    self.import_utility.run_stage('select_unseen_responding_agency')
 
     self.update_status('responding agency unmatched')
 
@@ -143,14 +181,14 @@ def select_unseen_responding_agency(self, *, s_file_id):
 
 @shared_task(bind=True, base=DataImportTask)
 def insert_responding_agency(self, *, s_file_id):
-    self.import_utility.insert_responding_agency()
+    self.import_utility.run_stage('insert_responding_agency')
 
     return 'Inserted responding agencies'
 
 
 @shared_task(bind=True, base=DataImportTask)
 def select_unseen_parent_employer(self, *, s_file_id):
-    self.import_utility.select_unseen_parent_employer()
+    self.import_utility.run_stage('select_unseen_parent_employer')
 
     self.update_status('parent employer unmatched')
 
@@ -159,14 +197,14 @@ def select_unseen_parent_employer(self, *, s_file_id):
 
 @shared_task(bind=True, base=DataImportTask)
 def insert_parent_employer(self, *, s_file_id):
-    self.import_utility.insert_parent_employer()
+    self.import_utility.run_stage('insert_parent_employer')
 
     return 'Inserted parent employers'
 
 
 @shared_task(bind=True, base=DataImportTask)
 def select_unseen_child_employer(self, *, s_file_id):
-    self.import_utility.select_unseen_child_employer()
+    self.import_utility.run_stage('select_unseen_child_employer')
 
     self.update_status('child employer unmatched')
 
@@ -175,26 +213,24 @@ def select_unseen_child_employer(self, *, s_file_id):
 
 @shared_task(bind=True, base=DataImportTask)
 def insert_child_employer(self, *, s_file_id):
-    self.import_utility.insert_child_employer()
+    self.import_utility.run_stage('insert_child_employer')
 
     return 'Inserted child employers'
 
 
 @shared_task(bind=True, base=DataImportTask)
 def insert_salaries(self, *, s_file_id):
-    self.import_utility.insert_position()
+    # Each stage is checkpointed, so if this task is interrupted, running it
+    # again picks up where it left off.
+    self.import_utility.run_stages(self.import_utility.SALARY_STAGES)
 
-    self.import_utility.select_raw_person()
-    self.import_utility.select_raw_job()
-
-    self.import_utility.insert_person()
-    self.import_utility.insert_job()
-    self.import_utility.insert_salary()
-
-    call_command('sync_pgviews')
+    with RunLogStage(s_file_id, 'sync_pgviews', record_queries=False):
+        call_command('sync_pgviews')
 
     self.update_status('complete')
 
+    data_vintage.bump()
+
     return 'Inserted salaries'
 
 
@@ -202,12 +238,50 @@ def insert_salaries(self, *, s_file_id):
 def build_solr_index(self, *, s_file_id):
     io_out = StringIO()
 
-    call_command(
-        'build_solr_index',
-        '--recreate',
-        reporting_year=self.s_file.reporting_year,
-        chunksize=25,
-        stdout=io_out
-    )
+    def build():
+        # Reindex only the entities changed by this file, rather than every
+        # document for the reporting year.
+        call_command(
+            'build_solr_index',
+            s_file_id=s_file_id,
+            stdout=io_out
+        )
+
+    self.import_utility.run_stage('build_solr_index', build, atomic=False)
+
+    return io_out.getvalue()
+
+
+@shared_task(bind=True, base=DataImportTask)
+def build_exports(self, *, s_file_id):
+    io_out = StringIO()
+
+    def build():
+        call_command(
+            'build_exports',
+            reporting_year=self.s_file.reporting_year,
+            stdout=io_out
+        )
+
+    self.import_utility.run_stage('build_exports', build, atomic=False)
+
+    return io_out.getvalue()
+
+
+@shared_task(bind=True, base=DataImportTask)
+def warm_cache(self, *, s_file_id):
+    io_out = StringIO()
+
+    def warm():
+        # Cache keys include the version of the data, so the import has
+        # already invalidated the responses it affects. Request the most
+        # visited ones before visitors do.
+        call_command(
+            'warm_cache',
+            data_year=self.s_file.reporting_year,
+            stdout=io_out
+        )
+
+    self.import_utility.run_stage('warm_cache', warm, atomic=False)
 
     return io_out.getvalue()
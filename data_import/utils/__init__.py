@@ -1,5 +1,7 @@
 # flake8: noqa
 from data_import.utils.csv_meta import CsvMeta
+from data_import.utils.data_vintage import data_vintage, VersionToken
 from data_import.utils.import_utility import ImportUtility
 from data_import.utils.queues import RespondingAgencyQueue, \
     ParentEmployerQueue, ChildEmployerQueue
+from data_import.utils.run_log import RunLogStage
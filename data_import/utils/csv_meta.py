@@ -1,9 +1,20 @@
+import codecs
 import csv
+import io
 import itertools
+import operator
+import os
 from os.path import basename
+import tempfile
 
 from cchardet import UniversalDetector
 from csvkit.convert import guess_format
+from django.conf import settings
+
+
+# Number of characters to buffer for each read from TrimmedCsvStream when
+# the caller does not specify a size.
+COPY_READ_SIZE = 64 * 1024
 
 
 class CsvMeta(object):
@@ -25,27 +36,87 @@ class CsvMeta(object):
         'data_year',
     ]
 
+    # Byte order marks, and the encodings they identify, checked before
+    # sampling the file for its encoding.
+    BOMS = [
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF32_LE, 'utf-32'),
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    ]
+
     def __init__(self, incoming_file):
         self.file = incoming_file
 
-        # We need two copies of the file chunk generator:
-        # One to detect file encoding, and one to grab the field names.
-        all_chunks, first_chunk = itertools.tee(self.file.chunks())
-        self.first_chunk = next(first_chunk)
-        self.chunks = all_chunks
+        # Only read as much of the file as it takes to detect its encoding
+        # and grab the field names.
+        self.chunks = self.file.chunks()
+        self.first_chunk = next(self.chunks)
+
+        # Whether the encoding was detected from part of the file. See
+        # _decoded_lines.
+        self.partial_sample = False
 
         self.file_type = guess_format(self.file.name.lower())
         self.file_encoding = self._file_encoding()
         self.field_names = self._field_names()
 
+    def _sample(self):
+        '''
+        Yield chunks of the file, starting with the first, until
+        ENCODING_DETECTION_BYTES have been read. The first chunk is always
+        sampled in full, since the field names are decoded from it.
+        '''
+        budget = settings.ENCODING_DETECTION_BYTES
+
+        yield self.first_chunk
+        budget -= len(self.first_chunk)
+
+        for chunk in self.chunks:
+            if len(chunk) > budget:
+                self.partial_sample = True
+
+                if budget > 0:
+                    yield chunk[:budget]
+
+                break
+
+            yield chunk
+            budget -= len(chunk)
+
     def _file_encoding(self):
+        for bom, encoding in self.BOMS:
+            if self.first_chunk.startswith(bom):
+                return encoding
+
+        sample = list(self._sample())
+
+        # Most uploads are UTF-8, or ASCII, which UTF-8 decodes. If the sample
+        # decodes, skip detection. The sample may end mid-character, so decode
+        # it incrementally.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+
+        try:
+            for chunk in sample:
+                decoder.decode(chunk)
+
+        except UnicodeDecodeError:
+            pass
+
+        else:
+            return 'utf-8'
+
+        return self._detect_encoding(sample)
+
+    def _detect_encoding(self, chunks):
         detector = UniversalDetector()
 
-        for chunk in self.chunks:
-            for line in chunk.splitlines():
-                detector.feed(line)
-                if detector.done:
-                    break
+        for line in itertools.chain.from_iterable(chunk.splitlines() for chunk in chunks):
+            detector.feed(line)
+
+            if detector.done:
+                break
 
         detector.close()
         encoding = detector.result['encoding']
@@ -53,7 +124,9 @@ class CsvMeta(object):
         return encoding
 
     def _field_names(self):
-        decoded_chunk = self.first_chunk.decode(self.file_encoding).splitlines()
+        # The first chunk may end mid-character, so decode it incrementally.
+        decoder = codecs.getincrementaldecoder(self.file_encoding)()
+        decoded_chunk = decoder.decode(self.first_chunk).splitlines()
 
         reader = csv.reader(decoded_chunk)
         fields = next(reader)
@@ -64,32 +137,149 @@ class CsvMeta(object):
     def _clean_field(cls, field):
         return '_'.join(field.strip().lower().split(' '))
 
+    def _decoded_lines(self):
+        '''
+        Decode the file one chunk at a time, and yield it line by line. Line
+        endings are kept, so quoted fields containing newlines survive intact.
+
+        If the encoding was detected from the first ENCODING_DETECTION_BYTES
+        of the file, e.g., a Latin-1 file whose first megabyte is ASCII, and
+        the rest of the file does not decode, detect the encoding from the
+        whole file, and carry on from the same line.
+        '''
+        yielded = 0
+
+        try:
+            for line in self._decode_lines(self.file_encoding):
+                yield line
+                yielded += 1
+
+        except UnicodeDecodeError:
+            if not self.partial_sample:
+                raise
+
+            encoding = self._detect_encoding(self.file.chunks())
+
+            if not encoding or codecs.lookup(encoding) == codecs.lookup(self.file_encoding):
+                raise
+
+            self.file_encoding = encoding
+            self.partial_sample = False
+
+            # The sample decoded, so the lines already yielded are split in
+            # the same places in the encoding of the whole file. Skip them.
+            yield from itertools.islice(self._decode_lines(encoding), yielded, None)
+
+    def _decode_lines(self, encoding):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        remainder = ''
+
+        for chunk in self.file.chunks():
+            lines = (remainder + decoder.decode(chunk)).splitlines(keepends=True)
+
+            # Hold back a partial line, or a carriage return that may be
+            # followed by a newline in the next chunk.
+            if lines and not lines[-1].endswith('\n'):
+                remainder = lines.pop()
+            else:
+                remainder = ''
+
+            yield from lines
+
+        remainder += decoder.decode(b'', final=True)
+
+        if remainder:
+            yield remainder
+
+    def trimmed_rows(self):
+        '''
+        Yield a tuple of REQUIRED_FIELDS for each row of the standardized
+        upload, excluding the header. Values are stripped of surrounding
+        whitespace, so the import can match them to existing entities
+        without trimming them in the database. Blank values are copied as
+        nulls.
+        '''
+        reader = csv.reader(self._decoded_lines())
+
+        # Discard header. Map positions using the downcased and underscored
+        # field names, so they will match with REQUIRED_FIELDS.
+        next(reader)
+
+        positions = [self.field_names.index(field) for field in self.REQUIRED_FIELDS]
+        width = max(positions) + 1
+        project = operator.itemgetter(*positions)
+
+        for row in reader:
+            # Skip blank lines, as DictReader did.
+            if not row:
+                continue
+
+            # Pad short rows, so missing values are copied as nulls.
+            if len(row) < width:
+                row += [''] * (width - len(row))
+
+            yield tuple(value.strip() for value in project(row))
+
+    def trimmed_file(self):
+        '''
+        Return a read-only, file-like object of REQUIRED_FIELDS from the
+        standardized upload, as CSV with a header, for passing directly to
+        cursor.copy_expert.
+        '''
+        return TrimmedCsvStream(self.REQUIRED_FIELDS, self.trimmed_rows())
+
     def trim_extra_fields(self):
         '''
         From standardized upload, grab REQUIRED_FIELDS and write them
         to a UTF-8 temp file for copying to the database.
+
+        The temp file is written to a new directory, so files with the same
+        name, e.g., from different directories of a batch, don't overwrite
+        each other, while keeping the name of the upload, which is the name
+        the standardized file is stored under. Remove the directory once the
+        file has been stored.
         '''
-        infile = self.file.open(mode='r')
-        lines = infile.read().decode(self.file_encoding).splitlines()
-        reader = csv.DictReader(lines)
+        outfile_name = os.path.join(tempfile.mkdtemp(), basename(self.file.name))
 
-        # Downcase and underscore field names, so they will match with
-        # REQUIRED_FIELDS.
-        reader.fieldnames = self.field_names
+        with open(outfile_name, 'w', encoding='utf-8', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(self.REQUIRED_FIELDS)
+            writer.writerows(self.trimmed_rows())
 
-        # Discard header.
-        next(reader)
+        return outfile_name
 
-        outfile_name = '/tmp/{}'.format(basename(self.file.name))
 
-        with open(outfile_name, 'w', encoding='utf-8') as outfile:
-            writer = csv.DictWriter(outfile, fieldnames=self.REQUIRED_FIELDS)
-            writer.writeheader()
+class TrimmedCsvStream(object):
+    '''
+    File-like object that writes rows as CSV on demand, so they can be
+    streamed into COPY without being held in memory or written to disk.
+    '''
+    def __init__(self, header, rows):
+        self.rows = rows
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(header)
+        self.pending = self.buffer.getvalue()
 
-            for row in reader:
-                out_row = {field: row[field] for field in self.REQUIRED_FIELDS}
-                writer.writerow(out_row)
+    def _fill(self, size):
+        self.buffer.seek(0)
+        self.buffer.truncate()
 
-        infile.close()
+        for row in self.rows:
+            self.writer.writerow(row)
 
-        return outfile_name
+            if self.buffer.tell() >= size:
+                break
+
+        return self.buffer.getvalue()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = COPY_READ_SIZE
+
+        if len(self.pending) < size:
+            self.pending += self._fill(size - len(self.pending))
+
+        data, self.pending = self.pending[:size], self.pending[size:]
+
+        return data
@@ -0,0 +1,199 @@
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Max, Q
+
+
+def imported_files():
+    '''
+    Return the standardized files whose salaries have been imported, i.e.,
+    that the import task has completed, or that have an insert_salary
+    checkpoint, for files imported with the import_data command, which does
+    not move them through the review steps.
+    '''
+    from data_import.models import StandardizedFile
+
+    imported = Q(status=StandardizedFile.State.COMPLETE) | Q(checkpoints__stage='insert_salary')
+
+    return StandardizedFile.objects.filter(imported)
+
+
+class VersionToken(object):
+    '''
+    Version token, stored in the default cache, for invalidating values
+    memoized in each process. Tokens are random, rather than counters, so a
+    cleared cache cannot repeat a version a process has already seen.
+
+    get() returns None if the cache does not retain the token, e.g., when
+    caching is turned off with the dummy backend.
+    '''
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+
+    @property
+    def cache(self):
+        return caches['default']
+
+    def get(self):
+        version = self.cache.get(self.cache_key)
+
+        if version is None:
+            self.cache.add(self.cache_key, uuid.uuid4().hex, None)
+            version = self.cache.get(self.cache_key)
+
+        return version
+
+    def bump(self):
+        self.cache.set(self.cache_key, uuid.uuid4().hex, None)
+
+
+class DataVintageRegistry(object):
+    '''
+    In-process memo of facts about the uploaded data, e.g., the available
+    reporting years, that only change when an import completes.
+
+    Memoized values are keyed by a version token stored in the default cache,
+    so they are shared by all web workers. Completing an import bumps the
+    token, and each process recomputes its values the next time they are
+    requested. If the cache does not retain the token, e.g., when caching is
+    turned off with the dummy backend, values are computed on every request.
+    '''
+    def __init__(self):
+        self.token = VersionToken('data_vintage_version')
+        self._lock = threading.Lock()
+        self._version = None
+        self._values = {}
+
+    def version(self):
+        return self.token.get()
+
+    def bump(self):
+        self.token.bump()
+
+    def get(self, name, compute):
+        version = self.version()
+
+        if version is None:
+            return compute()
+
+        with self._lock:
+            if version != self._version:
+                self._values = {}
+                self._version = version
+
+            try:
+                return self._values[name]
+            except KeyError:
+                pass
+
+        value = compute()
+
+        with self._lock:
+            if version == self._version:
+                self._values[name] = value
+
+        return value
+
+    def data_years(self):
+        '''
+        Return a list of reporting years with uploaded data, most recent
+        first.
+        '''
+        from data_import.models import StandardizedFile
+
+        def compute():
+            return list(StandardizedFile.objects.distinct('reporting_year')
+                                                .order_by('-reporting_year')
+                                                .values_list('reporting_year', flat=True))
+
+        return self.get('data_years', compute)
+
+    def latest_year(self):
+        '''
+        Return the most recent reporting year with uploaded data.
+        '''
+        data_years = self.data_years()
+        return data_years[0] if data_years else None
+
+    def latest_standardized_file(self, year):
+        '''
+        Return the ID of the most recent standardized file uploaded for the
+        given year, or None if there is no data for the year.
+        '''
+        from data_import.models import StandardizedFile
+
+        def compute():
+            return StandardizedFile.objects.filter(reporting_year=year)\
+                                           .aggregate(Max('id'))['id__max']
+
+        return self.get('latest_standardized_file.{}'.format(year), compute)
+
+    def latest_imported_file(self, year):
+        '''
+        Return the ID of the most recent standardized file for the given year
+        whose salaries have been imported, per imported_files, or None if
+        there is none.
+        '''
+        def compute():
+            return imported_files().filter(reporting_year=year)\
+                                   .aggregate(Max('id'))['id__max']
+
+        return self.get('latest_imported_file.{}'.format(year), compute)
+
+    def data_version(self):
+        '''
+        Return the ID of the most recent standardized file uploaded for any
+        year, or None if there is no data.
+        '''
+        from data_import.models import StandardizedFile
+
+        def compute():
+            return StandardizedFile.objects.aggregate(Max('id'))['id__max']
+
+        return self.get('data_version', compute)
+
+    def imported_data_version(self):
+        '''
+        Return the ID of the most recent standardized file imported for any
+        year, per latest_imported_file, or None if no data has been imported.
+        '''
+        def compute():
+            return imported_files().aggregate(Max('id'))['id__max']
+
+        return self.get('imported_data_version', compute)
+
+    def unit_versions(self):
+        '''
+        Return a dictionary of the slugs of units and departments to the ID of
+        the most recent standardized file that changed the salaries of the
+        unit or, for departments, their parent unit. Employers that no import
+        has recorded changes to are left out.
+        '''
+        def compute():
+            query = '''
+                WITH unit_versions AS (
+                  SELECT
+                    entity_id AS unit_id,
+                    MAX(standardized_file_id) AS version
+                  FROM data_import_changedentity
+                  WHERE entity_type = 'unit'
+                  GROUP BY entity_id
+                )
+                SELECT
+                  employer.slug,
+                  unit_versions.version
+                FROM payroll_employer AS employer
+                JOIN unit_versions
+                ON COALESCE(employer.parent_id, employer.id) = unit_versions.unit_id
+            '''
+
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                return dict(cursor)
+
+        return self.get('unit_versions', compute)
+
+
+data_vintage = DataVintageRegistry()
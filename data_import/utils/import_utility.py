@@ -1,11 +1,31 @@
-from django.db import connection
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 
+from data_import.utils.run_log import log_stage
 from data_import.utils.table_names import TableNamesMixin
 from data_import.utils.queues import ChildEmployerQueue, ParentEmployerQueue, \
     RespondingAgencyQueue
 
 
 class ImportUtility(TableNamesMixin):
+    # Stages run by populate_models_from_raw_data, in order.
+    POPULATE_STAGES = [
+        'insert_responding_agency',
+        'insert_parent_employer',
+        'insert_child_employer',
+    ]
+
+    # Stages run once employers have been reviewed and inserted, in order.
+    SALARY_STAGES = [
+        'insert_position',
+        'select_raw_person',
+        'select_raw_job',
+        'insert_person',
+        'insert_job',
+        'insert_salary',
+        'record_changed_entities',
+    ]
+
     def __init__(self, s_file_id):
         super().__init__(s_file_id)
 
@@ -18,29 +38,59 @@ class ImportUtility(TableNamesMixin):
         self.vintage = s_file.upload.id  # Standard file upload
 
     def populate_models_from_raw_data(self):
-        self.insert_responding_agency()
+        self.run_stages(self.POPULATE_STAGES + self.SALARY_STAGES)
+
+    def completed_stages(self):
+        from data_import.models import ImportCheckpoint
+
+        checkpoints = ImportCheckpoint.objects.filter(standardized_file_id=self.s_file_id)
+
+        return set(checkpoints.values_list('stage', flat=True))
+
+    def run_stage(self, stage, method=None, atomic=True):
+        '''
+        Run the given stage of the import, i.e., the method of this class
+        with the same name, or the given method, unless it has already been
+        completed. Return True if the stage was run.
+
+        By default, the stage and its checkpoint are committed in a single
+        transaction, so an interrupted stage leaves nothing behind, and the
+        import can be resumed by running the stage again. Stages with side
+        effects outside the database, e.g., indexing, should pass atomic=False
+        and be safe to repeat.
+        '''
+        from data_import.models import ImportCheckpoint
 
-        self.insert_parent_employer()
-        self.insert_child_employer()
+        if stage in self.completed_stages():
+            return False
 
-        self.insert_position()
+        method = method or getattr(self, stage)
 
-        self.select_raw_person()
-        self.select_raw_job()
+        if atomic:
+            with transaction.atomic():
+                method()
+                ImportCheckpoint.objects.create(standardized_file_id=self.s_file_id, stage=stage)
 
-        self.insert_person()
-        self.insert_job()
-        self.insert_salary()
+        else:
+            method()
+            ImportCheckpoint.objects.create(standardized_file_id=self.s_file_id, stage=stage)
 
+        return True
+
+    def run_stages(self, stages):
+        for stage in stages:
+            self.run_stage(stage)
+
+    @log_stage
     def select_unseen_responding_agency(self):
         q = RespondingAgencyQueue(self.s_file_id)
 
         select = '''
             SELECT
-              DISTINCT TRIM(raw.responding_agency)
+              DISTINCT raw.responding_agency
             FROM {raw_payroll} AS raw
             LEFT JOIN data_import_respondingagencyalias AS existing
-            ON TRIM(raw.responding_agency) = TRIM(existing.name)
+            ON raw.responding_agency = existing.name
             WHERE existing.name IS NULL
         '''.format(raw_payroll=self.raw_payroll_table)
 
@@ -50,27 +100,40 @@ class ImportUtility(TableNamesMixin):
             for agency in cursor:
                 q.add({'name': agency[0]})
 
+    @log_stage
     def insert_responding_agency(self):
         # Unseen names mapped to an existing responding agency will have been
         # added as aliases, i.e., they will no longer appear in this select.
-        from data_import.models import RespondingAgency, RespondingAgencyAlias
-
-        select = '''
+        # Names are distinct and unseen, so the new aliases satisfy
+        # RespondingAgencyAlias.clean by construction.
+        insert = '''
+            WITH unseen AS (
+              SELECT
+                DISTINCT responding_agency AS name
+              FROM {raw_payroll} AS raw
+              LEFT JOIN data_import_respondingagencyalias AS existing
+              ON raw.responding_agency = existing.name
+              WHERE existing.name IS NULL
+            ),
+            new_agencies AS (
+              INSERT INTO data_import_respondingagency (name)
+              SELECT name FROM unseen
+              RETURNING id, name
+            )
+            INSERT INTO data_import_respondingagencyalias (
+              name,
+              preferred,
+              responding_agency_id
+            )
             SELECT
-              DISTINCT TRIM(responding_agency)
-            FROM {raw_payroll} AS raw
-            LEFT JOIN data_import_respondingagencyalias AS existing
-            ON TRIM(raw.responding_agency) = TRIM(existing.name)
-            WHERE existing.name IS NULL
+              name,
+              FALSE,
+              id
+            FROM new_agencies
         '''.format(raw_payroll=self.raw_payroll_table)
 
         with connection.cursor() as cursor:
-            cursor.execute(select)
-
-            for row in cursor:
-                name, = row
-                agency = RespondingAgency.objects.create(name=name)
-                RespondingAgencyAlias.objects.create(name=name, responding_agency=agency)
+            cursor.execute(insert)
 
         self._link_responding_agency_with_standardized_file()
 
@@ -85,13 +148,14 @@ class ImportUtility(TableNamesMixin):
               agency.responding_agency_id
             FROM {raw_payroll} AS raw
             JOIN data_import_respondingagencyalias AS agency
-            ON TRIM(raw.responding_agency) = TRIM(agency.name)
+            ON raw.responding_agency = agency.name
         '''.format(s_file_id=self.s_file_id,
                    raw_payroll=self.raw_payroll_table)
 
         with connection.cursor() as cursor:
             cursor.execute(insert)
 
+    @log_stage
     def select_unseen_parent_employer(self):
         q = ParentEmployerQueue(self.s_file_id)
 
@@ -104,10 +168,10 @@ class ImportUtility(TableNamesMixin):
               WHERE employer.parent_id IS NULL
             )
             SELECT
-              DISTINCT TRIM(employer)
+              DISTINCT employer
             FROM {raw_payroll} AS raw
             LEFT JOIN parent_employers AS existing
-            ON TRIM(raw.employer) = TRIM(existing.name)
+            ON raw.employer = existing.name
             WHERE existing.name IS NULL
         '''.format(raw_payroll=self.raw_payroll_table)
 
@@ -117,33 +181,48 @@ class ImportUtility(TableNamesMixin):
             for employer in cursor:
                 q.add({'name': employer[0]})
 
+    @log_stage
     def insert_parent_employer(self):
-        from payroll.models import Employer, EmployerAlias
-
-        select_parents = '''
+        # Create unseen parent employers and their aliases in one statement.
+        # Names are distinct, and each alias belongs to a new employer, so
+        # the new aliases satisfy EmployerAlias.clean by construction.
+        # Slugs are generated by the employer_slug trigger.
+        insert = '''
             WITH parent_employers AS (
               SELECT alias.*
               FROM payroll_employeralias AS alias
               JOIN payroll_employer AS employer
               ON alias.employer_id = employer.id
               WHERE employer.parent_id IS NULL
+            ),
+            unseen AS (
+              SELECT
+                DISTINCT employer AS name
+              FROM {raw_payroll} AS raw
+              LEFT JOIN parent_employers AS existing
+              ON raw.employer = existing.name
+              WHERE existing.name IS NULL
+            ),
+            new_employers AS (
+              INSERT INTO payroll_employer (name, vintage_id)
+              SELECT name, {vintage} FROM unseen
+              RETURNING id, name
+            )
+            INSERT INTO payroll_employeralias (
+              name,
+              preferred,
+              employer_id
             )
             SELECT
-              DISTINCT TRIM(employer)
-            FROM {raw_payroll} AS raw
-            LEFT JOIN parent_employers AS existing
-            ON TRIM(raw.employer) = TRIM(existing.name)
-            WHERE existing.name IS NULL
+              name,
+              FALSE,
+              id
+            FROM new_employers
         '''.format(vintage=self.vintage,
                    raw_payroll=self.raw_payroll_table)
 
         with connection.cursor() as cursor:
-            cursor.execute(select_parents)
-
-            for row in cursor:
-                name, = row
-                employer = Employer.objects.create(name=name, vintage_id=self.vintage)
-                EmployerAlias.objects.create(name=name, employer=employer)
+            cursor.execute(insert)
 
         self._insert_unit_responding_agency()
         self._classify_parent_employers()
@@ -162,11 +241,11 @@ class ImportUtility(TableNamesMixin):
               {reporting_year}
             FROM {raw_payroll} AS raw
             JOIN payroll_employeralias AS alias
-              ON TRIM(raw.employer) = alias.name
+              ON raw.employer = alias.name
             JOIN payroll_employer AS emp
               ON alias.employer_id = emp.id
             JOIN data_import_respondingagency AS agency
-              ON TRIM(raw.responding_agency) = agency.name
+              ON raw.responding_agency = agency.name
             WHERE emp.parent_id IS NULL
             ON CONFLICT DO NOTHING
         '''.format(reporting_year=self.reporting_year,
@@ -296,6 +375,7 @@ class ImportUtility(TableNamesMixin):
         with connection.cursor() as cursor:
             cursor.execute(insert)
 
+    @log_stage
     def select_unseen_child_employer(self):
         '''
         If the parent is new as of this vintage, don't force the
@@ -318,19 +398,19 @@ class ImportUtility(TableNamesMixin):
               LEFT JOIN payroll_employeralias AS child_alias
               ON child.id = child_alias.employer_id
             )
-            SELECT DISTINCT ON (TRIM(employer), TRIM(department))
-              TRIM(employer),
-              TRIM(department)
+            SELECT DISTINCT ON (employer, department)
+              employer,
+              department
             FROM {raw_payroll} AS raw
             /* Join to filter records where new_parent is True.
             Parents will always exist, because we added them in
             the prior step. */
             LEFT JOIN child_employers AS parent
-            ON TRIM(raw.employer) = parent.parent_name
+            ON raw.employer = parent.parent_name
             /* Join to filter unseen records. */
             LEFT JOIN child_employers AS child
-            ON TRIM(raw.employer) = child.parent_name
-              AND TRIM(raw.department) = child.employer_name
+            ON raw.employer = child.parent_name
+              AND raw.department = child.employer_name
             WHERE raw.department IS NOT NULL
               AND parent.new_parent IS FALSE
               AND child.employer_name IS NULL
@@ -346,10 +426,9 @@ class ImportUtility(TableNamesMixin):
                     'parent': parent,
                 })
 
+    @log_stage
     def insert_child_employer(self):
-        from payroll.models import Employer, EmployerAlias
-
-        select = '''
+        unseen = '''
             WITH child_employers AS (
               SELECT
                 child_alias.name AS employer_name,
@@ -361,29 +440,79 @@ class ImportUtility(TableNamesMixin):
               ON parent.id = parent_alias.employer_id
               LEFT JOIN payroll_employeralias AS child_alias
               ON child.id = child_alias.employer_id
+            ),
+            unseen AS (
+              SELECT DISTINCT ON (employer, department)
+                employer AS unit_name,
+                department AS department_name
+              FROM {raw_payroll} AS raw
+              LEFT JOIN child_employers AS child
+              ON raw.employer = child.parent_name
+                AND raw.department = child.employer_name
+              WHERE raw.department IS NOT NULL
+                AND child.employer_name IS NULL
+            ),
+            unseen_with_unit AS (
+              SELECT
+                unseen.*,
+                unit.id AS unit_id,
+                COUNT(*) OVER (PARTITION BY unseen.unit_name, unseen.department_name) AS unit_count
+              FROM unseen
+              /* Only match aliases of units, so a department sharing the
+              name of a unit does not add a row without a unit. */
+              LEFT JOIN (
+                SELECT DISTINCT
+                  alias.name,
+                  employer.id
+                FROM payroll_employeralias AS alias
+                JOIN payroll_employer AS employer
+                ON alias.employer_id = employer.id
+                WHERE employer.parent_id IS NULL
+              ) AS unit
+              ON unseen.unit_name = unit.name
             )
-            SELECT DISTINCT ON (TRIM(employer), TRIM(department))
-              TRIM(employer),
-              TRIM(department)
-            FROM {raw_payroll} AS raw
-            LEFT JOIN child_employers AS child
-            ON TRIM(raw.employer) = child.parent_name
-              AND TRIM(raw.department) = child.employer_name
-            WHERE raw.department IS NOT NULL
-              AND child.employer_name IS NULL
-        '''.format(vintage=self.vintage,
-                   raw_payroll=self.raw_payroll_table)
+        '''.format(raw_payroll=self.raw_payroll_table)
+
+        # Each department must belong to exactly one unit. Check this for all
+        # unseen departments before inserting any of them.
+        validate = '''
+            {unseen}
+            SELECT DISTINCT unit_name
+            FROM unseen_with_unit
+            WHERE unit_id IS NULL OR unit_count > 1
+        '''.format(unseen=unseen)
+
+        # Create unseen departments and their aliases in one statement. As in
+        # insert_parent_employer, the new aliases are valid by construction.
+        insert = '''
+            {unseen},
+            new_employers AS (
+              INSERT INTO payroll_employer (name, parent_id, vintage_id)
+              SELECT department_name, unit_id, {vintage} FROM unseen_with_unit
+              RETURNING id, name
+            )
+            INSERT INTO payroll_employeralias (
+              name,
+              preferred,
+              employer_id
+            )
+            SELECT
+              name,
+              FALSE,
+              id
+            FROM new_employers
+        '''.format(unseen=unseen, vintage=self.vintage)
 
         with connection.cursor() as cursor:
-            cursor.execute(select)
+            cursor.execute(validate)
 
-            for row in cursor:
-                unit_name, department_name = row
+            unmatched_units = [unit_name for unit_name, in cursor]
 
-                unit = Employer.objects.get(aliases__name=unit_name, parent_id__isnull=True)
-                department = Employer.objects.create(name=department_name, parent=unit, vintage_id=self.vintage)
+            if unmatched_units:
+                message = 'Could not match departments to exactly one unit: {}'
+                raise ValidationError(message.format(', '.join(unmatched_units)))
 
-                EmployerAlias.objects.create(name=department_name, employer=department)
+            cursor.execute(insert)
 
         self._add_employer_universe()
 
@@ -425,108 +554,100 @@ class ImportUtility(TableNamesMixin):
         with connection.cursor() as cursor:
             cursor.execute(update)
 
+    def _create_employer_lookup(self):
+        '''
+        Create an indexed lookup table of all employer IDs by unit name and
+        department name, for matching raw records to employers. Units have
+        an empty department name, so records can be matched on equality of
+        both columns, regardless of whether they name a department.
+
+        The lookup is a temporary table, so it must be created on the same
+        connection as the queries that use it. Create it once per instance,
+        after all employers for the incoming data have been inserted.
+        '''
+        if getattr(self, '_employer_lookup_created', False):
+            return
+
+        create = '''
+            DROP TABLE IF EXISTS {employer_lookup};
+
+            CREATE TEMP TABLE {employer_lookup} AS
+              SELECT
+                employer.id AS employer_id,
+                CASE
+                  WHEN employer.parent_id IS NULL THEN employer_alias.name
+                  ELSE unit_alias.name
+                END AS unit_name,
+                CASE
+                  WHEN employer.parent_id IS NULL THEN ''
+                  ELSE employer_alias.name
+                END AS department_name
+              FROM payroll_employer AS employer
+              JOIN payroll_employeralias AS employer_alias
+                ON employer.id = employer_alias.employer_id
+              LEFT JOIN payroll_employeralias AS unit_alias
+                ON employer.parent_id = unit_alias.employer_id
+              WHERE employer.parent_id IS NULL
+                OR unit_alias.name IS NOT NULL;
+
+            CREATE INDEX ON {employer_lookup} (unit_name, department_name);
+            CREATE INDEX ON {employer_lookup} (employer_id);
+
+            ANALYZE {employer_lookup};
+        '''.format(employer_lookup=self.employer_lookup_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(create)
+
+        self._employer_lookup_created = True
+
+    @log_stage
     def insert_position(self):
+        self._create_employer_lookup()
+
         insert = '''
             INSERT INTO payroll_position (employer_id, title, vintage_id)
-              WITH employer_ids AS (
-                SELECT
-                  child.id AS employer_id,
-                  department_alias.name AS employer_name,
-                  unit_alias.name AS parent_name
-                FROM payroll_employer AS child
-                LEFT JOIN payroll_employer AS parent
-                  ON child.parent_id = parent.id
-                LEFT JOIN payroll_employeralias AS unit_alias
-                  ON parent.id = unit_alias.employer_id
-                LEFT JOIN payroll_employeralias AS department_alias
-                  ON child.id = department_alias.employer_id
-              )
               SELECT
                 employer_id,
-                COALESCE(TRIM(raw.title), 'Employee'),
+                COALESCE(raw.title, 'Employee'),
                 {vintage}
               FROM {raw_payroll} AS raw
-              JOIN employer_ids AS existing
-              ON (
-                TRIM(raw.department) = existing.employer_name
-                AND TRIM(raw.employer) = existing.parent_name
-                AND TRIM(raw.department) IS NOT NULL
-              ) OR (
-                TRIM(raw.employer) = existing.employer_name
-                AND TRIM(raw.department) IS NULL
-                AND existing.parent_name IS NULL
-              )
+              JOIN {employer_lookup} AS existing
+                ON raw.employer = existing.unit_name
+                AND COALESCE(raw.department, '') = existing.department_name
             ON CONFLICT DO NOTHING
         '''.format(vintage=self.vintage,
-                   raw_payroll=self.raw_payroll_table)
+                   raw_payroll=self.raw_payroll_table,
+                   employer_lookup=self.employer_lookup_table)
 
         with connection.cursor() as cursor:
             cursor.execute(insert)
 
+    @log_stage
     def select_raw_person(self):
+        self._create_employer_lookup()
+
         select = '''
-            WITH employer_ids AS (
-              /* Create a lookup table of all employer IDs, names, and parent
-              names, if applicable. (Units do not have parents.) */
-              SELECT
-                child.id AS employer_id,
-                department_alias.name AS employer_name,
-                unit_alias.name AS parent_name
-              FROM payroll_employer AS child
-              LEFT JOIN payroll_employer AS parent
-                ON child.parent_id = parent.id
-              LEFT JOIN payroll_employeralias AS unit_alias
-                ON parent.id = unit_alias.employer_id
-              LEFT JOIN payroll_employeralias AS department_alias
-                ON child.id = department_alias.employer_id
-            ), existing AS (
-              /* Create a view of existing people and their employers. Select
-              distinct on person ID, because a person can have more than one
-              salary, causing them to appear many times in this select. */
-              SELECT DISTINCT ON (per.id)
-                per.id AS e_person_id,
-                per.first_name AS e_first_name,
-                per.last_name AS e_last_name,
-                emp.employer_id AS e_employer_id,
-                emp.employer_name AS e_employer_name,
-                emp.parent_name AS e_employer_parent
-              FROM payroll_person AS per
-              JOIN payroll_job AS job
-                ON job.person_id = per.id
-              JOIN payroll_salary AS sal
-                ON sal.job_id = job.id
-              JOIN payroll_position AS pos
-                ON pos.id = job.position_id
-              JOIN employer_ids AS emp
-                ON pos.employer_id = emp.employer_id
-            ), unambiguous_matches AS (
+            WITH unambiguous_matches AS (
               /* If an incoming person is the only individual with their
               name in a given unit and department, use the existing person,
-              entity, rather than creating a new one. */
+              entity, rather than creating a new one. Only look up existing
+              people employed by the employers in the incoming data. */
               SELECT
-                ARRAY_AGG(record_id) AS record_id,
-                ARRAY_AGG(e_person_id) AS e_person_id
+                ARRAY_AGG(raw.record_id) AS record_id,
+                ARRAY_AGG(existing.person_id) AS e_person_id
               FROM {raw_payroll} AS raw
-              JOIN existing
-                ON (
-                  TRIM(raw.first_name) = existing.e_first_name
-                  AND TRIM(raw.last_name) = existing.e_last_name
-                )
-                AND (
-                  (
-                    TRIM(raw.department) = existing.e_employer_name
-                    AND TRIM(raw.employer) = existing.e_employer_parent
-                    AND TRIM(raw.department) IS NOT NULL
-                  ) OR (
-                    TRIM(raw.employer) = existing.e_employer_name
-                    AND TRIM(raw.department) IS NULL
-                    AND existing.e_employer_parent IS NULL
-                  )
-                )
+              JOIN {employer_lookup} AS emp
+                ON raw.employer = emp.unit_name
+                AND COALESCE(raw.department, '') = emp.department_name
+              JOIN payroll_personemployer AS existing
+                ON existing.employer_id = emp.employer_id
+                AND existing.first_name = raw.first_name
+                AND existing.last_name = raw.last_name
               GROUP BY (
-                existing.e_employer_id,
-                TRIM(raw.first_name),
-                TRIM(raw.last_name)
+                emp.employer_id,
+                raw.first_name,
+                raw.last_name
               )
               HAVING COUNT(*) = 1
             )
@@ -546,26 +667,20 @@ class ImportUtility(TableNamesMixin):
             ) AS existing
             USING (record_id)
         '''.format(raw_person=self.raw_person_table,
-                   raw_payroll=self.raw_payroll_table)
+                   raw_payroll=self.raw_payroll_table,
+                   employer_lookup=self.employer_lookup_table)
 
         with connection.cursor() as cursor:
+            # Drop the table left by an import that was interrupted before
+            # stages were checkpointed, so this stage can be repeated.
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(self.raw_person_table))
             cursor.execute(select)
 
+    @log_stage
     def select_raw_job(self):
+        self._create_employer_lookup()
+
         select = '''
-            WITH employer_ids AS (
-              SELECT
-                child.id AS employer_id,
-                department_alias.name AS employer_name,
-                unit_alias.name AS parent_name
-              FROM payroll_employer AS child
-              LEFT JOIN payroll_employer AS parent
-                ON child.parent_id = parent.id
-              LEFT JOIN payroll_employeralias AS unit_alias
-                ON parent.id = unit_alias.employer_id
-              LEFT JOIN payroll_employeralias AS department_alias
-                ON child.id = department_alias.employer_id
-            )
             SELECT
               raw_person.record_id,
               raw_person.person_id,
@@ -577,37 +692,34 @@ class ImportUtility(TableNamesMixin):
             FROM {raw_person} AS raw_person
             JOIN {raw_payroll} AS raw
               USING (record_id)
-            JOIN employer_ids AS emp
-              ON (
-                TRIM(raw.department) = emp.employer_name
-                AND TRIM(raw.employer) = emp.parent_name
-                AND TRIM(raw.department) IS NOT NULL
-              ) OR (
-                TRIM(raw.employer) = emp.employer_name
-                AND TRIM(raw.department) IS NULL
-                AND emp.parent_name IS NULL
-              )
+            JOIN {employer_lookup} AS emp
+              ON raw.employer = emp.unit_name
+              AND COALESCE(raw.department, '') = emp.department_name
             JOIN payroll_position AS position
               ON position.employer_id = emp.employer_id
-              AND position.title = COALESCE(TRIM(raw.title), 'Employee')
+              AND position.title = COALESCE(raw.title, 'Employee')
             LEFT JOIN payroll_job AS job
               ON job.person_id = raw_person.person_id
               AND job.position_id = position.id
               AND job.start_date = NULLIF(TRIM(raw.date_started), '')::DATE
         '''.format(raw_job=self.raw_job_table,
                    raw_person=self.raw_person_table,
-                   raw_payroll=self.raw_payroll_table)
+                   raw_payroll=self.raw_payroll_table,
+                   employer_lookup=self.employer_lookup_table)
 
         with connection.cursor() as cursor:
+            # See select_raw_person.
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(self.raw_job_table))
             cursor.execute(select)
 
+    @log_stage
     def insert_person(self):
         insert = '''
             INSERT INTO payroll_person (id, first_name, last_name, vintage_id, noindex)
               SELECT
                 person_id,
-                TRIM(first_name),
-                TRIM(last_name),
+                first_name,
+                last_name,
                 {vintage},
                 FALSE
               FROM {raw_person}
@@ -618,6 +730,7 @@ class ImportUtility(TableNamesMixin):
         with connection.cursor() as cursor:
             cursor.execute(insert)
 
+    @log_stage
     def insert_job(self):
         insert = '''
             INSERT INTO payroll_job (id, person_id, position_id, start_date, vintage_id)
@@ -632,9 +745,33 @@ class ImportUtility(TableNamesMixin):
         '''.format(vintage=self.vintage,
                    raw_job=self.raw_job_table)
 
-        with connection.cursor() as cursor:
+        # Record the employer of each incoming person, so they can be matched
+        # by select_raw_person in future imports.
+        insert_person_employer = '''
+            INSERT INTO payroll_personemployer (
+              employer_id,
+              person_id,
+              first_name,
+              last_name
+            )
+              SELECT DISTINCT
+                position.employer_id,
+                person.id,
+                person.first_name,
+                person.last_name
+              FROM {raw_job} AS raw_job
+              JOIN payroll_position AS position
+                ON raw_job.position_id = position.id
+              JOIN payroll_person AS person
+                ON raw_job.person_id = person.id
+            ON CONFLICT DO NOTHING
+        '''.format(raw_job=self.raw_job_table)
+
+        with transaction.atomic(), connection.cursor() as cursor:
             cursor.execute(insert)
+            cursor.execute(insert_person_employer)
 
+    @log_stage
     def insert_salary(self):
         insert = '''
             INSERT INTO payroll_salary (job_id, amount, extra_pay, vintage_id)
@@ -652,3 +789,50 @@ class ImportUtility(TableNamesMixin):
 
         with connection.cursor() as cursor:
             cursor.execute(insert)
+
+    @log_stage
+    def record_changed_entities(self):
+        '''
+        Record the people, departments and units with salaries in this file,
+        so the search index can be updated for just those entities. Units are
+        recorded for their departments, too, since unit documents roll up the
+        headcount and expenditure of their departments.
+        '''
+        insert = '''
+            WITH salary_employers AS (
+              SELECT DISTINCT
+                job.person_id,
+                employer.id AS employer_id,
+                employer.parent_id
+              FROM payroll_salary AS salary
+              JOIN payroll_job AS job
+                ON salary.job_id = job.id
+              JOIN payroll_position AS position
+                ON job.position_id = position.id
+              JOIN payroll_employer AS employer
+                ON position.employer_id = employer.id
+              WHERE salary.vintage_id = {vintage}
+            )
+            INSERT INTO data_import_changedentity (
+              standardized_file_id,
+              entity_type,
+              entity_id
+            )
+              SELECT DISTINCT {s_file_id}, entity_type, entity_id
+              FROM (
+                SELECT 'person' AS entity_type, person_id AS entity_id
+                FROM salary_employers
+                UNION ALL
+                SELECT 'department', employer_id
+                FROM salary_employers
+                WHERE parent_id IS NOT NULL
+                UNION ALL
+                SELECT 'unit', COALESCE(parent_id, employer_id)
+                FROM salary_employers
+              ) AS changed
+            ON CONFLICT DO NOTHING
+        '''.format(vintage=self.vintage,
+                   s_file_id=self.s_file_id)
+
+        with connection.cursor() as cursor:
+            cursor.execute(insert)
@@ -0,0 +1,180 @@
+import datetime
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+
+
+_active_stages = threading.local()
+
+
+class QueryRecorder(object):
+    '''
+    Database execute wrapper that counts the rows affected by each statement
+    run during a stage, and, if requested, collects the output of EXPLAIN
+    (ANALYZE, BUFFERS) for each statement.
+
+    EXPLAIN ANALYZE executes the statement it explains, so each statement is
+    explained in a savepoint that is rolled back, before it is run for real.
+    This roughly doubles the runtime of an explained stage, so only turn it
+    on while investigating a slow import.
+    '''
+    def __init__(self, stage, explain=False):
+        self.stage = stage
+        self.explain = explain
+        self.plans = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Pass EXPLAIN statements through to the database untouched.
+        if getattr(_active_stages, 'explaining', False):
+            return execute(sql, params, many, context)
+
+        # Only explain statements in the innermost stage, so statements are
+        # explained once, and their plans are logged with the stage that
+        # ran them.
+        innermost = _active_stages.stack[-1] is self.stage
+
+        if self.explain and innermost and not many:
+            self.plans.append(self._explain(context['cursor'], sql, params))
+
+        result = execute(sql, params, many, context)
+
+        # rowcount is -1 for statements that do not affect rows.
+        rowcount = context['cursor'].rowcount
+
+        if rowcount is not None and rowcount >= 0:
+            self.stage.add_rows(rowcount)
+
+        return result
+
+    def _explain(self, cursor, sql, params):
+        _active_stages.explaining = True
+
+        try:
+            with transaction.atomic():
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) {}'.format(sql), params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                transaction.set_rollback(True)
+
+        except DatabaseError as e:
+            # E.g., for strings of more than one statement.
+            plan = 'Could not explain statement: {}'.format(e)
+
+        finally:
+            _active_stages.explaining = False
+
+        return '{}\n\n{}'.format(sql.strip(), plan)
+
+
+class RunLogStage(object):
+    '''
+    Record the wall time and rows affected by a stage of the import of a
+    standardized file in the run log. Stages may be nested, e.g., a task may
+    run several ImportUtility stages. Rows affected by nested stages count
+    toward the stages that contain them.
+
+    Set record_queries to count the rows affected by each statement run
+    during the stage. Otherwise, add rows with add_rows.
+    '''
+    def __init__(self, s_file_id, name, record_queries=True, explain=None):
+        self.s_file_id = s_file_id
+        self.name = name
+        self.row_count = None
+        self.parent = None
+
+        if explain is None:
+            explain = settings.IMPORT_EXPLAIN
+
+        if record_queries:
+            self.recorder = QueryRecorder(self, explain=explain)
+        else:
+            self.recorder = None
+
+    def add_rows(self, n):
+        self.row_count = (self.row_count or 0) + n
+
+    def start(self):
+        stack = getattr(_active_stages, 'stack', None)
+
+        if stack is None:
+            stack = _active_stages.stack = []
+
+        if stack:
+            self.parent = stack[-1]
+
+        stack.append(self)
+
+        if self.recorder:
+            connection.execute_wrappers.append(self.recorder)
+
+        self.started = timezone.now()
+        self._start_time = time.perf_counter()
+
+    def finish(self):
+        duration = datetime.timedelta(seconds=time.perf_counter() - self._start_time)
+
+        if self.recorder:
+            connection.execute_wrappers.remove(self.recorder)
+
+        _active_stages.stack.remove(self)
+
+        # Rows affected by this stage were already counted by the parent if
+        # the parent records its own queries.
+        if self.parent and self.row_count is not None and not self.parent.recorder:
+            self.parent.add_rows(self.row_count)
+
+        from data_import.models import ImportRunLog
+
+        # Don't count the log entry toward any containing stage.
+        wrappers = connection.execute_wrappers
+        connection.execute_wrappers = []
+
+        try:
+            ImportRunLog.objects.create(
+                standardized_file_id=self.s_file_id,
+                stage=self.name,
+                started=self.started,
+                duration=duration,
+                row_count=self.row_count,
+                explain='\n\n'.join(self.recorder.plans) if self.recorder else ''
+            )
+
+        finally:
+            connection.execute_wrappers = wrappers
+
+    def abandon(self):
+        '''
+        Stop tracking the stage without recording it, e.g., because it
+        failed.
+        '''
+        if self.recorder and self.recorder in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self.recorder)
+
+        if self in getattr(_active_stages, 'stack', []):
+            _active_stages.stack.remove(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abandon()
+        else:
+            self.finish()
+
+
+def log_stage(method):
+    '''
+    Record an ImportUtility method as a stage in the run log of its
+    standardized file.
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with RunLogStage(self.s_file_id, method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
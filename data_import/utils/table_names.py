@@ -3,3 +3,4 @@ class TableNamesMixin(object):
         self.raw_payroll_table = 'raw_payroll_{}'.format(s_file_id)
         self.raw_job_table = 'raw_job_{}'.format(s_file_id)
         self.raw_person_table = 'raw_person_{}'.format(s_file_id)
+        self.employer_lookup_table = 'employer_lookup_{}'.format(s_file_id)
@@ -9,6 +9,7 @@ from extra_settings.models import Setting
 
 from payroll.models import Employer, EmployerUniverse, EmployerTaxonomy, \
     Person, EmployerAlias
+from payroll.utils import employer_records
 
 
 class AdminEmployer(admin.ModelAdmin):
@@ -32,6 +33,8 @@ class AdminEmployer(admin.ModelAdmin):
                 alias.preferred = True
                 alias.save()
 
+        employer_records.bump()
+
         call_command('build_solr_index', employer=obj.id)
 
 
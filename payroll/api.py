@@ -1,5 +1,4 @@
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
@@ -7,37 +6,64 @@ from rest_framework.response import Response
 
 from payroll.models import Unit, Department, Person
 from payroll import serializers
+from payroll.utils import SingleFlight, cache_key_prefix, vintage_cache_page
+
+
+# Coalesce concurrent computations of the same response, e.g., when a
+# popular page expires from the cache.
+single_flight = SingleFlight(cache='api')
+
+
+def single_flight_key(request, scope='year'):
+    # Responses depend on the data_year parameter, so include the query
+    # string.
+    return '{0}.{1}'.format(cache_key_prefix(request, scope, {}), request.get_full_path())
 
 
 class IndexViewSet(viewsets.ViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = serializers.IndexSerializer
 
-    @method_decorator(cache_page(60 * 60 * 72, cache='api'))
+    @method_decorator(vintage_cache_page(60 * 60 * 72, 'year', cache='api'))
     def list(self, request):
         try:
             data_year = request.query_params['data_year']
         except KeyError:
             return Response({})
         else:
-            serializer = serializers.IndexSerializer(instance=data_year)
-            return Response(serializer.data)
+            def compute():
+                serializer = serializers.IndexSerializer(instance=data_year)
+                return serializer.data
+
+            return Response(single_flight.do(single_flight_key(request), compute))
 
 
 class ReadOnlyModelViewSetWithDataYear(viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     lookup_field = 'slug'
 
-    @method_decorator(cache_page(60 * 60 * 72, cache='api'))
+    # Scope of the version of the data responses are built from. See
+    # cache_key_prefix.
+    cache_scope = 'year'
+
+    @method_decorator(vintage_cache_page(60 * 60 * 72, 'year', cache='api'))
     def retrieve(self, request, slug=None):
+        return self.data_year_response(request)
+
+    def data_year_response(self, request):
         try:
             data_year = request.query_params['data_year']
         except KeyError:
             return Response({})
         else:
-            serializer = self.serializer_class(instance=self.get_object(),
-                                               context={'data_year': data_year})
-            return Response(serializer.data)
+            def compute():
+                serializer = self.serializer_class(instance=self.get_object(),
+                                                   context={'data_year': data_year})
+                return serializer.data
+
+            key = single_flight_key(request, scope=self.cache_scope)
+
+            return Response(single_flight.do(key, compute))
 
 
 class UnitViewSet(ReadOnlyModelViewSetWithDataYear):
@@ -53,3 +79,11 @@ class DepartmentViewSet(ReadOnlyModelViewSetWithDataYear):
 class PersonViewSet(ReadOnlyModelViewSetWithDataYear):
     serializer_class = serializers.PersonSerializer
     queryset = Person.objects.all()
+
+    # Person responses include salaries from every year, so an import for
+    # any year may change them.
+    cache_scope = 'data'
+
+    @method_decorator(vintage_cache_page(60 * 60 * 72, 'data', cache='api'))
+    def retrieve(self, request, slug=None):
+        return self.data_year_response(request)
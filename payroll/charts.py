@@ -27,6 +27,41 @@ class ChartHelperMixin(object):
 
         values, edges = np.histogram(float_data, bins=bin_edges)
 
+        return self._format_salary_bins(values, edges, **kwargs)
+
+    def bin_precomputed_salary_data(self, salary_bins, max_value, **kwargs):
+        '''
+        Format salary counts that were binned in the database, e.g.,
+        EmployerYearStats.salary_bins, exactly as bin_salary_data would format
+        the underlying salaries.
+
+        :salary_bins is a list of DISTRIBUTION_BIN_NUM + 2 counts, as returned
+        by WIDTH_BUCKET(total_pay, 0, DISTRIBUTION_MAX, DISTRIBUTION_BIN_NUM),
+        where the first count is salaries below 0, which np.histogram ignores,
+        and the last count is salaries of at least DISTRIBUTION_MAX.
+        :max_value is the highest salary in the binned data.
+        '''
+        bin_size = DISTRIBUTION_MAX / DISTRIBUTION_BIN_NUM
+
+        bin_edges = [i * bin_size for i in range(DISTRIBUTION_BIN_NUM + 1)]
+
+        values = list(salary_bins[1:DISTRIBUTION_BIN_NUM + 1])
+        overflow = salary_bins[DISTRIBUTION_BIN_NUM + 1]
+
+        if max_value > bin_edges[-1]:
+            # Mirror bin_salary_data, which adds a bin for salaries above
+            # DISTRIBUTION_MAX.
+            bin_edges.append(float(max_value))
+            values.append(overflow)
+
+        else:
+            # The last bin of np.histogram is closed, i.e., it includes
+            # salaries equal to DISTRIBUTION_MAX.
+            values[-1] += overflow
+
+        return self._format_salary_bins(values, bin_edges, **kwargs)
+
+    def _format_salary_bins(self, values, edges, **kwargs):
         salary_json = []
 
         for i, value in enumerate(values):
@@ -0,0 +1,343 @@
+import csv
+import gzip
+import io
+import os
+import queue
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from data_import.utils import data_vintage
+
+
+EXPORT_HEADERS = [
+    'name',
+    'unit',
+    'department',
+    'title',
+    'tenure',
+    'salary',
+    'other',
+]
+
+# Project exactly the columns of the export, formatted as Employer.__str__
+# and the previous, ORM-based export formatted them, so rows can be written
+# as they come off the cursor.
+SALARY_EXPORT_QUERY = '''
+    SELECT
+      CONCAT(person.first_name, ' ', person.last_name) AS name,
+      parent.name AS unit,
+      CASE
+        WHEN parent.id IS NOT NULL
+        AND POSITION(LOWER(parent.name) IN LOWER(employer.name)) = 0
+        THEN CONCAT(parent.name, ' ', employer.name)
+        ELSE employer.name
+      END AS department,
+      position.title,
+      TO_CHAR(job.start_date, 'MM/DD/YYYY') AS tenure,
+      salary.amount AS salary,
+      salary.extra_pay AS other
+    FROM payroll_salary AS salary
+    JOIN payroll_job AS job
+    ON salary.job_id = job.id
+    JOIN payroll_person AS person
+    ON job.person_id = person.id
+    JOIN payroll_position AS position
+    ON job.position_id = position.id
+    JOIN payroll_employer AS employer
+    ON position.employer_id = employer.id
+    LEFT JOIN payroll_employer AS parent
+    ON employer.parent_id = parent.id
+    JOIN data_import_upload AS upload
+    ON salary.vintage_id = upload.id
+    JOIN data_import_standardizedfile AS s_file
+    ON upload.id = s_file.upload_id
+    WHERE (employer.id = %(employer_id)s OR employer.parent_id = %(employer_id)s)
+'''
+
+# Pre-generated exports are stored under a directory for the data vintage
+# they were built from, so an import that changes the data for a given year
+# orphans, rather than overwrites, the exports built before it.
+EXPORT_ROOT = 'exports'
+
+EXPORT_PATH_FMT = os.path.join(EXPORT_ROOT, '{year}', '{vintage}', '{slug}.{extension}')
+
+# Size, in bytes, of the chunks streamed from the COPY fast path.
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Number of chunks the COPY fast path may read ahead of the client.
+COPY_QUEUE_SIZE = 16
+
+
+def salary_export_query(employer, year=None):
+    '''
+    Return the query and parameters selecting export rows for the salaries
+    of the given employer and, if it is a unit, its departments.
+    '''
+    query = SALARY_EXPORT_QUERY
+    params = {'employer_id': employer.id}
+
+    if year:
+        query += 'AND s_file.reporting_year = %(year)s'
+        params['year'] = year
+
+    return query, params
+
+
+def stream_salary_export(employer, year=None):
+    '''
+    Yield the salary export for the given employer and year as chunks of CSV,
+    without holding more than a fixed number of rows in memory.
+    '''
+    query, params = salary_export_query(employer, year=year)
+
+    if settings.DOWNLOAD_USE_COPY:
+        return _copy_chunks(query, params)
+
+    return _cursor_chunks(query, params)
+
+
+def _cursor_chunks(query, params):
+    '''
+    Fetch rows from a named, server-side cursor in batches of
+    DOWNLOAD_FETCH_SIZE, and yield each batch as a chunk of CSV.
+
+    Outside a transaction, Django declares named cursors WITH HOLD, and
+    Postgres materializes the whole result when the implicit transaction
+    commits, so fetch rows inside one.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_HEADERS)
+    yield buffer.getvalue()
+
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(query, params)
+
+        while True:
+            rows = cursor.fetchmany(settings.DOWNLOAD_FETCH_SIZE)
+
+            if not rows:
+                break
+
+            buffer.seek(0)
+            buffer.truncate()
+
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    '''
+    File-like object that collects COPY output into chunks of roughly
+    COPY_CHUNK_SIZE bytes and hands them to the consuming thread.
+    '''
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def put(self, item):
+        # Give up, rather than block forever, if the client goes away while
+        # the queue is full.
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+            except queue.Full:
+                continue
+            else:
+                return
+
+        raise CopyCancelled
+
+    def write(self, data):
+        self.buffer.extend(data)
+
+        if len(self.buffer) >= COPY_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def _copy_chunks(query, params):
+    '''
+    Stream the output of COPY ... TO STDOUT for the given query. psycopg2
+    only copies into a file-like object, so run the COPY in a worker thread,
+    with its own database connection, and read its output from a bounded
+    queue.
+    '''
+    chunks = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+    cancelled = threading.Event()
+    done = object()
+
+    def copy():
+        writer = _QueueWriter(chunks, cancelled)
+
+        try:
+            with connection.cursor() as cursor:
+                select = cursor.mogrify(query, params).decode('utf-8')
+                cursor.copy_expert('COPY ({}) TO STDOUT WITH CSV HEADER'.format(select), writer)
+
+            writer.flush()
+            writer.put(done)
+
+        except CopyCancelled:
+            pass
+
+        except Exception as e:
+            try:
+                writer.put(e)
+            except CopyCancelled:
+                pass
+
+        finally:
+            connection.close()
+
+    worker = threading.Thread(target=copy, daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+
+            if chunk is done:
+                break
+
+            elif isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+
+    finally:
+        cancelled.set()
+
+
+def export_vintage(year):
+    '''
+    Return an identifier for the version of the data for the given year, i.e.,
+    the ID of the most recent standardized file imported for that year, or
+    None if no data has been imported for the year. Files still being
+    imported are left out, so exports built from the data before them are
+    served until the import completes.
+    '''
+    return data_vintage.latest_imported_file(year)
+
+
+def export_path(employer, year, vintage, extension='csv.gz'):
+    return EXPORT_PATH_FMT.format(year=year,
+                                  vintage=vintage,
+                                  slug=employer.slug,
+                                  extension=extension)
+
+
+def stored_salary_export(employer, year):
+    '''
+    Return the path to the gzipped salary export for the given employer and
+    year in default storage, if one has been built from the current data.
+    Otherwise, return None.
+    '''
+    vintage = export_vintage(year)
+
+    if vintage:
+        path = export_path(employer, year, vintage)
+
+        if default_storage.exists(path):
+            return path
+
+
+def _save(path, f):
+    f.seek(0)
+
+    if default_storage.exists(path):
+        default_storage.delete(path)
+
+    return default_storage.save(path, File(f))
+
+
+def write_salary_export(employer, year, vintage):
+    '''
+    Write a gzipped CSV of the salary export for the given employer and year
+    to default storage, and return its path.
+    '''
+    query, params = salary_export_query(employer, year=year)
+
+    with tempfile.TemporaryFile() as f:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gzipped:
+            for chunk in _cursor_chunks(query, params):
+                gzipped.write(chunk.encode('utf-8'))
+
+        return _save(export_path(employer, year, vintage), f)
+
+
+def write_salary_parquet(employer, year, vintage):
+    '''
+    Write a Parquet file of the salary export for the given employer and year
+    to default storage, and return its path. Requires pyarrow, which is not
+    installed by default.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('name', pa.string()),
+        ('unit', pa.string()),
+        ('department', pa.string()),
+        ('title', pa.string()),
+        ('tenure', pa.string()),
+        ('salary', pa.decimal128(10, 2)),
+        ('other', pa.decimal128(10, 2)),
+    ])
+
+    query, params = salary_export_query(employer, year=year)
+
+    with tempfile.TemporaryFile() as f:
+        # Read rows in a transaction, per _cursor_chunks.
+        with pq.ParquetWriter(f, schema) as writer, transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(query, params)
+
+            while True:
+                rows = cursor.fetchmany(settings.DOWNLOAD_FETCH_SIZE)
+
+                if not rows:
+                    break
+
+                columns = dict(zip(EXPORT_HEADERS, zip(*rows)))
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+        return _save(export_path(employer, year, vintage, extension='parquet'), f)
+
+
+def delete_stale_exports(year, vintage):
+    '''
+    Delete exports for the given year built from data older than the given
+    vintage.
+    '''
+    year_root = os.path.join(EXPORT_ROOT, str(year))
+
+    if not default_storage.exists(year_root):
+        return
+
+    vintages, _ = default_storage.listdir(year_root)
+
+    for stale_vintage in vintages:
+        if stale_vintage == str(vintage):
+            continue
+
+        vintage_root = os.path.join(year_root, stale_vintage)
+
+        _, filenames = default_storage.listdir(vintage_root)
+
+        for filename in filenames:
+            default_storage.delete(os.path.join(vintage_root, filename))
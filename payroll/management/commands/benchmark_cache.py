@@ -0,0 +1,135 @@
+import json
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache.backends.db import DatabaseCache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+
+from bga_database.cache import TieredCache
+
+
+BENCHMARK_TABLE = 'benchmark_cache'
+
+
+class QueryCounter(object):
+    '''
+    Database execute wrapper that counts the statements run.
+    '''
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Compare the hit latency and database load of the tiered cache with the database cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--location',
+            default=settings.REDIS_URL,
+            help='URL of the Redis database to benchmark. Defaults to REDIS_URL',
+        )
+        parser.add_argument(
+            '--keys',
+            type=int,
+            default=100,
+            help='Number of responses to cache',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=64 * 1024,
+            help='Approximate size of each response, in bytes',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=10,
+            help='Number of times to get each response',
+        )
+
+    def handle(self, *args, **options):
+        call_command('createcachetable', BENCHMARK_TABLE, verbosity=0)
+
+        backends = [
+            ('Database', DatabaseCache(BENCHMARK_TABLE, {
+                'KEY_PREFIX': 'benchmark',
+                'OPTIONS': {'MAX_ENTRIES': options['keys'] * 2},
+            })),
+            ('Redis', TieredCache(options['location'], {
+                'KEY_PREFIX': 'benchmark_redis',
+                'OPTIONS': {'LOCAL_MAX_ENTRIES': 0},
+            })),
+            ('Tiered', TieredCache(options['location'], {
+                'KEY_PREFIX': 'benchmark_tiered',
+                'OPTIONS': {'LOCAL_MAX_ENTRIES': options['keys']},
+            })),
+        ]
+
+        responses = [self._response(options['size']) for _ in range(options['keys'])]
+
+        try:
+            for label, cache in backends:
+                cache.clear()
+
+                for i, response in enumerate(responses):
+                    cache.set('response.{}'.format(i), response, 60 * 60)
+
+                counter = QueryCounter()
+                timings = []
+
+                with connection.execute_wrapper(counter):
+                    for _ in range(options['runs']):
+                        for i in range(len(responses)):
+                            start = time.perf_counter()
+                            cache.get('response.{}'.format(i))
+                            timings.append(time.perf_counter() - start)
+
+                timings.sort()
+
+                self.stdout.write(
+                    '{label}: {n} hits, {queries:.1f} queries per hit, '
+                    'mean {mean:.2f} ms, median {median:.2f} ms, 95th percentile {p95:.2f} ms'.format(
+                        label=label,
+                        n=len(timings),
+                        queries=counter.queries / len(timings),
+                        mean=statistics.mean(timings) * 1000,
+                        median=statistics.median(timings) * 1000,
+                        p95=timings[int(len(timings) * 0.95)] * 1000,
+                    )
+                )
+
+                cache.clear()
+
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(BENCHMARK_TABLE))
+
+    def _response(self, size):
+        '''
+        Return a JSON response of roughly the given size, shaped like the
+        salaries returned by the API.
+        '''
+        salaries = []
+        length = 0
+
+        while length < size:
+            salary = {
+                'name': 'Person {}'.format(random.randint(1, 100000)),
+                'position': random.choice(['Police Officer', 'Firefighter', 'Teacher', 'Clerk']),
+                'amount': random.randint(20000, 200000),
+                'extra_pay': random.randint(0, 20000),
+                'start_date': '20{:02d}-01-01'.format(random.randint(0, 19)),
+            }
+            salaries.append(salary)
+            length += len(json.dumps(salary))
+
+        return HttpResponse(json.dumps({'salaries': salaries}), content_type='application/json')
@@ -0,0 +1,90 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from payroll.search import PayrollSearchMixin
+
+
+class CountingSearcher(object):
+    '''
+    Wrap a pysolr.Solr instance to count requests to Solr.
+    '''
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.requests = 0
+
+    def search(self, *args, **kwargs):
+        self.requests += 1
+        return self.searcher.search(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of single-query search with sequential and concurrent per-entity type search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name',
+            action='append',
+            dest='names',
+            help='Search term to benchmark. May be given more than once',
+        )
+        parser.add_argument(
+            '--entity-types',
+            dest='entity_types',
+            default='unit,department,person',
+            help='Comma separated list of entity types to search',
+        )
+        parser.add_argument(
+            '--page',
+            type=int,
+            default=1,
+            help='Page of results to request',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=10,
+            help='Number of times to run each search',
+        )
+
+    def handle(self, *args, **options):
+        names = options['names'] or ['chicago', 'police', 'smith']
+
+        modes = [
+            ('Per entity type', False, False),
+            ('Per entity type, concurrent', False, True),
+            ('Single query', True, False),
+        ]
+
+        for label, single_query, concurrent_search in modes:
+            search = PayrollSearchMixin()
+            search.single_query = single_query
+            search.concurrent_search = concurrent_search
+            search.searcher = CountingSearcher(search.searcher)
+
+            timings = []
+
+            for name in names:
+                for _ in range(options['runs']):
+                    params = {
+                        'name': name,
+                        'entity_type': options['entity_types'],
+                        'page': str(options['page']),
+                    }
+
+                    start = time.perf_counter()
+                    search.search(params, pagesize=25)
+                    timings.append(time.perf_counter() - start)
+
+            self.stdout.write(
+                '{label}: {n} searches, {requests} Solr requests, '
+                'mean {mean:.1f} ms, median {median:.1f} ms, max {max:.1f} ms'.format(
+                    label=label,
+                    n=len(timings),
+                    requests=search.searcher.requests,
+                    mean=statistics.mean(timings) * 1000,
+                    median=statistics.median(timings) * 1000,
+                    max=max(timings) * 1000,
+                )
+            )
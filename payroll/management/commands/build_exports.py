@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data_import.models import StandardizedFile
+from payroll.exports import export_vintage, write_salary_export, \
+    write_salary_parquet, delete_stale_exports
+from payroll.models import EmployerYearStats
+
+
+class Command(BaseCommand):
+    help = 'Write salary exports for each employer and reporting year to default storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reporting_year',
+            type=int,
+            dest='reporting_year',
+            default=None,
+            help='Specify a specific reporting year to export',
+        )
+        parser.add_argument(
+            '--employer',
+            default=None,
+            help='ID of specific Employer instance to export',
+        )
+        parser.add_argument(
+            '--parquet',
+            action='store_true',
+            default=False,
+            help='Also write Parquet exports. Requires pyarrow',
+        )
+
+    def handle(self, *args, **options):
+        if options['parquet']:
+            try:
+                import pyarrow  # noqa
+            except ImportError:
+                raise CommandError('Install pyarrow to write Parquet exports')
+
+        if options['reporting_year']:
+            reporting_years = [options['reporting_year']]
+        else:
+            reporting_years = list(
+                StandardizedFile.objects.distinct('reporting_year')
+                                        .values_list('reporting_year', flat=True)
+            )
+
+        for year in reporting_years:
+            vintage = export_vintage(year)
+
+            if not vintage:
+                self.stdout.write('No imported data for {}'.format(year))
+                continue
+
+            # EmployerYearStats contains a row for every unit and department
+            # with salaries in the given year.
+            employer_stats = EmployerYearStats.objects.filter(reporting_year=year)\
+                                                      .select_related('employer')
+
+            if options['employer']:
+                employer_stats = employer_stats.filter(employer_id=options['employer'])
+
+            self.stdout.write('Writing exports for {}'.format(year))
+
+            export_count = 0
+
+            for stats in employer_stats.iterator():
+                write_salary_export(stats.employer, year, vintage)
+
+                if options['parquet']:
+                    write_salary_parquet(stats.employer, year, vintage)
+
+                export_count += 1
+
+            if not options['employer']:
+                delete_stale_exports(year, vintage)
+
+            self.stdout.write(
+                self.style.SUCCESS('Wrote {} exports for {}'.format(export_count, year))
+            )
@@ -1,15 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
 from django.core.management.base import BaseCommand
-from django.db.models import Sum, Q
+from django.db.models import Max, Min, Sum, Q
 from django.db.models.functions import Coalesce
-from django.db import connection
+from django.db import connection, transaction
 import pysolr
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 
-from data_import.models import StandardizedFile
+from data_import.models import ChangedEntity, StandardizedFile
 from payroll.models import Employer, Person, Salary
 
 
+class IndexProgress(object):
+    """
+    Thread-safe count of the documents added to the index for an entity
+    type, for reporting progress and throughput.
+    """
+
+    def __init__(self, stdout, entity_type):
+        self.stdout = stdout
+        self.entity_type = entity_type
+        self.count = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.count / self.elapsed if self.elapsed else 0
+
+    def add(self, n):
+        with self._lock:
+            self.count += n
+
+            self.stdout.write(
+                "Indexed {} {} documents ({:.0f} documents/s)...".format(
+                    self.count, self.entity_type, self.rate
+                )
+            )
+
+
 class Command(BaseCommand):
     help = "Populate the Solr index"
 
@@ -56,11 +93,40 @@ class Command(BaseCommand):
             "--s_file",
             dest="s_file_id",
             default=None,
-            help="Specify a specific standardized file to index",
+            help="Reindex only the units, departments and people changed by "
+            "the import of a specific standardized file",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of partitions to index concurrently",
+        )
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            default=4,
+            help="Number of ranges of person IDs to split each reporting year "
+            "into when indexing people",
         )
 
     def handle(self, *args, **options):
-        if options.get("reporting_year"):
+        # Mapping of entity type to the IDs of the entities to index, or
+        # None to index every entity with salaries in the reporting years.
+        self.entity_ids = None
+
+        if options.get("s_file_id"):
+            s_file = StandardizedFile.objects.get(id=options["s_file_id"])
+            self.reporting_years = [s_file.reporting_year]
+
+            self.entity_ids = {entity_type: [] for entity_type in ChangedEntity.ENTITY_TYPES}
+
+            for entity_type, entity_id in s_file.changed_entities.values_list(
+                "entity_type", "entity_id"
+            ):
+                self.entity_ids[entity_type].append(entity_id)
+
+        elif options.get("reporting_year"):
             self.reporting_years = [options["reporting_year"]]
         else:
             self.reporting_years = list(
@@ -80,12 +146,20 @@ class Command(BaseCommand):
         else:
             self.recreate = options["recreate"]
             self.chunksize = int(options["chunksize"])
+            self.workers = options["workers"]
+            self.partitions = options["partitions"]
+            self.searcher = self._make_searcher()
 
             entities = options["entity_types"].split(",")
 
             for entity in entities:
                 getattr(self, "index_{}".format(entity))()
 
+            # Documents are deleted and added without committing, so searches
+            # see the old documents until the whole index has been rebuilt.
+            self.stdout.write("Committing changes to the index")
+            self.searcher.commit()
+
     def _make_search_string(self, initial_params):
         search_fmt = "{initial_params} AND ({year_params})"
         year_params = " OR ".join(
@@ -93,126 +167,225 @@ class Command(BaseCommand):
         )
         return search_fmt.format(initial_params=initial_params, year_params=year_params)
 
-    def index_units(self):
-        if self.recreate:
-            message = "Dropping units from {} from index".format(
-                ", ".join(str(year) for year in self.reporting_years)
+    def _drop_documents(self, entity_type, label):
+        """
+        Drop the documents that are about to be reindexed: those for the
+        changed entities in targeted mode, or, with --recreate, all documents
+        of the entity type for the reporting years. Documents for changed
+        entities that no longer have salaries, e.g., people removed by an
+        amendment, are dropped and not added back.
+        """
+        if self.entity_ids is not None:
+            ids = [
+                "{}.{}.{}".format(entity_type, entity_id, year)
+                for entity_id in self.entity_ids[entity_type]
+                for year in self.reporting_years
+            ]
+
+            self.stdout.write("Dropping {} changed {} from index".format(len(ids), label))
+
+            for i in range(0, len(ids), self.chunksize):
+                self.searcher.delete(id=ids[i:i + self.chunksize], commit=False)
+
+        elif self.recreate:
+            message = "Dropping {} from {} from index".format(
+                label, ", ".join(str(year) for year in self.reporting_years)
             )
             self.stdout.write(message)
-            search_string = self._make_search_string("id:unit*")
-            self.searcher.delete(q=search_string)
-            self.stdout.write(self.style.SUCCESS("Units dropped from index"))
+            search_string = self._make_search_string("id:{}*".format(entity_type))
+            self.searcher.delete(q=search_string, commit=False)
+            self.stdout.write(self.style.SUCCESS("{} dropped from index".format(label.capitalize())))
 
-        self.stdout.write("Indexing units")
+    def _make_searcher(self):
+        """
+        Return a Solr client whose requests share a pool of keep-alive
+        connections, large enough for each indexing worker to hold one.
+        """
+        searcher = pysolr.Solr(settings.SOLR_URL)
 
-        sql = """
-        WITH unit_stats AS (
-            SELECT
-                e.id as employer_id,
-                e.name,
-                e.slug,
-                et.entity_type as taxonomy,
-                ep.population,
-                sf.reporting_year,
-                COUNT(s.id) as headcount,
-                SUM(COALESCE(s.amount, 0) + COALESCE(s.extra_pay, 0)) as expenditure
-            FROM payroll_employer e
-            LEFT JOIN payroll_employertaxonomy et ON e.taxonomy_id = et.id
-            LEFT JOIN payroll_employerpopulation ep ON e.id = ep.employer_id
-            LEFT JOIN payroll_position p ON (e.id = p.employer_id OR e.id = (
-                SELECT parent_id FROM payroll_employer WHERE id = p.employer_id
-            ))
-            LEFT JOIN payroll_job j ON p.id = j.position_id
-            LEFT JOIN payroll_salary s ON j.id = s.job_id
-            LEFT JOIN data_import_upload u ON s.vintage_id = u.id
-            LEFT JOIN data_import_standardizedfile sf ON u.id = sf.upload_id
-            WHERE e.parent_id IS NULL
-            AND sf.reporting_year = ANY(%s)
-            GROUP BY e.id, e.name, e.slug, et.entity_type, ep.population, sf.reporting_year
-            HAVING COUNT(s.id) > 0
-        )
-        SELECT
-            employer_id,
-            name,
-            slug,
-            taxonomy,
-            reporting_year,
-            expenditure,
-            headcount,
-            CASE
-                WHEN population >= 1000000 THEN 'Large'
-                WHEN population >= 50000 THEN 'Medium'
-                WHEN population >= 10000 THEN 'Small'
-                ELSE NULL
-            END as size_class
-        FROM unit_stats
-        ORDER BY employer_id, reporting_year
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+
+        session = searcher.get_session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return searcher
+
+    def _partitions(self, entity_type):
         """
+        Split indexing into partitions that can run concurrently: one per
+        reporting year and, for people, ranges of person IDs within each
+        year. Return a list of (year, ID range) tuples, where the ID range is
+        None if the partition covers every ID. In targeted mode, there are too
+        few people to be worth splitting.
+        """
+        id_ranges = [None]
 
-        documents = []
-        document_count = 0
-
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [self.reporting_years])
-
-            for row in cursor:
-                (
-                    employer_id,
-                    name,
-                    slug,
-                    taxonomy,
-                    year,
-                    expenditure,
-                    headcount,
-                    size_class,
-                ) = row
-
-                if headcount and expenditure:  # Only index units with actual data
-                    document = {
-                        "id": "unit.{}.{}".format(employer_id, year),
-                        "slug": slug,
-                        "name": name,
-                        "entity_type": "Employer",
-                        "year": year,
-                        "taxonomy_s": taxonomy or "",
-                        "size_class_s": size_class or "",
-                        "expenditure_d": float(expenditure),
-                        "headcount_i": headcount,
-                        "text": name,
-                    }
-
-                    documents.append(document)
+        if entity_type == "person" and self.partitions > 1 and self.entity_ids is None:
+            bounds = Person.objects.aggregate(Min("id"), Max("id"))
+            min_id, max_id = bounds["id__min"], bounds["id__max"]
+
+            if min_id is not None:
+                step = (max_id - min_id) // self.partitions + 1
+                id_ranges = [
+                    (start, start + step - 1)
+                    for start in range(min_id, max_id + 1, step)
+                ]
+
+        return [(year, id_range) for year in self.reporting_years for id_range in id_ranges]
+
+    def _filters(self, entity_type, column, id_range):
+        """
+        Return conditions restricting the given ID column to the changed
+        entities of the given type, in targeted mode, and to the given range
+        of IDs, and their parameters.
+        """
+        filters = []
+        params = []
+
+        if self.entity_ids is not None:
+            filters.append("AND {} = ANY(%s)".format(column))
+            params.append(self.entity_ids[entity_type])
+
+        if id_range:
+            filters.append("AND {} BETWEEN %s AND %s".format(column))
+            params.extend(id_range)
+
+        return "\n".join(filters), params
+
+    def _index(self, entity_type, label, sql, column, make_document):
+        """
+        Index the documents of the given type built from the rows of the
+        given query, partition by partition, with up to --workers partitions
+        at a time. Documents are added without committing; handle commits
+        once everything has been indexed.
+        """
+        self._drop_documents(entity_type, label)
+
+        self.stdout.write("Indexing {}".format(label))
+
+        progress = IndexProgress(self.stdout, entity_type)
+
+        def index_partition(partition):
+            year, id_range = partition
+            filters, params = self._filters(entity_type, column, id_range)
+
+            documents = []
+
+            # Stream rows from a named, server-side cursor, rather than
+            # fetching the whole partition into memory. Outside a
+            # transaction, the cursor is declared WITH HOLD, and Postgres
+            # materializes the whole partition when the implicit transaction
+            # commits, so read it inside one.
+            with transaction.atomic(), connection.chunked_cursor() as cursor:
+                cursor.execute(sql.format(filters=filters), [[year]] + params)
+
+                for row in cursor:
+                    document = make_document(row)
+
+                    if document:
+                        documents.append(document)
 
                     if len(documents) >= self.chunksize:
-                        self.searcher.add(documents)
-                        document_count += len(documents)
+                        self.searcher.add(documents, commit=False)
+                        progress.add(len(documents))
                         documents = []
-                        self.stdout.write(
-                            "Indexed {} unit documents...".format(document_count)
-                        )
 
-        if documents:
-            self.searcher.add(documents)
-            document_count += len(documents)
+            if documents:
+                self.searcher.add(documents, commit=False)
+                progress.add(len(documents))
+
+        def index_partition_in_thread(partition):
+            try:
+                index_partition(partition)
+            finally:
+                # Each thread opens its own database connection.
+                connection.close()
+
+        partitions = self._partitions(entity_type)
+
+        if self.workers > 1 and len(partitions) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # Consume the results to raise any exceptions.
+                list(executor.map(index_partition_in_thread, partitions))
+        else:
+            for partition in partitions:
+                index_partition(partition)
 
         self.stdout.write(
             self.style.SUCCESS(
-                "Added {} unit documents to the index".format(document_count)
+                "Added {} {} documents to the index in {:.1f} s ({:.0f} documents/s)".format(
+                    progress.count, entity_type, progress.elapsed, progress.rate
+                )
             )
         )
 
-    def index_departments(self):
-        if self.recreate:
-            message = "Dropping departments from {} from index".format(
-                ", ".join(str(year) for year in self.reporting_years)
-            )
-            self.stdout.write(message)
-            search_string = self._make_search_string("id:department*")
-            self.searcher.delete(q=search_string)
-            self.stdout.write(self.style.SUCCESS("Departments dropped from index"))
+    def index_units(self):
+        # Unit headcount and expenditure roll up the salaries of the unit and
+        # its departments. Read them from the precomputed statistics the unit
+        # pages use, which are refreshed by sync_pgviews at the end of each
+        # import, rather than aggregating every salary again. Units take
+        # their population from the most recent year of population data, as
+        # in Employer.get_population.
+        sql = """
+        SELECT
+            e.id as employer_id,
+            e.name,
+            e.slug,
+            et.entity_type as taxonomy,
+            et.chicago OR et.cook_or_collar as is_special,
+            ep.population,
+            stats.reporting_year,
+            stats.total_pay as expenditure,
+            stats.headcount
+        FROM payroll_employer_year_stats stats
+        JOIN payroll_employer e ON stats.employer_id = e.id
+        LEFT JOIN payroll_employertaxonomy et ON e.taxonomy_id = et.id
+        LEFT JOIN LATERAL (
+            SELECT population
+            FROM payroll_employerpopulation
+            WHERE employer_id = e.id
+            ORDER BY data_year DESC
+            LIMIT 1
+        ) ep ON TRUE
+        WHERE e.parent_id IS NULL
+        AND stats.reporting_year = ANY(%s)
+        {filters}
+        ORDER BY employer_id, reporting_year
+        """
 
-        self.stdout.write("Indexing departments")
+        def make_document(row):
+            (
+                employer_id,
+                name,
+                slug,
+                taxonomy,
+                is_special,
+                population,
+                year,
+                expenditure,
+                headcount,
+            ) = row
+
+            if headcount and expenditure:  # Only index units with actual data
+                size_class = Employer.classify_size(taxonomy, is_special, population)
+
+                return {
+                    "id": "unit.{}.{}".format(employer_id, year),
+                    "slug": slug,
+                    "name": name,
+                    "entity_type": "Employer",
+                    "year": year,
+                    "taxonomy_s": taxonomy or "",
+                    "size_class_s": size_class or "",
+                    "expenditure_d": float(expenditure),
+                    "headcount_i": headcount,
+                    "text": name,
+                }
+
+        self._index("unit", "units", sql, "e.id", make_document)
 
+    def index_departments(self):
         sql = """
         WITH dept_stats AS (
             SELECT
@@ -238,6 +411,7 @@ class Command(BaseCommand):
             LEFT JOIN data_import_standardizedfile sf ON u.id = sf.upload_id
             WHERE e.parent_id IS NOT NULL
             AND sf.reporting_year = ANY(%s)
+            {filters}
             GROUP BY e.id, e.name, e.slug, parent.slug, parent.name, eu.name, sf.reporting_year
             HAVING COUNT(s.id) > 0
         )
@@ -254,74 +428,41 @@ class Command(BaseCommand):
         ORDER BY employer_id, reporting_year
         """
 
-        documents = []
-        document_count = 0
-
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [self.reporting_years])
-
-            for row in cursor:
-                (
-                    employer_id,
-                    name,
-                    slug,
-                    parent_slug,
-                    universe,
-                    year,
-                    expenditure,
-                    headcount,
-                ) = row
-
-                if headcount and expenditure:
-                    display_name = str(name)
-
-                    document = {
-                        "id": "department.{}.{}".format(employer_id, year),
-                        "slug": slug,
-                        "name": display_name,
-                        "entity_type": "Employer",
-                        "year": year,
-                        "expenditure_d": float(expenditure),
-                        "headcount_i": headcount,
-                        "parent_s": parent_slug,
-                        "text": display_name,
-                    }
-
-                    if universe:
-                        document["universe_s"] = universe
-
-                    documents.append(document)
-
-                    if len(documents) >= self.chunksize:
-                        self.searcher.add(documents)
-                        document_count += len(documents)
-                        documents = []
-                        self.stdout.write(
-                            "Indexed {} department documents...".format(document_count)
-                        )
+        def make_document(row):
+            (
+                employer_id,
+                name,
+                slug,
+                parent_slug,
+                universe,
+                year,
+                expenditure,
+                headcount,
+            ) = row
+
+            if headcount and expenditure:
+                display_name = str(name)
 
-        if documents:
-            self.searcher.add(documents)
-            document_count += len(documents)
+                document = {
+                    "id": "department.{}.{}".format(employer_id, year),
+                    "slug": slug,
+                    "name": display_name,
+                    "entity_type": "Employer",
+                    "year": year,
+                    "expenditure_d": float(expenditure),
+                    "headcount_i": headcount,
+                    "parent_s": parent_slug,
+                    "text": display_name,
+                }
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                "Added {} department documents to the index".format(document_count)
-            )
-        )
+                if universe:
+                    document["universe_s"] = universe
 
-    def index_people(self):
-        if self.recreate:
-            message = "Dropping people from {} from index".format(
-                ", ".join(str(year) for year in self.reporting_years)
-            )
-            self.stdout.write(message)
-            search_string = self._make_search_string("id:person*")
-            self.searcher.delete(q=search_string)
-            self.stdout.write(self.style.SUCCESS("People dropped from index"))
+                return document
 
-        self.stdout.write("Indexing people")
+        self._index("department", "departments", sql, "e.id", make_document)
 
+    def index_people(self):
         sql = """
         WITH person_data AS (
             SELECT DISTINCT ON (p.id, sf.reporting_year)
@@ -344,6 +485,7 @@ class Command(BaseCommand):
             JOIN data_import_upload u ON s.vintage_id = u.id
             JOIN data_import_standardizedfile sf ON u.id = sf.upload_id
             WHERE sf.reporting_year = ANY(%s)
+            {filters}
             ORDER BY p.id, sf.reporting_year, s.id DESC  -- Get most recent salary if multiple
         )
         SELECT
@@ -361,66 +503,42 @@ class Command(BaseCommand):
         ORDER BY person_id, reporting_year
         """
 
-        documents = []
-        document_count = 0
-
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [self.reporting_years])
-
-            for row in cursor:
-                (
-                    person_id,
-                    slug,
-                    first_name,
-                    last_name,
-                    year,
-                    title,
-                    employer_slug,
-                    parent_slug,
-                    employer_name,
-                    total_salary,
-                ) = row
-
-                name = "{} {}".format(first_name or "", last_name or "").strip()
-                text = "{} {} {}".format(name, employer_name, title or "")
-
-                # Build employer slug list
-                employer_slugs = (
-                    [parent_slug, employer_slug] if parent_slug else [employer_slug]
-                )
-                employer_slugs = [s for s in employer_slugs if s]  # Remove None values
-
-                document = {
-                    "id": "person.{}.{}".format(person_id, year),
-                    "slug": slug,
-                    "name": name,
-                    "entity_type": "Person",
-                    "year": year,
-                    "title_s": title or "",
-                    "salary_d": float(total_salary),
-                    "employer_ss": employer_slugs,
-                    "text": text,
-                }
-
-                documents.append(document)
-
-                if len(documents) >= self.chunksize:
-                    self.searcher.add(documents)
-                    document_count += len(documents)
-                    documents = []
-                    self.stdout.write(
-                        "Indexed {} person documents...".format(document_count)
-                    )
+        def make_document(row):
+            (
+                person_id,
+                slug,
+                first_name,
+                last_name,
+                year,
+                title,
+                employer_slug,
+                parent_slug,
+                employer_name,
+                total_salary,
+            ) = row
+
+            name = "{} {}".format(first_name or "", last_name or "").strip()
+            text = "{} {} {}".format(name, employer_name, title or "")
+
+            # Build employer slug list
+            employer_slugs = (
+                [parent_slug, employer_slug] if parent_slug else [employer_slug]
+            )
+            employer_slugs = [s for s in employer_slugs if s]  # Remove None values
 
-        if documents:
-            self.searcher.add(documents)
-            document_count += len(documents)
+            return {
+                "id": "person.{}.{}".format(person_id, year),
+                "slug": slug,
+                "name": name,
+                "entity_type": "Person",
+                "year": year,
+                "title_s": title or "",
+                "salary_d": float(total_salary),
+                "employer_ss": employer_slugs,
+                "text": text,
+            }
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                "Added {} person documents to the index".format(document_count)
-            )
-        )
+        self._index("person", "people", sql, "p.id", make_document)
 
     def reindex_one(self, entity_type, entity_id):
         """Keep the existing reindex_one method for individual updates"""
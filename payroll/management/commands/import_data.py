@@ -1,3 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import shutil
 import sys
 
 from django.core.files import File
@@ -9,21 +13,56 @@ from django.db.models import Count
 import sqlalchemy as sa
 from sqlalchemy.engine.url import URL
 
-from data_import.models import Upload, StandardizedFile
+from data_import.models import ChangedEntity, Upload, StandardizedFile
 from data_import.tasks import copy_to_database
-from data_import.utils import ImportUtility, CsvMeta
+from data_import.utils import ImportUtility, CsvMeta, data_vintage
 
 from payroll.models import Unit, Job, Department, Person
 
 
+def validate_data_file(data_file):
+    '''
+    Check that the given data file is a CSV with the required fields, and
+    write its required fields to a temp file. Return the path to the temp
+    file. Defined at module level, so files can be validated in separate
+    processes.
+    '''
+    with open(data_file, 'rb') as df:
+        meta = CsvMeta(File(df))
+
+        if meta.file_type != 'csv':
+            raise CommandError('Data file must be a CSV')
+
+        missing_fields = ', '.join(set(CsvMeta.REQUIRED_FIELDS) - set(meta.field_names))
+
+        if missing_fields:
+            message = 'Standardized file missing fields: {}'.format(missing_fields)
+            raise CommandError(message)
+
+        return meta.trim_extra_fields()
+
+
 class Command(BaseCommand):
-    help = 'Load specified data file'
+    help = 'Load specified data file, or a batch of data files'
 
     def add_arguments(self, parser):
         parser.add_argument('--data_file',
                             help='Path to data file')
+        parser.add_argument('--data_dir',
+                            help='Path to a directory of data files to import '
+                                 'as a batch')
+        parser.add_argument('--manifest',
+                            help='Path to a file listing data files to import '
+                                 'as a batch, one per line')
         parser.add_argument('--reporting_year',
-                            help='Year to which data pertains')
+                            help='Year to which data pertains. Required for a '
+                                 'single data file. In batch mode, defaults to '
+                                 'the year in each file name')
+        parser.add_argument('--workers',
+                            help='Number of data files to validate at once in '
+                                 'batch mode',
+                            type=int,
+                            default=4)
         parser.add_argument('--amend',
                             help='Specify flag if incoming data should replace '
                                  'existing data for the given responding agency '
@@ -38,19 +77,26 @@ class Command(BaseCommand):
                                  'search index. Useful for uploading more than '
                                  'one file in a row',
                             action='store_true')
+        parser.add_argument('--no_exports',
+                            help='Specify flag if you do not want to rebuild the '
+                                 'salary exports. Useful for uploading more than '
+                                 'one file in a row',
+                            action='store_true')
+        parser.add_argument('--no_warm_cache',
+                            help='Specify flag if you do not want to warm the '
+                                 'page and API caches. Useful for uploading '
+                                 'more than one file in a row',
+                            action='store_true')
 
     def handle(self, *args, **options):
-        try:
-            assert all([options.get('data_file'), options.get('reporting_year')])
-        except AssertionError:
-            raise ValueError('Please provide a data file and reporting year')
+        self.data_files = self.get_data_files(options)
 
-        self.reporting_year = options['reporting_year']
         self.amend = options.get('amend', False)
         self.prompt_for_delete = not options.get('no_input', False)
         self.update_index = not options.get('no_index', False)
-
-        self.data_file = self.validate(options['data_file'])
+        self.update_exports = not options.get('no_exports', False)
+        self.warm_cache = not options.get('no_warm_cache', False)
+        self.workers = options['workers']
 
         django_conn = connection.get_connection_params()
 
@@ -66,42 +112,82 @@ class Command(BaseCommand):
 
         self.upload()
 
+    def get_data_files(self, options):
+        '''
+        Return a list of (data file, reporting year) tuples to import.
+        '''
+        reporting_year = options.get('reporting_year')
+
+        if options.get('data_file'):
+            if not reporting_year:
+                raise ValueError('Please provide a data file and reporting year')
+
+            return [(options['data_file'], reporting_year)]
+
+        if options.get('data_dir'):
+            data_dir = options['data_dir']
+            paths = [os.path.join(data_dir, f) for f in sorted(os.listdir(data_dir))
+                     if f.lower().endswith('.csv')]
+
+        elif options.get('manifest'):
+            with open(options['manifest']) as manifest:
+                paths = [line.strip() for line in manifest if line.strip()]
+
+        else:
+            raise ValueError('Please provide a data file, data directory or manifest')
+
+        if not paths:
+            raise CommandError('Found no data files to import')
+
+        data_files = []
+
+        for path in paths:
+            year = reporting_year or self.get_reporting_year(path)
+            data_files.append((path, year))
+
+        return data_files
+
+    def get_reporting_year(self, data_file):
+        # Follow the convention of the import targets in data/payroll.mk.
+        match = re.search(r'[0-9]{4}', os.path.basename(data_file))
+
+        if not match:
+            message = 'Could not find reporting year in file name "{}". ' \
+                      'Please provide a reporting year'.format(data_file)
+            raise CommandError(message)
+
+        return match.group(0)
+
     def prompt(self, prompt, bail=True):
         confirm = input('{} [y/n] '.format(prompt))
         if confirm.lower() != 'y' and bail:
             sys.exit()
 
-    def validate(self, data_file):
-        with open(data_file, 'rb') as df:
-            meta = CsvMeta(File(df))
-
-            if meta.file_type != 'csv':
-                raise CommandError('Data file must be a CSV')
-
-            missing_fields = ', '.join(set(CsvMeta.REQUIRED_FIELDS) - set(meta.field_names))
+    def validate(self, data_files):
+        '''
+        Validate data files concurrently, in separate processes, and return a
+        list of (validated file, reporting year) tuples.
+        '''
+        paths = [data_file for data_file, _ in data_files]
 
-            if missing_fields:
-                message = 'Standardized file missing fields: {}'.format(missing_fields)
-                raise CommandError(message)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            valid_file_names = list(executor.map(validate_data_file, paths))
 
-            valid_file_name = meta.trim_extra_fields()
+        for data_file in paths:
+            self.stdout.write('Validated {}'.format(data_file))
 
-        self.stdout.write('Validated {}'.format(data_file))
-
-        return valid_file_name
+        return [(valid_file_name, year) for valid_file_name, (_, year)
+                in zip(valid_file_names, data_files)]
 
     def get_units(self, s_file):
-        if not getattr(self, '_units', None):
-            with self.engine.begin() as conn:
-                select_distinct_units = '''
-                    SELECT DISTINCT employer FROM {raw_table}
-                '''.format(raw_table=s_file.raw_table_name)
-
-                result = conn.execute(select_distinct_units)
+        with self.engine.begin() as conn:
+            select_distinct_units = '''
+                SELECT DISTINCT employer FROM {raw_table}
+            '''.format(raw_table=s_file.raw_table_name)
 
-                self._units = [r[0] for r in result]
+            result = conn.execute(select_distinct_units)
 
-        return self._units
+            return [r[0] for r in result]
 
     def get_unit_from_slug_prompt(self):
         knows_slug = input('Do you know the unit slug? [y/n] ')
@@ -149,48 +235,79 @@ class Command(BaseCommand):
                     existing_units.append(unit)
 
             for unit in existing_units:
-                salaries = unit.get_salaries(year=self.reporting_year)
+                salaries = unit.get_salaries(year=s_file.reporting_year)
 
                 if self.prompt_for_delete:
                     self.prompt('Found {0} salaries for unit {1}.\n{2}\nDo you wish to delete? '.format(salaries.count(), unit.name, salaries))
 
+                # Record whose salaries are deleted, so they are updated in
+                # the search index after the import.
+                ChangedEntity.record_salaries(s_file.id, salaries)
+
                 summary = salaries.delete()
                 self.stdout.write('Salary deletion summary for unit {0}: {1}'.format(unit.name, summary))
 
     def upload(self):
-        upload = Upload.objects.create()
+        # Connections can't be shared with the validation processes.
+        connection.close()
+
+        validated_files = self.validate(self.data_files)
+
+        s_files = []
+
+        try:
+            for data_file, reporting_year in validated_files:
+                upload = Upload.objects.create()
+
+                with open(data_file, 'rb') as f:
+                    s_file = StandardizedFile.objects.create(
+                        standardized_file=File(f),
+                        reporting_year=reporting_year,
+                        upload=upload
+                    )
 
-        with open(self.data_file, 'rb') as data_file:
-            s_file = StandardizedFile.objects.create(
-                standardized_file=File(data_file),
-                reporting_year=self.reporting_year,
-                upload=upload
-            )
+                s_files.append(s_file)
 
-        # Call task directly so it blocks until the file has been copied
-        copy = copy_to_database.delay(s_file_id=s_file.id)
-        copy.get()
+        finally:
+            # Validated files are trimmed copies, each in its own temp
+            # directory. Once stored, they are no longer needed.
+            for data_file, _ in validated_files:
+                shutil.rmtree(os.path.dirname(data_file), ignore_errors=True)
 
-        self.stdout.write('Copied standardized file {} to database'.format(s_file.id))
-        self.stdout.write('Beginning import')
+        # Queue every copy before waiting on any of them, so the Celery
+        # workers copy files concurrently. Call the task directly, so it
+        # blocks until the files have been copied.
+        copies = [copy_to_database.delay(s_file_id=s_file.id) for s_file in s_files]
 
-        with transaction.atomic():
-            self.pre_import(s_file)
+        for s_file, copy in zip(s_files, copies):
+            copy.get()
 
-            import_util = ImportUtility(s_file.id)
-            import_util.populate_models_from_raw_data()
+            self.stdout.write('Copied standardized file {} to database'.format(s_file.id))
 
-            self.stdout.write('Populated models from standardized file {}'.format(s_file.id))
+        # Entity resolution matches incoming employers, positions and people
+        # against those already in the database, including those created from
+        # earlier files in the batch, so import files one at a time.
+        for s_file in s_files:
+            self.stdout.write('Beginning import of standardized file {}'.format(s_file.id))
+
+            with transaction.atomic():
+                self.pre_import(s_file)
+
+                import_util = ImportUtility(s_file.id)
+                import_util.populate_models_from_raw_data()
+
+                self.stdout.write('Populated models from standardized file {}'.format(s_file.id))
 
         # Do this after commit, so search index updates don't reference database
         # changes that have not yet been committed. The post import steps perform
         # cleanup and update derived data views (pg_views and the search index).
-        # They need not be atomic with the import updates.
-        self.post_import(s_file)
+        # They need not be atomic with the import updates. In batch mode, run
+        # them once for all files.
+        self.post_import(s_files)
 
         self.stdout.write('Import complete')
 
-    def post_import(self, s_file):
+    def post_import(self, s_files):
         if self.amend:
             jobs = Job.objects.filter(salaries__isnull=True)
 
@@ -218,14 +335,27 @@ class Command(BaseCommand):
 
         call_command('sync_pgviews')
 
-        self.stdout.write('Synced pg_views for standardized file {}'.format(s_file.id))
+        s_file_ids = ', '.join(str(s_file.id) for s_file in s_files)
+
+        self.stdout.write('Synced pg_views for standardized files {}'.format(s_file_ids))
+
+        data_vintage.bump()
 
         if self.update_index:
-            call_command(
-                'build_solr_index',
-                reporting_year=self.reporting_year,
-                recreate=True,
-                chunksize=25
-            )
-
-            self.stdout.write('Updated index for standardized_file {}'.format(s_file.id))
+            for s_file in s_files:
+                call_command('build_solr_index', s_file_id=s_file.id)
+
+                self.stdout.write('Updated index for standardized file {}'.format(s_file.id))
+
+        reporting_years = sorted(set(s_file.reporting_year for s_file in s_files))
+
+        for reporting_year in reporting_years:
+            if self.update_exports:
+                call_command('build_exports', reporting_year=reporting_year)
+
+                self.stdout.write('Updated exports for {}'.format(reporting_year))
+
+        if self.warm_cache:
+            call_command('warm_cache', data_year=reporting_years[-1])
+
+            self.stdout.write('Warmed caches for {}'.format(reporting_years[-1]))
@@ -0,0 +1,227 @@
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.functions import Coalesce
+from django.test import Client
+
+from data_import.utils import data_vintage
+from payroll.models import EmployerYearStats, Salary
+from payroll.sitemaps import UnitSitemap, DepartmentSitemap
+
+
+class WarmProgress(object):
+    '''
+    Thread-safe count of the URLs requested so far, for reporting progress
+    and the time remaining.
+    '''
+    def __init__(self, stdout, total, report_every=100):
+        self.stdout = stdout
+        self.total = total
+        self.report_every = report_every
+        self.count = 0
+        self.failures = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.count / self.elapsed if self.elapsed else 0
+
+    def add(self, url, failure=None):
+        with self._lock:
+            self.count += 1
+
+            if failure:
+                self.failures.append((url, failure))
+
+            if self.count % self.report_every == 0 or self.count == self.total:
+                remaining = (self.total - self.count) / self.rate if self.rate else 0
+
+                self.stdout.write(
+                    'Warmed {0} of {1} URLs ({2:.1f} URLs/s, {3:.0f}m {4:.0f}s remaining)'.format(
+                        self.count, self.total, self.rate, *divmod(remaining, 60)
+                    )
+                )
+
+
+class Command(BaseCommand):
+    help = 'Request entity pages and API responses, so they are cached before visitors request them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--data_year',
+            type=int,
+            dest='data_year',
+            default=None,
+            help='Reporting year of the API responses to warm. Defaults to the most recent year',
+        )
+        parser.add_argument(
+            '--people',
+            type=int,
+            default=1000,
+            help='Number of people to warm, most paid first',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of URLs to request at once',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            default=False,
+            help='Clear the caches before warming them. Cache keys include the '
+                 'version of the data, so this is not needed after an import',
+        )
+
+    def handle(self, *args, **options):
+        data_year = options['data_year'] or data_vintage.latest_year()
+
+        if not data_year:
+            raise CommandError('There is no data to warm')
+
+        if options['clear']:
+            for cache_label in settings.CACHES.keys():
+                caches[cache_label].clear()
+
+            self.stdout.write('Cleared caches')
+
+        urls = list(self.urls(data_year, options['people']))
+
+        self.stdout.write('Warming {0} URLs for {1} with {2} workers'.format(len(urls),
+                                                                             data_year,
+                                                                             options['workers']))
+
+        progress = self.warm(urls, options['workers'])
+
+        for url, failure in progress.failures:
+            self.stderr.write('Could not warm {0}: {1}'.format(url, failure))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Warmed {0} URLs in {1:.0f} s ({2:.1f} URLs/s), {3} failed'.format(
+                    progress.count, progress.elapsed, progress.rate, len(progress.failures)
+                )
+            )
+        )
+
+    def urls(self, data_year, n_people):
+        '''
+        Yield the paths to warm, in order of priority: the home page, then
+        units, departments and the most paid people, with the API responses
+        their pages request for the given year.
+        '''
+        api_fmt = '/{endpoint}/{slug}/?data_year={year}'
+
+        yield '/'
+        yield '/index/?data_year={}'.format(data_year)
+
+        # Only employers with salaries in the given year have an API response
+        # worth caching.
+        in_year = set(
+            EmployerYearStats.objects.filter(reporting_year=data_year)
+                                     .values_list('employer_id', flat=True)
+        )
+
+        sitemaps = (
+            ('unit', 'units', UnitSitemap()),
+            ('department', 'departments', DepartmentSitemap()),
+        )
+
+        for endpoint, api_endpoint, sitemap in sitemaps:
+            # Format paths as PayrollSitemap.location does, without looking up
+            # the parent of each employer to determine its endpoint.
+            for employer_id, slug in sitemap.items().values_list('id', 'slug').iterator():
+                yield '/{0}/{1}/'.format(endpoint, slug)
+
+                if employer_id in in_year:
+                    yield api_fmt.format(endpoint=api_endpoint, slug=slug, year=data_year)
+
+        salaries = Salary.objects.filter(vintage__standardized_file__reporting_year=data_year)\
+                                 .annotate(total_pay=Coalesce('amount', 0) + Coalesce('extra_pay', 0))\
+                                 .order_by('-total_pay')\
+                                 .values_list('job__person__slug', flat=True)
+
+        seen = set()
+
+        for slug in salaries.iterator():
+            if slug in seen:
+                continue
+
+            seen.add(slug)
+
+            yield '/person/{}/'.format(slug)
+            yield api_fmt.format(endpoint='people', slug=slug, year=data_year)
+
+            if len(seen) >= n_people:
+                break
+
+    def warm(self, urls, workers):
+        '''
+        Request the given paths from up to the given number of threads at
+        once. Requests go through the full middleware and URL configuration,
+        with the host and scheme of WARM_CACHE_URL, so responses are cached
+        under the same keys as requests from visitors.
+        '''
+        site = urlsplit(settings.WARM_CACHE_URL)
+        secure = site.scheme == 'https'
+
+        headers = {'HTTP_HOST': site.netloc}
+
+        # Behind a proxy, Django determines the scheme from a header.
+        if secure and settings.SECURE_PROXY_SSL_HEADER:
+            header, value = settings.SECURE_PROXY_SSL_HEADER
+            headers[header] = value
+
+        progress = WarmProgress(self.stdout, len(urls))
+        pending = queue.Queue()
+
+        for url in urls:
+            pending.put(url)
+
+        def work():
+            try:
+                while True:
+                    try:
+                        url = pending.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    # Use a new client for each request, so cookies set by
+                    # one response do not change the cache key of the next.
+                    client = Client(**headers)
+
+                    try:
+                        response = client.get(url, secure=secure)
+                    except Exception as e:
+                        progress.add(url, failure=repr(e))
+                    else:
+                        if response.status_code >= 400:
+                            progress.add(url, failure='status {}'.format(response.status_code))
+                        else:
+                            progress.add(url)
+
+            finally:
+                # Each thread opens its own database connection.
+                connection.close()
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return progress
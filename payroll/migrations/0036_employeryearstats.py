@@ -0,0 +1,34 @@
+# Generated by Django 2.2.9 on 2026-10-18 01:48
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0035_reflect_aliases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployerYearStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reporting_year', models.IntegerField()),
+                ('headcount', models.IntegerField(default=0)),
+                ('base_pay', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('extra_pay', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_pay', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('max_total_pay', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('median_base_pay', models.FloatField(null=True)),
+                ('median_extra_pay', models.FloatField(null=True)),
+                ('median_total_pay', models.FloatField(null=True)),
+                ('salary_bins', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'db_table': 'payroll_employer_year_stats',
+                'managed': False,
+            },
+        ),
+    ]
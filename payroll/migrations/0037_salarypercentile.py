@@ -0,0 +1,32 @@
+# Generated by Django 2.2.9 on 2026-10-18 01:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0036_employeryearstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalaryPercentile',
+            fields=[
+                ('salary', models.OneToOneField(
+                    on_delete=django.db.models.deletion.DO_NOTHING,
+                    primary_key=True,
+                    related_name='percentiles',
+                    serialize=False,
+                    to='payroll.Salary'
+                )),
+                ('employer_percentile', models.FloatField()),
+                ('like_employer_percentile', models.FloatField(null=True)),
+            ],
+            options={
+                'db_table': 'payroll_salary_percentile',
+                'managed': False,
+            },
+        ),
+    ]
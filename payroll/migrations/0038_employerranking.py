@@ -0,0 +1,28 @@
+# Generated by Django 2.2.9 on 2026-10-18 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0037_salarypercentile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployerRanking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reporting_year', models.IntegerField()),
+                ('median_salary', models.FloatField()),
+                ('total_budget', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('salary_percentile', models.FloatField()),
+                ('expenditure_percentile', models.FloatField()),
+            ],
+            options={
+                'db_table': 'payroll_employer_ranking',
+                'managed': False,
+            },
+        ),
+    ]
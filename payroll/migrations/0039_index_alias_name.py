@@ -0,0 +1,25 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0038_employerranking'),
+    ]
+
+    operations = [
+        # The import matches incoming data to aliases by exact name, so trim
+        # existing aliases before indexing them.
+        migrations.RunSQL('''
+            UPDATE payroll_employeralias
+            SET name = TRIM(name)
+            WHERE name != TRIM(name)
+        ''', reverse_sql='SELECT 1'),
+        migrations.AlterField(
+            model_name='employeralias',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.9 on 2026-10-18 02:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0039_index_alias_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonEmployer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=255, null=True)),
+                ('last_name', models.CharField(max_length=255, null=True)),
+                ('employer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='payroll.Employer')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='payroll.Person')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='personemployer',
+            index=models.Index(fields=['employer', 'first_name', 'last_name'], name='payroll_per_employe_68dc8c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='personemployer',
+            constraint=models.UniqueConstraint(fields=('employer', 'person'), name='unique_person_employer'),
+        ),
+        migrations.RunSQL('''
+            INSERT INTO payroll_personemployer (
+              employer_id,
+              person_id,
+              first_name,
+              last_name
+            )
+            SELECT DISTINCT
+              position.employer_id,
+              person.id,
+              person.first_name,
+              person.last_name
+            FROM payroll_person AS person
+            JOIN payroll_job AS job
+              ON job.person_id = person.id
+            JOIN payroll_salary AS salary
+              ON salary.job_id = job.id
+            JOIN payroll_position AS position
+              ON position.id = job.position_id
+        ''', reverse_sql='SELECT 1'),
+    ]
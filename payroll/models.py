@@ -1,3 +1,4 @@
+from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.db import models, connection
 from django.db.models import Q, CheckConstraint, UniqueConstraint
@@ -6,6 +7,7 @@ from django.db.models.functions import Coalesce
 from django_pgviews import view as pg
 
 from bga_database.base_models import AliasModel, SluggedModel
+from bga_database.chart_settings import DISTRIBUTION_MAX, DISTRIBUTION_BIN_NUM
 from data_import.models import Upload, RespondingAgency, SourceFile
 
 
@@ -116,6 +118,21 @@ class Employer(SluggedModel, VintagedModel):
         else:
             return 'unit'
 
+    # Size class lookup where the key is a unique tuple, (entity type,
+    # is_special), and the value is a tuple, (lower size class boundary, upper
+    # size class boundary), where the boundaries are population in thousands,
+    # such that an entity with a population greater than or equal to the upper
+    # boundary is Large; less than the upper but greater than or equal to the
+    # lower boundary is Medium; or less than the lower boundary is Small.
+    SIZE_CLASS_BOUNDS = {
+        ('Municipal', True): (-1, -1),  # Chicago municipal (always large)
+        ('Municipal', False): (10, 50),  # Non-Chicago municipal
+        ('County', True): (500, 1000),  # Cook or collar county
+        ('County', False): (25, 75),  # Downstate county
+        ('Township', True): (25, 100),  # Cook or collar township
+        ('Township', False): (10, 50),  # Downstate township
+    }
+
     @property
     def size_class(self):
         '''
@@ -130,43 +147,33 @@ class Employer(SluggedModel, VintagedModel):
         Note that Chicago is its own special class, and it should always be
         large.
         '''
-        # Create a size class lookup where the key is a unique tuple,
-        # (entity type, is_special), and the value is a tuple, (lower size
-        # class boundary, upper size class boundary), where the boundaries
-        # are population in thousands, such that an entity with a population
-        # greater than or equal to the upper boundary is Large; less than the
-        # upper but greater than or equal to the lower boundary is Medium; or
-        # less than the lower boundary is Small.
-        class_lookup = {
-            ('Municipal', True): (-1, -1),  # Chicago municipal (always large)
-            ('Municipal', False): (10, 50),  # Non-Chicago municipal
-            ('County', True): (500, 1000),  # Cook or collar county
-            ('County', False): (25, 75),  # Downstate county
-            ('Township', True): (25, 100),  # Cook or collar township
-            ('Township', False): (10, 50),  # Downstate township
-        }
-
         if self.taxonomy:
-            lookup_key = (self.taxonomy.entity_type, self.taxonomy.is_special)
+            return self.classify_size(self.taxonomy.entity_type,
+                                      self.taxonomy.is_special,
+                                      self.get_population())
 
-            bounds = class_lookup.get(lookup_key)
+        else:
+            return None
 
-            if bounds:
-                lower_bound, upper_bound = bounds
-                population = self.get_population()
+    @classmethod
+    def classify_size(cls, entity_type, is_special, population):
+        '''
+        Return the size class of an employer with the given taxonomy and
+        population, or None if it cannot be classified. See size_class.
+        '''
+        bounds = cls.SIZE_CLASS_BOUNDS.get((entity_type, is_special))
 
-                if population:
-                    if population >= upper_bound * 1000:
-                        return 'Large'
+        if bounds and population:
+            lower_bound, upper_bound = bounds
 
-                    elif population >= lower_bound * 1000:
-                        return 'Medium'
+            if population >= upper_bound * 1000:
+                return 'Large'
 
-                    else:
-                        return 'Small'
+            elif population >= lower_bound * 1000:
+                return 'Medium'
 
-        else:
-            return None
+            else:
+                return 'Small'
 
     def get_population(self, year=None):
         '''
@@ -274,6 +281,313 @@ class EmployerHighestSalaries(pg.MaterializedView):
         managed = False
 
 
+class EmployerYearStats(pg.MaterializedView):
+    '''
+    Materialized view of payroll statistics for each employer and reporting
+    year, so entity pages don't have to aggregate every salary on request.
+    Department statistics describe the department's own salaries. Unit
+    statistics roll up the salaries of the unit and all of its departments.
+
+    salary_bins holds salary counts per WIDTH_BUCKET of total pay between 0
+    and DISTRIBUTION_MAX, i.e., the first element counts salaries less than 0,
+    the last element counts salaries greater than or equal to
+    DISTRIBUTION_MAX, and the elements in between correspond to the
+    DISTRIBUTION_BIN_NUM bins of the salary distribution chart. See
+    ChartHelperMixin.bin_precomputed_salary_data.
+    '''
+    sql = '''
+        WITH salaries AS (
+          SELECT
+            employer.id AS employer_id,
+            COALESCE(employer.parent_id, employer.id) AS unit_id,
+            employer.parent_id IS NOT NULL AS is_department,
+            s_file.reporting_year,
+            salary.amount,
+            salary.extra_pay,
+            COALESCE(salary.amount, 0) + COALESCE(salary.extra_pay, 0) AS total_pay
+          FROM payroll_salary AS salary
+          JOIN payroll_job AS job
+          ON salary.job_id = job.id
+          JOIN payroll_position AS position
+          ON job.position_id = position.id
+          JOIN payroll_employer AS employer
+          ON position.employer_id = employer.id
+          JOIN data_import_upload AS upload
+          ON salary.vintage_id = upload.id
+          JOIN data_import_standardizedfile AS s_file
+          ON upload.id = s_file.upload_id
+        ), employer_salaries AS (
+          /* Departments report their own salaries... */
+          SELECT
+            employer_id,
+            reporting_year,
+            amount,
+            extra_pay,
+            total_pay
+          FROM salaries
+          WHERE is_department
+          UNION ALL
+          /* ...while units report their own salaries, as well as the
+          salaries of their departments. */
+          SELECT
+            unit_id AS employer_id,
+            reporting_year,
+            amount,
+            extra_pay,
+            total_pay
+          FROM salaries
+        ), employer_stats AS (
+          SELECT
+            employer_id,
+            reporting_year,
+            COUNT(*) AS headcount,
+            SUM(COALESCE(amount, 0)) AS base_pay,
+            SUM(COALESCE(extra_pay, 0)) AS extra_pay,
+            SUM(total_pay) AS total_pay,
+            MAX(total_pay) AS max_total_pay,
+            percentile_cont(0.5) WITHIN GROUP (
+              ORDER BY amount
+            ) AS median_base_pay,
+            percentile_cont(0.5) WITHIN GROUP (
+              ORDER BY extra_pay
+            ) AS median_extra_pay,
+            percentile_cont(0.5) WITHIN GROUP (
+              ORDER BY NULLIF(total_pay, 0)
+            ) AS median_total_pay
+          FROM employer_salaries
+          GROUP BY employer_id, reporting_year
+        ), bin_counts AS (
+          SELECT
+            employer_id,
+            reporting_year,
+            WIDTH_BUCKET(total_pay, 0, {distribution_max}, {bin_num}) AS bin,
+            COUNT(*) AS salary_count
+          FROM employer_salaries
+          GROUP BY employer_id, reporting_year, bin
+        ), salary_bins AS (
+          SELECT
+            stats.employer_id,
+            stats.reporting_year,
+            ARRAY_AGG(
+              COALESCE(bin_counts.salary_count, 0) ORDER BY bins.bin
+            ) AS salary_bins
+          FROM employer_stats AS stats
+          CROSS JOIN GENERATE_SERIES(0, {bin_num} + 1) AS bins (bin)
+          LEFT JOIN bin_counts
+          ON stats.employer_id = bin_counts.employer_id
+            AND stats.reporting_year = bin_counts.reporting_year
+            AND bins.bin = bin_counts.bin
+          GROUP BY stats.employer_id, stats.reporting_year
+        )
+        SELECT
+          ROW_NUMBER() OVER (ORDER BY employer_id, reporting_year) AS id,
+          employer_stats.*,
+          salary_bins.salary_bins
+        FROM employer_stats
+        JOIN salary_bins
+        USING (employer_id, reporting_year)
+    '''.format(distribution_max=DISTRIBUTION_MAX, bin_num=DISTRIBUTION_BIN_NUM)
+
+    # Creates a unique index on (employer_id, reporting_year), so retrieving
+    # the statistics for an entity page is a single index lookup.
+    concurrent_index = 'employer_id, reporting_year'
+
+    employer = models.ForeignKey('Employer',
+                                 related_name='year_stats',
+                                 on_delete=models.DO_NOTHING)
+    reporting_year = models.IntegerField()
+    headcount = models.IntegerField(default=0)
+    base_pay = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    extra_pay = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_pay = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    max_total_pay = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    median_base_pay = models.FloatField(null=True)
+    median_extra_pay = models.FloatField(null=True)
+    median_total_pay = models.FloatField(null=True)
+    salary_bins = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        app_label = 'payroll'
+        db_table = 'payroll_employer_year_stats'
+        managed = False
+
+    @classmethod
+    def for_employer(cls, employer, year):
+        '''
+        Return the statistics for the given employer and year. Employers
+        missing from the view, e.g., because their salaries were added since
+        the view was last refreshed, have their statistics computed from
+        their salaries. Employers without salaries in the given year get
+        empty statistics.
+        '''
+        try:
+            return cls.objects.get(employer=employer, reporting_year=year)
+
+        except cls.DoesNotExist:
+            return cls.compute(employer, year)
+
+    @classmethod
+    def compute(cls, employer, year):
+        '''
+        Compute the statistics for the given employer and year from its
+        salaries, as the view does, without saving them.
+        '''
+        query = '''
+            WITH employer_salaries AS (
+              SELECT
+                salary.amount,
+                salary.extra_pay,
+                COALESCE(salary.amount, 0) + COALESCE(salary.extra_pay, 0) AS total_pay
+              FROM payroll_salary AS salary
+              JOIN payroll_job AS job
+              ON salary.job_id = job.id
+              JOIN payroll_position AS position
+              ON job.position_id = position.id
+              JOIN payroll_employer AS employer
+              ON position.employer_id = employer.id
+              JOIN data_import_upload AS upload
+              ON salary.vintage_id = upload.id
+              JOIN data_import_standardizedfile AS s_file
+              ON upload.id = s_file.upload_id
+              WHERE (employer.id = %(employer_id)s OR employer.parent_id = %(employer_id)s)
+                AND s_file.reporting_year = %(reporting_year)s
+            ), bin_counts AS (
+              SELECT
+                WIDTH_BUCKET(total_pay, 0, {distribution_max}, {bin_num}) AS bin,
+                COUNT(*) AS salary_count
+              FROM employer_salaries
+              GROUP BY bin
+            )
+            SELECT
+              COUNT(*) AS headcount,
+              SUM(COALESCE(amount, 0)) AS base_pay,
+              SUM(COALESCE(extra_pay, 0)) AS extra_pay,
+              SUM(total_pay) AS total_pay,
+              MAX(total_pay) AS max_total_pay,
+              percentile_cont(0.5) WITHIN GROUP (
+                ORDER BY amount
+              ) AS median_base_pay,
+              percentile_cont(0.5) WITHIN GROUP (
+                ORDER BY extra_pay
+              ) AS median_extra_pay,
+              percentile_cont(0.5) WITHIN GROUP (
+                ORDER BY NULLIF(total_pay, 0)
+              ) AS median_total_pay,
+              (
+                SELECT ARRAY_AGG(COALESCE(bin_counts.salary_count, 0) ORDER BY bins.bin)
+                FROM GENERATE_SERIES(0, {bin_num} + 1) AS bins (bin)
+                LEFT JOIN bin_counts
+                USING (bin)
+              ) AS salary_bins
+            FROM employer_salaries
+        '''.format(distribution_max=DISTRIBUTION_MAX, bin_num=DISTRIBUTION_BIN_NUM)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, {'employer_id': employer.id, 'reporting_year': year})
+            columns = [column[0] for column in cursor.description]
+            stats = dict(zip(columns, cursor.fetchone()))
+
+        if not stats['headcount']:
+            return cls(employer=employer, reporting_year=year)
+
+        return cls(employer=employer, reporting_year=year, **stats)
+
+
+class EmployerRanking(pg.MaterializedView):
+    '''
+    Materialized view of the percentile rank of each classified employer
+    among like employers, by median salary and by total expenditure, in each
+    reporting year. Units are ranked against units of the same taxonomy.
+    Departments are ranked against departments of the same universe whose
+    parent units share a taxonomy.
+
+    Percentiles are stored as fractions between 0 and 1, as returned by
+    percent_rank().
+    '''
+    dependencies = ['payroll.EmployerHighestSalaries']
+
+    sql = '''
+        WITH unit_budgets AS (
+          SELECT
+            COALESCE(salaries.employer_parent_id, salaries.employer_id) AS employer_id,
+            unit.taxonomy_id,
+            NULL::integer AS universe_id,
+            salaries.reporting_year,
+            percentile_cont(0.5) WITHIN GROUP (
+              ORDER BY salaries.total_pay ASC
+            ) AS median_salary,
+            SUM(salaries.total_pay) AS total_budget
+          FROM payroll_employer_highest_salaries AS salaries
+          JOIN payroll_employer AS unit
+          ON COALESCE(salaries.employer_parent_id, salaries.employer_id) = unit.id
+          WHERE unit.taxonomy_id IS NOT NULL
+          GROUP BY
+            COALESCE(salaries.employer_parent_id, salaries.employer_id),
+            unit.taxonomy_id,
+            salaries.reporting_year
+        ), department_budgets AS (
+          SELECT
+            salaries.employer_id,
+            unit.taxonomy_id,
+            department.universe_id,
+            salaries.reporting_year,
+            percentile_cont(0.5) WITHIN GROUP (
+              ORDER BY salaries.total_pay ASC
+            ) AS median_salary,
+            SUM(salaries.total_pay) AS total_budget
+          FROM payroll_employer_highest_salaries AS salaries
+          JOIN payroll_employer AS department
+          ON salaries.employer_id = department.id
+          JOIN payroll_employer AS unit
+          ON department.parent_id = unit.id
+          WHERE unit.taxonomy_id IS NOT NULL
+          AND department.universe_id IS NOT NULL
+          GROUP BY
+            salaries.employer_id,
+            unit.taxonomy_id,
+            department.universe_id,
+            salaries.reporting_year
+        ), budgets AS (
+          SELECT * FROM unit_budgets
+          UNION ALL
+          SELECT * FROM department_budgets
+        )
+        SELECT
+          ROW_NUMBER() OVER (ORDER BY employer_id, reporting_year) AS id,
+          employer_id,
+          reporting_year,
+          median_salary,
+          total_budget,
+          /* Unit rows have a NULL universe, so units and departments of the
+          same taxonomy fall into separate partitions. */
+          percent_rank() OVER (
+            PARTITION BY taxonomy_id, universe_id, reporting_year
+            ORDER BY median_salary ASC
+          ) AS salary_percentile,
+          percent_rank() OVER (
+            PARTITION BY taxonomy_id, universe_id, reporting_year
+            ORDER BY total_budget ASC
+          ) AS expenditure_percentile
+        FROM budgets
+    '''
+
+    concurrent_index = 'employer_id, reporting_year'
+
+    employer = models.ForeignKey('Employer',
+                                 related_name='rankings',
+                                 on_delete=models.DO_NOTHING)
+    reporting_year = models.IntegerField()
+    median_salary = models.FloatField()
+    total_budget = models.DecimalField(max_digits=16, decimal_places=2)
+    salary_percentile = models.FloatField()
+    expenditure_percentile = models.FloatField()
+
+    class Meta:
+        app_label = 'payroll'
+        db_table = 'payroll_employer_ranking'
+        managed = False
+
+
 class UnitManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(parent_id__isnull=True)
@@ -482,6 +796,38 @@ class Job(VintagedModel):
         return '{0} – {1}'.format(self.person, self.position)
 
 
+class PersonEmployer(models.Model):
+    '''
+    Lookup of the people who have held a job with each employer, by name,
+    for matching incoming people to existing people. Maintained by the
+    import, so matching can be restricted to the employers in the incoming
+    data. See ImportUtility.select_raw_person.
+    '''
+    employer = models.ForeignKey(
+        'Employer',
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    person = models.ForeignKey(
+        'Person',
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    first_name = models.CharField(max_length=255, null=True)
+    last_name = models.CharField(max_length=255, null=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['employer', 'person'],
+                name='unique_person_employer'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['employer', 'first_name', 'last_name']),
+        ]
+
+
 class Position(VintagedModel):
     employer = models.ForeignKey('Employer', on_delete=models.CASCADE, related_name='positions')
     title = models.CharField(max_length=255, null=True)
@@ -549,6 +895,35 @@ class Salary(VintagedModel):
 
     @property
     def employer_percentile(self):
+        try:
+            return self.percentiles.employer_percentile * 100
+
+        except SalaryPercentile.DoesNotExist:
+            # The salary was added since percentiles were last refreshed.
+            return self._employer_percentile()
+
+    @property
+    def like_employer_percentile(self):
+        employer = self.job.position.employer
+
+        if employer.is_unclassified:
+            return 'N/A'
+
+        try:
+            percentile = self.percentiles.like_employer_percentile
+
+        except SalaryPercentile.DoesNotExist:
+            if employer.is_department:
+                return self._like_department_percentile(employer)
+
+            else:
+                return self._like_unit_percentile(employer)
+
+        # Departments of unclassified units have no like employer percentile.
+        if percentile is not None:
+            return percentile * 100
+
+    def _employer_percentile(self):
         query = '''
             WITH salary_percentiles AS (
               SELECT
@@ -583,19 +958,6 @@ class Salary(VintagedModel):
 
         return result[0] * 100
 
-    @property
-    def like_employer_percentile(self):
-        employer = self.job.position.employer
-
-        if employer.is_unclassified:
-            return 'N/A'
-
-        elif employer.is_department:
-            return self._like_department_percentile(employer)
-
-        else:
-            return self._like_unit_percentile(employer)
-
     def _like_unit_percentile(self, employer):
         query = '''
             WITH employer_parent_lookup AS (
@@ -686,3 +1048,97 @@ class Salary(VintagedModel):
                 result = cursor.fetchone()
 
             return result[0] * 100
+
+
+class SalaryPercentile(pg.MaterializedView):
+    '''
+    Materialized view of the percentile rank of each salary, so person pages
+    don't have to rank every salary in an employer or comparison group on
+    request.
+
+    employer_percentile ranks a salary among all salaries of its employer in
+    the same reporting year, including the salaries of departments for salaries
+    paid directly by a unit. like_employer_percentile ranks a salary among
+    salaries paid by units of the same taxonomy or, for salaries paid by
+    departments, by departments of the same universe within units of the same
+    taxonomy. It is null for salaries paid by unclassified employers.
+
+    Percentiles are stored as fractions, as returned by percent_rank().
+    '''
+    sql = '''
+        WITH salaries AS (
+          SELECT
+            salary.id AS salary_id,
+            employer.id AS employer_id,
+            unit.id AS unit_id,
+            employer.parent_id IS NOT NULL AS is_department,
+            unit.taxonomy_id,
+            employer.universe_id,
+            s_file.reporting_year,
+            COALESCE(salary.amount, 0) + COALESCE(salary.extra_pay, 0) AS total_pay
+          FROM payroll_salary AS salary
+          JOIN payroll_job AS job
+          ON salary.job_id = job.id
+          JOIN payroll_position AS position
+          ON job.position_id = position.id
+          JOIN payroll_employer AS employer
+          ON position.employer_id = employer.id
+          JOIN payroll_employer AS unit
+          ON COALESCE(employer.parent_id, employer.id) = unit.id
+          JOIN data_import_upload AS upload
+          ON salary.vintage_id = upload.id
+          JOIN data_import_standardizedfile AS s_file
+          ON upload.id = s_file.upload_id
+        ), salary_ranks AS (
+          SELECT
+            salary_id,
+            is_department,
+            taxonomy_id,
+            universe_id,
+            percent_rank() OVER (
+              PARTITION BY employer_id, reporting_year
+              ORDER BY total_pay ASC
+            ) AS employer_rank,
+            percent_rank() OVER (
+              PARTITION BY unit_id, reporting_year
+              ORDER BY total_pay ASC
+            ) AS unit_rank,
+            percent_rank() OVER (
+              PARTITION BY taxonomy_id, reporting_year
+              ORDER BY total_pay ASC
+            ) AS taxonomy_rank,
+            /* Units do not have universes, so each universe partition
+            contains department salaries, only. */
+            percent_rank() OVER (
+              PARTITION BY taxonomy_id, universe_id, reporting_year
+              ORDER BY total_pay ASC
+            ) AS universe_rank
+          FROM salaries
+        )
+        SELECT
+          salary_id,
+          CASE
+            WHEN is_department THEN employer_rank
+            ELSE unit_rank
+          END AS employer_percentile,
+          CASE
+            WHEN taxonomy_id IS NULL THEN NULL
+            WHEN NOT is_department THEN taxonomy_rank
+            WHEN universe_id IS NOT NULL THEN universe_rank
+          END AS like_employer_percentile
+        FROM salary_ranks
+    '''
+
+    concurrent_index = 'salary_id'
+
+    salary = models.OneToOneField('Salary',
+                                  primary_key=True,
+                                  related_name='percentiles',
+                                  on_delete=models.DO_NOTHING)
+    employer_percentile = models.FloatField()
+    like_employer_percentile = models.FloatField(null=True)
+
+    class Meta:
+        app_label = 'payroll'
+        db_table = 'payroll_salary_percentile'
+        managed = False
@@ -1,22 +1,49 @@
 import collections
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import partialmethod
 from itertools import chain
+import json
+import logging
 import re
 import sys
 
 from django.conf import settings
-from django.db.models import Max
 import pysolr
+from requests.adapters import HTTPAdapter
 
-from data_import.models import StandardizedFile
+from data_import.utils import data_vintage
 from payroll.models import Unit, Department, Person
 from payroll.utils import employers_from_slugs
 
 
+logger = logging.getLogger(__name__)
+
+
 class DisallowedSearchException(Exception):
     pass
 
 
+def make_searcher():
+    '''
+    Return a Solr client whose requests share a pool of keep-alive connections,
+    large enough for each concurrent search worker to hold one.
+    '''
+    searcher = pysolr.Solr(settings.SOLR_URL, timeout=settings.SOLR_TIMEOUT)
+
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=settings.SOLR_SEARCH_WORKERS)
+
+    session = searcher.get_session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return searcher
+
+
+# Threads are started on demand, i.e., after web workers are forked.
+search_executor = ThreadPoolExecutor(max_workers=settings.SOLR_SEARCH_WORKERS)
+
+
 class EmployerSearch(object):
     search_kwargs = {
         'q.op': 'AND',
@@ -127,7 +154,7 @@ class LazyPaginatedResults(collections.abc.Sequence):
 
 
 class PayrollSearchMixin(object):
-    searcher = pysolr.Solr(settings.SOLR_URL)
+    searcher = make_searcher()
 
     # Cross-walk of URL parameters to Solr index fields
     param_index_map = {
@@ -151,6 +178,21 @@ class PayrollSearchMixin(object):
         'headcount'
     ]
 
+    # Query all requested entity types in a single request to Solr, rather
+    # than counting hits for each entity type, then querying each entity type
+    # needed to fill the page. Set to False to use the latter approach, e.g.,
+    # for comparison in the benchmark_search command.
+    single_query = True
+
+    # When entity types are searched separately, issue queries for each
+    # entity type concurrently, such that search time is bounded by the
+    # slowest entity type, rather than the sum of all entity types.
+    concurrent_search = True
+
+    # Maximum number of values to return for a facet field, i.e., the Solr
+    # default for facet.limit
+    facet_limit = 100
+
     def search(self, params, pagesize, **extra_kwargs):
         if params.get('entity_type'):
             entity_types = params.pop('entity_type').split(',')
@@ -174,23 +216,44 @@ class PayrollSearchMixin(object):
 
         query_string = self._make_querystring(params)
 
+        # Grouped queries, e.g., for autocomplete, return one group per entity
+        # type, so they're issued separately for each entity type.
+        if self.single_query and 'group' not in extra_kwargs:
+            search_results, total_hits = self._single_search(entity_types,
+                                                             pagesize,
+                                                             offset,
+                                                             query_string,
+                                                             **extra_kwargs)
+
+            return LazyPaginatedResults(search_results, total_hits)
+
         extra_kwargs['rows'] = 0
 
         # Determine the number of hits per entity type, for use in returning
         # results across entity types.
         entity_edges = []
 
-        for entity_type in entity_types:
-            _, hits = getattr(self, '_search_{}'.format(entity_type))(query_string, **extra_kwargs)
-            entity_edges.append((entity_type, hits))
+        if self.concurrent_search:
+            counts = self._search_concurrently([
+                (entity_type, query_string, extra_kwargs) for entity_type in entity_types
+            ])
+
+            for entity_type, result in zip(entity_types, counts):
+                # Leave out entity types whose hits could not be counted.
+                if result:
+                    _, hits = result
+                    entity_edges.append((entity_type, hits))
 
-        total_hits = sum(hits for _, hits in entity_edges)
+        else:
+            for entity_type in entity_types:
+                _, hits = getattr(self, '_search_{}'.format(entity_type))(query_string, **extra_kwargs)
+                entity_edges.append((entity_type, hits))
 
-        search_results = self._composite_search(entity_edges,
-                                                pagesize,
-                                                offset,
-                                                query_string,
-                                                **extra_kwargs)
+        search_results, total_hits = self._composite_search(entity_edges,
+                                                            pagesize,
+                                                            offset,
+                                                            query_string,
+                                                            **extra_kwargs)
 
         return LazyPaginatedResults(search_results, total_hits)
 
@@ -217,39 +280,348 @@ class PayrollSearchMixin(object):
         For example, if there are three unit results and 10 department results,
         and the requested page size is five, this method would return a list of
         three units and two departments, for a total of five results.
+
+        Return a tuple of the current page of results and the total number of
+        hits, leaving out the hits of entity types whose results could not be
+        retrieved.
         '''
-        upper_bound = 0
-        lower_bound = 0
+        queries = [
+            (entity_type, query_string, dict(extra_kwargs, start=start, rows=rows))
+            for entity_type, start, rows in self._page_plan(entity_edges, pagesize, offset)
+        ]
+
+        if self.concurrent_search:
+            page_results = self._search_concurrently(queries)
+
+        else:
+            page_results = [self._search(entity_type, query_string, **kwargs)
+                            for entity_type, query_string, kwargs in queries]
 
         search_results = []
-        entity_type_idx = 0
+        failed_entity_types = set()
 
-        while len(search_results) < pagesize:
-            try:
-                entity_type, entity_hits = entity_edges[entity_type_idx]
-            except IndexError:  # No more entity types, i.e., last page
+        for (entity_type, _, _), result in zip(queries, page_results):
+            # Return a partial page, if results could not be retrieved for
+            # one or more entity types.
+            if result:
+                entity_results, _ = result
+                search_results.extend(entity_results)
+            else:
+                failed_entity_types.add(entity_type)
+
+        total_hits = sum(hits for entity_type, hits in entity_edges
+                         if entity_type not in failed_entity_types)
+
+        return search_results, total_hits
+
+    def _page_plan(self, entity_edges, pagesize, offset):
+        '''
+        Return a list of tuples, containing entity type, the index of the first
+        result of that type, and the number of results of that type to request
+        in order to fill the current page.
+        '''
+        plan = []
+
+        lower_bound = 0
+        position = offset
+        remaining = pagesize
+
+        for entity_type, entity_hits in entity_edges:
+            if remaining <= 0:
                 break
 
-            upper_bound += entity_hits
+            upper_bound = lower_bound + entity_hits
 
-            if upper_bound >= offset:
-                if len(search_results) == 0:
-                    extra_kwargs['start'] = offset - lower_bound
-                else:
-                    # There were fewer than `pagesize` results in the previous
-                    # entity type, i.e., start from the beginning of the current
-                    # entity type
-                    extra_kwargs['start'] = 0
+            if upper_bound > position:
+                # Start from the offset within the first entity type on the
+                # page, and from the beginning of subsequent entity types.
+                start = position - lower_bound
+                plan.append((entity_type, start, remaining))
 
-                extra_kwargs['rows'] = pagesize - len(search_results)
+                page_hits = min(remaining, entity_hits - start)
+                position += page_hits
+                remaining -= page_hits
 
-                entity_results, _ = getattr(self, '_search_{}'.format(entity_type))(query_string, **extra_kwargs)
-                search_results.extend(entity_results)
+            lower_bound = upper_bound
+
+        return plan
+
+    def _search_concurrently(self, queries):
+        '''
+        :queries - list of tuples, containing entity type, Solr query string,
+            and extra search kwargs
+
+        Issue the given queries to Solr concurrently, and return a list of
+        (results, hits) tuples, in the same order. Queries that fail or do not
+        complete within SOLR_TIMEOUT are logged, and None is returned in their
+        place. If every query fails, raise the error.
+
+        Only Solr requests are made on worker threads. Results are handled on
+        the calling thread, as handling them may query the database.
+        '''
+        futures = []
+
+        for entity_type, query_string, extra_kwargs in queries:
+            entity_query, search_kwargs = self._entity_query(entity_type, query_string, **extra_kwargs)
+            futures.append(search_executor.submit(self.searcher.search, entity_query, **search_kwargs))
+
+        done, _ = wait(futures, timeout=settings.SOLR_TIMEOUT)
+
+        out = []
+        error = None
+
+        for (entity_type, _, _), future in zip(queries, futures):
+            if future not in done:
+                future.cancel()
+                error = pysolr.SolrError('Search for {} timed out'.format(entity_type))
+                logger.warning(str(error))
+                out.append(None)
+                continue
+
+            try:
+                results = future.result()
+
+            except pysolr.SolrError as e:
+                error = e
+                logger.warning('Search for {} failed: {}'.format(entity_type, e))
+                out.append(None)
+                continue
+
+            out.append(self._handle_results(entity_type, results))
+
+        if queries and not any(out):
+            raise error
+
+        return out
+
+    def _single_search(self,
+                       entity_types,
+                       pagesize,
+                       offset,
+                       query_string,
+                       **extra_kwargs):
+        '''
+        :entity_types - list of entity types to search, in the order in which
+            they should appear in the results
+        :pagesize - number of search results to return
+        :offset - (current page - 1) * offset, i.e., the starting index of the
+            current page of results
+        :query_string - Solr query string
+
+        Query all requested entity types at once, sorting results first by
+        entity type, then by the sort order of each entity type, such that
+        pages contain the same results as those assembled by
+        _composite_search. Facets for each entity type are requested with the
+        JSON Facet API, restricted to documents of that entity type, and
+        translated to the format of the standard facet response for parsing in
+        FacetingMixin.
+
+        Return a tuple of the current page of results and the total number of
+        hits.
+        '''
+        entity_filters = collections.OrderedDict(
+            (entity_type, 'id:{}*'.format(entity_type)) for entity_type in entity_types
+        )
+
+        entity_filter = '({})'.format(' OR '.join(entity_filters.values()))
+
+        if query_string:
+            query_string += ' AND {}'.format(entity_filter)
+        else:
+            query_string = entity_filter
+
+        search_kwargs = {
+            'q.op': 'AND',
+            'start': offset,
+            'rows': pagesize,
+            'sort': self._single_search_sort(entity_types),
+            'json.facet': json.dumps({
+                entity_type: {
+                    'type': 'query',
+                    'q': entity_filter,
+                    'facet': self._json_facets(entity_type),
+                } for entity_type, entity_filter in entity_filters.items()
+            }),
+        }
 
-            lower_bound += entity_hits
-            entity_type_idx += 1
+        # Entity filters are referenced by parameter in the sort.
+        search_kwargs.update({
+            '{}_filter'.format(entity_type): entity_filter
+            for entity_type, entity_filter in entity_filters.items()
+        })
 
-        return search_results
+        search_kwargs.update(extra_kwargs)
+
+        results = self.searcher.search(query_string, **search_kwargs)
+
+        results_by_type = collections.defaultdict(list)
+
+        for result in results:
+            results_by_type[result['id'].split('.')[0]].append(result)
+
+        # As in _search, only return facets for entity types with results on
+        # the current page.
+        facets = {
+            entity_type: self._standard_facets(entity_type, results.raw_response['facets'][entity_type])
+            for entity_type in results_by_type
+        }
+
+        try:
+            self.facets.update(facets)
+
+        except AttributeError:
+            self.facets = facets
+
+        for entity_type, entity_results in results_by_type.items():
+            # If results contain Employer slugs, replace them with the
+            # appropriate Unit and Department objects.
+            try:
+                self._search_class(entity_type)._format_results(entity_results)
+            except AttributeError:
+                pass
+
+        return results.docs, results.hits
+
+    def _single_search_sort(self, entity_types):
+        '''
+        Sort results by entity type, in the order given, then by the sort
+        order of each entity type. query() returns 1 for documents matching
+        the referenced entity filter, and the given default, 0, otherwise.
+        '''
+        sort = ['query(${}_filter,0) desc'.format(entity_type)
+                for entity_type in entity_types[:-1]]
+
+        for entity_type in entity_types:
+            entity_sort = self._search_class(entity_type).search_kwargs['sort']
+
+            if entity_sort not in sort:
+                sort.append(entity_sort)
+
+        return ','.join(sort)
+
+    def _facet_params(self, entity_type):
+        '''
+        Return the field, interval, and pivot facets of the given entity type,
+        as well as the minimum count for field facets.
+        '''
+        search_kwargs = self._search_class(entity_type).search_kwargs
+
+        def as_list(value):
+            if not value:
+                return []
+            return [value] if isinstance(value, str) else value
+
+        fields = as_list(search_kwargs.get('facet.field'))
+        intervals = {field: search_kwargs['f.{}.facet.interval.set'.format(field)]
+                     for field in as_list(search_kwargs.get('facet.interval'))}
+        pivots = as_list(search_kwargs.get('facet.pivot'))
+        mincount = int(search_kwargs.get('facet.mincount', 1))
+
+        return fields, intervals, pivots, mincount
+
+    def _json_facets(self, entity_type):
+        '''
+        Translate the standard facet parameters of the given entity type into
+        a JSON Facet API request.
+        '''
+        fields, intervals, pivots, mincount = self._facet_params(entity_type)
+
+        json_facets = {}
+
+        for field in fields:
+            json_facets[field] = {
+                'type': 'terms',
+                'field': field,
+                'mincount': mincount,
+                'limit': self.facet_limit,
+            }
+
+        for field, interval_set in intervals.items():
+            for idx, interval in enumerate(interval_set):
+                # Convert an interval like [0,25000) to a range query like
+                # [0 TO 25000}.
+                solr_range = interval.replace(',', ' TO ').replace(')', '}').replace('(', '{')
+
+                json_facets['{}_{}'.format(field, idx)] = {
+                    'type': 'query',
+                    'q': '{}:{}'.format(field, solr_range),
+                }
+
+        for idx, pivot in enumerate(pivots):
+            # N.b., only one level of pivoting is supported, as in
+            # FacetingMixin._facet_pivot.
+            field, pivot_field = pivot.split(',')
+
+            json_facets['pivot_{}'.format(idx)] = {
+                'type': 'terms',
+                'field': field,
+                'limit': self.facet_limit,
+                'facet': {
+                    pivot_field: {
+                        'type': 'terms',
+                        'field': pivot_field,
+                        'limit': self.facet_limit,
+                    },
+                },
+            }
+
+        return json_facets
+
+    def _standard_facets(self, entity_type, json_facets):
+        '''
+        Translate JSON Facet API counts for the given entity type into the
+        format of the standard facet response, i.e., facet_fields,
+        facet_intervals, and facet_pivot.
+        '''
+        fields, intervals, pivots, _ = self._facet_params(entity_type)
+
+        facets = {
+            'facet_fields': {},
+            'facet_intervals': {},
+            'facet_pivot': {},
+        }
+
+        # Solr omits buckets from facets with no matching documents.
+        def buckets(facet):
+            return json_facets.get(facet, {}).get('buckets', [])
+
+        for field in fields:
+            facets['facet_fields'][field] = list(chain.from_iterable(
+                (bucket['val'], bucket['count']) for bucket in buckets(field)
+            ))
+
+        for field, interval_set in intervals.items():
+            facets['facet_intervals'][field] = collections.OrderedDict(
+                (interval, json_facets.get('{}_{}'.format(field, idx), {}).get('count', 0))
+                for idx, interval in enumerate(interval_set)
+            )
+
+        for idx, pivot in enumerate(pivots):
+            field, pivot_field = pivot.split(',')
+
+            pivot_counts = []
+
+            for bucket in buckets('pivot_{}'.format(idx)):
+                count = {
+                    'field': field,
+                    'value': bucket['val'],
+                    'count': bucket['count'],
+                }
+
+                pivot_buckets = bucket.get(pivot_field, {}).get('buckets', [])
+
+                if pivot_buckets:
+                    count['pivot'] = [{
+                        'field': pivot_field,
+                        'value': pivot_bucket['val'],
+                        'count': pivot_bucket['count'],
+                    } for pivot_bucket in pivot_buckets]
+
+                pivot_counts.append(count)
+
+            facets['facet_pivot'][pivot] = pivot_counts
+
+        return facets
 
     def _search(self, entity_type, query_string, **extra_kwargs):
         '''
@@ -258,6 +630,17 @@ class PayrollSearchMixin(object):
         those specific fields will only return results of the given entity
         type.
         '''
+        query_string, search_kwargs = self._entity_query(entity_type, query_string, **extra_kwargs)
+
+        results = self.searcher.search(query_string, **search_kwargs)
+
+        return self._handle_results(entity_type, results)
+
+    def _entity_query(self, entity_type, query_string, **extra_kwargs):
+        '''
+        Return the query string and search kwargs for querying one type of
+        entity.
+        '''
         search_class = self._search_class(entity_type)
 
         # Don't edit the actual static attribute
@@ -271,7 +654,14 @@ class PayrollSearchMixin(object):
         else:
             query_string = entity_filter
 
-        results = self.searcher.search(query_string, **search_kwargs)
+        return query_string, search_kwargs
+
+    def _handle_results(self, entity_type, results):
+        '''
+        Record facets and format results from a query for one type of entity.
+        Return a tuple of the results and the number of hits.
+        '''
+        search_class = self._search_class(entity_type)
 
         if results:
             try:
@@ -337,9 +727,7 @@ class PayrollSearchMixin(object):
                         if k not in range_params}
 
         if 'year' not in value_params:
-            value_params['year'] = StandardizedFile.objects.aggregate(
-                latest_year=Max('reporting_year')
-            )['latest_year']
+            value_params['year'] = data_vintage.latest_year()
 
         query_parts = chain(self._value_q(value_params), self._range_q(range_params))
 
@@ -1,11 +1,11 @@
 from django.conf import settings
 from django.db import connection
-from django.db.models import Q, FloatField, Sum, Max
-from django.db.models.functions import Coalesce, NullIf
-from postgres_stats.aggregates import Percentile
+from django.db.models import Max
 from rest_framework import serializers
 
-from payroll.models import Employer, Unit, Department, Salary, Person
+from data_import.models import SourceFile
+from payroll.models import Employer, Unit, Department, Salary, Person, \
+    EmployerYearStats, EmployerRanking
 from payroll.charts import ChartHelperMixin
 from payroll.utils import format_exact_number, format_ballpark_number, \
     format_salary, format_percentile
@@ -65,78 +65,42 @@ class EmployerSerializer(serializers.ModelSerializer, ChartHelperMixin):
     payroll_expenditure = serializers.SerializerMethodField()
 
     @property
-    def salary_q(self):
-        return Q(positions__jobs__salaries__vintage__standardized_file__reporting_year=self.context['data_year'])
+    def employer_stats(self):
+        if not hasattr(self, '_employer_stats'):
+            self._employer_stats = EmployerYearStats.for_employer(self.instance, self.context['data_year'])
+        return self._employer_stats
 
     @property
-    def employer_queryset(self):
-        return Employer.objects.filter(
-            Q(id=self.instance.id) | Q(parent_id=self.instance.id)
-        )
-
-    @property
-    def employer_salaries(self):
-        if not hasattr(self, '_employer_salaries'):
-            self._employer_salaries = self.instance.get_salaries(year=self.context['data_year'])
-        return self._employer_salaries
+    def employer_ranking(self):
+        '''
+        Percentile ranks of the employer among like employers, or None if the
+        employer is unclassified or reported no salaries in the given year.
+        '''
+        if not hasattr(self, '_employer_ranking'):
+            self._employer_ranking = EmployerRanking.objects.filter(
+                employer=self.instance,
+                reporting_year=self.context['data_year']
+            ).first()
+        return self._employer_ranking
 
     @property
     def employer_salary_count(self):
-        if not hasattr(self, '_employer_salary_count'):
-            self._employer_salary_count = self.employer_salaries.count()
-        return self._employer_salary_count
+        return self.employer_stats.headcount
 
     @property
     def employer_median_salaries(self):
-        if not hasattr(self, '_employer_median_salaries'):
-            median_base_pay = Percentile(
-                'positions__jobs__salaries__amount',
-                0.5,
-                filter=self.salary_q,
-                output_field=FloatField()
-            )
-            median_extra_pay = Percentile(
-                'positions__jobs__salaries__extra_pay',
-                0.5,
-                filter=self.salary_q,
-                output_field=FloatField()
-            )
-            median_total_pay = Percentile(
-                NullIf(
-                    Coalesce('positions__jobs__salaries__amount', 0) +
-                    Coalesce('positions__jobs__salaries__extra_pay', 0), 0
-                ),
-                0.5,
-                filter=self.salary_q,
-                output_field=FloatField()
-            )
-
-            self._employer_median_salaries = self.employer_queryset.aggregate(
-                median_base_pay=Coalesce(median_base_pay, 0),
-                median_extra_pay=Coalesce(median_extra_pay, 0),
-                median_total_pay=Coalesce(median_total_pay, 0)
-            )
-
-        return self._employer_median_salaries
+        return {
+            'median_base_pay': self.employer_stats.median_base_pay or 0,
+            'median_extra_pay': self.employer_stats.median_extra_pay or 0,
+            'median_total_pay': self.employer_stats.median_total_pay or 0,
+        }
 
     @property
     def employer_payroll(self):
-        if not hasattr(self, '_employer_payroll'):
-            entity_base_pay = Sum(
-                Coalesce('positions__jobs__salaries__amount', 0),
-                filter=self.salary_q
-            )
-            entity_extra_pay = Sum(
-                Coalesce('positions__jobs__salaries__extra_pay', 0),
-                filter=self.salary_q
-            )
-
-            self._employer_payroll = self.employer_queryset.aggregate(
-                base_pay=Coalesce(entity_base_pay, 0),
-                extra_pay=Coalesce(entity_extra_pay, 0)
-            )
-
-        return self._employer_payroll
+        return {
+            'base_pay': self.employer_stats.base_pay,
+            'extra_pay': self.employer_stats.extra_pay,
+        }
 
     def get_salaries(self, obj):
         data = []
@@ -211,8 +175,9 @@ class EmployerSerializer(serializers.ModelSerializer, ChartHelperMixin):
 
     def get_employee_salary_json(self, obj):
         if self.employer_salary_count > 0:
-            return self.bin_salary_data(
-                list(s['total_pay'] for s in self.employer_salaries.values('total_pay'))
+            return self.bin_precomputed_salary_data(
+                self.employer_stats.salary_bins,
+                self.employer_stats.max_total_pay
             )
         else:
             return []
@@ -306,78 +271,16 @@ class UnitSerializer(EmployerSerializer):
         return self._department_statistics
 
     def get_salary_percentile(self, obj):
-        if obj.is_unclassified or self.employer_salary_count == 0:
+        if obj.is_unclassified or not self.employer_ranking:
             return 'N/A'
 
-        query = '''
-            WITH employer_median_salaries_by_unit AS (
-              SELECT
-                COALESCE(employer_parent_id, employer_id) AS unit_id,
-                percentile_cont(0.5) WITHIN GROUP (
-                  ORDER BY total_pay ASC
-                ) AS median_salary
-              FROM payroll_employer_highest_salaries
-              WHERE COALESCE(employer_parent_id, employer_id) IN (
-                SELECT id FROM payroll_employer WHERE taxonomy_id = {taxonomy}
-              )
-              AND reporting_year = {reporting_year}
-              GROUP BY COALESCE(employer_parent_id, employer_id)
-            ),
-            salary_percentiles AS (
-              SELECT
-                percent_rank() OVER (ORDER BY median_salary ASC) AS percentile,
-                unit_id
-              FROM employer_median_salaries_by_unit
-            )
-            SELECT
-              percentile
-            FROM salary_percentiles
-            WHERE unit_id = {id}
-        '''.format(taxonomy=obj.taxonomy.id,
-                   reporting_year=self.context['data_year'],
-                   id=obj.id)
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-
-        return format_percentile(result[0] * 100)
+        return format_percentile(self.employer_ranking.salary_percentile * 100)
 
     def get_expenditure_percentile(self, obj):
-        if obj.is_unclassified or self.employer_salary_count == 0:
+        if obj.is_unclassified or not self.employer_ranking:
             return 'N/A'
 
-        query = '''
-            WITH expenditure_by_unit AS (
-              SELECT
-                COALESCE(employer_parent_id, employer_id) AS unit_id,
-                SUM(total_pay) AS total_budget
-              FROM payroll_employer_highest_salaries
-              WHERE COALESCE(employer_parent_id, employer_id) IN (
-                SELECT id FROM payroll_employer WHERE taxonomy_id = {taxonomy}
-              )
-              AND reporting_year = {reporting_year}
-              GROUP BY COALESCE(employer_parent_id, employer_id)
-            ),
-            exp_percentiles AS (
-              SELECT
-                percent_rank() OVER (ORDER BY total_budget ASC) AS percentile,
-                unit_id
-              FROM expenditure_by_unit
-            )
-            SELECT
-              percentile
-            FROM exp_percentiles
-            WHERE unit_id = {id}
-        '''.format(taxonomy=obj.taxonomy.id,
-                   reporting_year=self.context['data_year'],
-                   id=obj.id)
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-
-        return format_percentile(result[0] * 100)
+        return format_percentile(self.employer_ranking.expenditure_percentile * 100)
 
     def get_department_salaries(self, obj):
         formatted_salaries = []
@@ -444,107 +347,24 @@ class DepartmentSerializer(EmployerSerializer):
     percent_of_total_expenditure = serializers.SerializerMethodField()
 
     def get_percent_of_total_expenditure(self, obj):
-        department_salaries = self.employer_salaries.values_list('total_pay', flat=True)
+        unit_stats = EmployerYearStats.for_employer(self.instance.parent, self.context['data_year'])
 
-        unit_salaries = self.instance.parent.get_salaries(year=self.context['data_year'])\
-                                            .values_list('total_pay', flat=True)
+        if not unit_stats.total_pay:
+            return 'N/A'
 
-        return format_percentile(sum(department_salaries) / sum(unit_salaries) * 100)
+        return format_percentile(self.employer_stats.total_pay / unit_stats.total_pay * 100)
 
     def get_expenditure_percentile(self, obj):
-        if obj.is_unclassified or obj.parent.is_unclassified:
+        if obj.is_unclassified or obj.parent.is_unclassified or not self.employer_ranking:
             return 'N/A'
 
-        query = '''
-            WITH taxonomy_members AS (
-              SELECT
-                department.id,
-                department.universe_id
-              FROM payroll_employer AS unit
-              JOIN payroll_employer AS department
-              ON unit.id = department.parent_id
-              WHERE unit.taxonomy_id = {taxonomy}
-              AND department.universe_id = {universe}
-            ),
-            expenditure_by_department AS (
-              SELECT
-                SUM(total_pay) AS total_budget,
-                employer_id AS department_id
-              FROM payroll_employer_highest_salaries
-              WHERE employer_id IN (
-                SELECT id FROM taxonomy_members
-              )
-              AND reporting_year = {reporting_year}
-              GROUP BY employer_id
-            ),
-            exp_percentiles AS (
-              SELECT
-                percent_rank() OVER (ORDER BY total_budget ASC) AS percentile,
-                department_id
-              FROM expenditure_by_department
-            )
-            SELECT
-              percentile
-            FROM exp_percentiles
-            WHERE department_id = {id}
-        '''.format(taxonomy=obj.parent.taxonomy.id,
-                   universe=obj.universe.id,
-                   id=obj.id,
-                   reporting_year=self.context['data_year'])
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-
-        return format_percentile(result[0] * 100)
+        return format_percentile(self.employer_ranking.expenditure_percentile * 100)
 
     def get_salary_percentile(self, obj):
-        if obj.is_unclassified or obj.parent.is_unclassified:
+        if obj.is_unclassified or obj.parent.is_unclassified or not self.employer_ranking:
             return 'N/A'
 
-        query = '''
-            WITH taxonomy_members AS (
-              SELECT
-                department.id,
-                department.universe_id
-              FROM payroll_employer AS unit
-              JOIN payroll_employer AS department
-              ON unit.id = department.parent_id
-              WHERE unit.taxonomy_id = {taxonomy}
-              AND department.universe_id = {universe}
-            ),
-            median_salaries_by_department AS (
-              SELECT
-                percentile_cont(0.5) WITHIN GROUP (
-                  ORDER BY total_pay ASC
-                ) AS median_salary,
-                employer_id AS department_id
-              FROM payroll_employer_highest_salaries
-              WHERE employer_id IN (
-                SELECT id FROM taxonomy_members
-              )
-              AND reporting_year = {reporting_year}
-              GROUP BY employer_id
-            ),
-            salary_percentiles AS (
-              SELECT
-                percent_rank() OVER (ORDER BY median_salary ASC) AS percentile,
-                department_id
-              FROM median_salaries_by_department
-            )
-            SELECT percentile
-            FROM salary_percentiles
-            WHERE department_id = {id}
-            '''.format(taxonomy=obj.parent.taxonomy.id,
-                       universe=obj.universe.id,
-                       id=obj.id,
-                       reporting_year=self.context['data_year'])
-
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-
-        return format_percentile(result[0] * 100)
+        return format_percentile(self.employer_ranking.salary_percentile * 100)
 
 
 # /v1/people/SLUG/YEAR
@@ -578,27 +398,60 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
         else:
             return super()._get_bar_color(lower, upper)
 
+    @property
+    def person_salaries(self):
+        '''
+        The salary history of the person, earliest first, with the jobs,
+        employers and percentiles needed to build the payload, so the rest of
+        the serializer does not query them again.
+        '''
+        if not hasattr(self, '_salaries'):
+            self._salaries = list(
+                Salary.objects.with_related_objects()
+                              .select_related('percentiles',
+                                              'job__position__employer__taxonomy',
+                                              'job__position__employer__universe',
+                                              'job__position__employer__parent__taxonomy')
+                              .filter(job__person=self.instance)
+                              .annotate(data_year=Max('vintage__standardized_file__reporting_year'))
+                              .order_by('data_year', 'id')
+            )
+        return self._salaries
+
     @property
     def person_current_job(self):
+        '''
+        The job of the most recent salary, like Person.most_recent_job.
+        '''
         if not hasattr(self, '_current_job'):
-            self._current_job = self.instance.most_recent_job
+            self._current_job = self.person_salaries[-1].job
         return self._current_job
 
     @property
     def person_current_salary(self):
         if not hasattr(self, '_current_salary'):
-            self._current_salary = self.person_current_job.salaries.get(
-                vintage__standardized_file__reporting_year=self.context['data_year']
-            )
+            data_year = str(self.context['data_year'])
+
+            try:
+                self._current_salary = next(
+                    salary for salary in self.person_salaries
+                    if salary.job_id == self.person_current_job.id and str(salary.data_year) == data_year
+                )
+            except StopIteration:
+                raise Salary.DoesNotExist('{0} has no salary for {1}'.format(self.instance, data_year))
+
         return self._current_salary
 
     @property
     def person_current_employer(self):
         if not hasattr(self, '_current_employer'):
             employer = self.person_current_job.position.employer
-            self._current_employer = (Department.objects.get(id=employer.id)
-                                      if employer.is_department
-                                      else Unit.objects.get(id=employer.id))
+
+            # Cast the employer, loaded with the salary history, to the
+            # appropriate proxy model, rather than fetching it again.
+            employer.__class__ = Department if employer.is_department else Unit
+
+            self._current_employer = employer
         return self._current_employer
 
     def get_current_job(self, obj):
@@ -614,11 +467,7 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
     def get_all_jobs(self, obj):
         data = []
 
-        for salary in Salary.objects.with_related_objects()\
-                                    .filter(job__person=obj)\
-                                    .annotate(data_year=Max('vintage__standardized_file__reporting_year'))\
-                                    .order_by('-vintage__standardized_file__reporting_year'):
-
+        for salary in reversed(self.person_salaries):
             data.append({
                 'position': salary.job.position.title,
                 'employer': salary.job.position.employer.name,
@@ -662,9 +511,11 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
             return [str(self.person_current_employer.taxonomy)]
 
     def get_employer_salary_json(self, obj):
-        return self.bin_salary_data(
-            self.person_current_employer.get_salaries(self.context['data_year'])
-                                        .values_list('total_pay', flat=True),
+        employer_stats = EmployerYearStats.for_employer(self.person_current_employer, self.context['data_year'])
+
+        return self.bin_precomputed_salary_data(
+            employer_stats.salary_bins,
+            employer_stats.max_total_pay,
             salary_amount=self.person_current_salary.total_pay
         )
 
@@ -694,10 +545,21 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
         return data
 
     def get_source_link(self, obj):
-        source_file = obj.source_file(self.context['data_year'])
+        '''
+        Like Person.source_file, in a single query.
+        '''
+        employer = self.person_current_salary.job.position.employer
+        unit_id = employer.parent_id or employer.id
+        data_year = self.context['data_year']
+
+        source_file = SourceFile.objects.filter(
+            reporting_year=data_year,
+            responding_agency__units__unit=unit_id,
+            responding_agency__units__reporting_year=data_year
+        ).first()
 
         if source_file:
-            return source_file.url
+            return source_file.source_file.url
 
     def get_noindex(self, obj):
         total_pay = (self.person_current_salary.amount or 0) + (self.person_current_salary.extra_pay or 0)
@@ -713,11 +575,7 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
             'data': []
         }
 
-        for salary in Salary.objects.with_related_objects()\
-                                    .filter(job__person=obj)\
-                                    .annotate(data_year=Max('vintage__standardized_file__reporting_year'))\
-                                    .order_by('vintage__standardized_file__reporting_year'):
-
+        for salary in self.person_salaries:
             base_pay['data'].append({
                 'name': str(salary.data_year),
                 'y': float(salary.amount or 0),
@@ -743,8 +601,7 @@ class PersonSerializer(serializers.ModelSerializer, ChartHelperMixin):
         '''
         current_salary = self.person_current_salary
 
-        ordered_salaries = list(Salary.objects.filter(job__person=obj)
-                                              .order_by('vintage__standardized_file__reporting_year'))
+        ordered_salaries = self.person_salaries
 
         first_salary = ordered_salaries[0]
 
@@ -1,11 +1,21 @@
+import collections
 from decimal import Decimal, ROUND_HALF_UP
+import functools
+import hashlib
 import math
 import re
+import threading
+import time
 import urllib.parse
 
+from django.core.cache import caches
+from django.middleware.cache import CacheMiddleware
+from django.utils.cache import get_cache_key
+from django.utils.decorators import decorator_from_middleware_with_args
 import inflect
 
-from payroll.models import Unit, Department
+from data_import.utils import VersionToken, data_vintage
+from payroll.models import Employer, Unit, Department
 
 
 def query_transform(request, drop_keys=['page']):
@@ -123,7 +133,7 @@ def url_from_facet(facet_data, request):
             if param in ('universe', 'taxonomy'):
                 value = '"{}"'.format(value)
 
-            elif isinstance(value, Unit) or isinstance(value, Department):
+            elif isinstance(value, (Unit, Department, EmployerRecord)):
                 value = value.slug
 
             params[param] = value
@@ -190,11 +200,268 @@ def an_or_a(word, bold=False):
     return phrase.format(word)
 
 
+class EmployerRecord(collections.namedtuple('EmployerRecord', ['id', 'slug', 'name', 'parent_name', 'parent_slug'])):
+    '''
+    Lightweight stand-in for a Unit or Department, with just enough
+    information to render a link to it.
+    '''
+    __slots__ = ()
+
+    @property
+    def is_department(self):
+        return bool(self.parent_slug)
+
+    @property
+    def endpoint(self):
+        return 'department' if self.is_department else 'unit'
+
+    def __str__(self):
+        # Format names like Unit.__str__ and Department.__str__.
+        if self.is_department and self.parent_name.lower() not in self.name.lower():
+            return '{} {}'.format(self.parent_name, self.name)
+
+        return self.name
+
+
+class EmployerRecordCache(object):
+    '''
+    Process-wide, size-bounded LRU cache of slugs to EmployerRecord objects.
+    Cached records are dropped when the employer version token is bumped,
+    i.e., when an employer is edited in the admin.
+    '''
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.token = VersionToken('employer_version')
+        self._lock = threading.Lock()
+        self._version = None
+        self._records = collections.OrderedDict()
+
+    def bump(self):
+        self.token.bump()
+
+    def get_many(self, slugs):
+        version = self.token.get()
+
+        records = {}
+        misses = set()
+
+        with self._lock:
+            if version is None or version != self._version:
+                self._records.clear()
+                self._version = version
+
+            for slug in slugs:
+                try:
+                    records[slug] = self._records[slug]
+                except KeyError:
+                    misses.add(slug)
+                else:
+                    self._records.move_to_end(slug)
+
+        if misses:
+            fetched = {
+                slug: EmployerRecord(*values) for slug, *values in
+                Employer.objects.filter(slug__in=misses)
+                                .values_list('slug', 'id', 'slug', 'name', 'parent__name', 'parent__slug')
+            }
+
+            records.update(fetched)
+
+            # Don't cache records if the cache does not retain the version
+            # token, since they could never be invalidated.
+            if version is not None:
+                with self._lock:
+                    if version == self._version:
+                        self._records.update(fetched)
+
+                        while len(self._records) > self.maxsize:
+                            self._records.popitem(last=False)
+
+        return records
+
+
+employer_records = EmployerRecordCache()
+
+
 def employers_from_slugs(slugs):
-    employers = {e.slug: e for e in Unit.objects.filter(slug__in=slugs)}
+    '''
+    Return a dictionary of the given slugs to EmployerRecord objects for the
+    corresponding units and departments.
+    '''
+    return employer_records.get_many(slugs)
+
+
+def cache_key_prefix(request, scope, kwargs):
+    '''
+    Return a cache key prefix naming the version of the data a response is
+    built from. An import changes the prefix of the responses it affects, so
+    they are rebuilt, while responses it does not affect keep their keys, and
+    stay cached. Scope is one of:
+
+    - 'year', for API responses for the reporting year in the data_year
+      parameter. Versioned by the most recent file imported for the year,
+      since they compare employers across the year.
+    - 'unit', for the pages of the unit or department in the slug URL
+      argument. Versioned by the most recent file to change the unit.
+    - 'data', for pages built from every year, e.g., the home page. Versioned
+      by the most recent file imported for any year.
+
+    Files still being imported are left out, so responses built before their
+    import completes are not cached under the versions it produces.
+    '''
+    if scope == 'year':
+        try:
+            year = int(request.GET['data_year'])
+        except (KeyError, ValueError):
+            version = None
+        else:
+            version = '{0}.{1}'.format(year, data_vintage.latest_imported_file(year))
+
+    elif scope == 'unit':
+        version = data_vintage.unit_versions().get(kwargs.get('slug'), 0)
+
+    elif scope == 'data':
+        version = data_vintage.imported_data_version()
+
+    else:
+        raise ValueError('Unknown cache scope "{}"'.format(scope))
+
+    return '{0}.{1}'.format(scope, version)
+
+
+class StaleReads(object):
+    '''
+    View of a cache whose get() returns expired values, without claiming
+    their refresh, for looking up the header lists of cached responses.
+    '''
+    def __init__(self, cache):
+        self.cache = cache
 
-    employers.update(
-        {e.slug: e for e in Department.objects.filter(slug__in=slugs)}
+    def get(self, key, default=None, version=None):
+        return self.cache.get_stale(key, default, version=version, refresh=False)
+
+
+class StaleCacheMiddleware(CacheMiddleware):
+    '''
+    CacheMiddleware that, with caches that keep expired values, i.e.,
+    TieredCache, serves an expired response while the first request for it
+    rebuilds it, rather than rebuilding it for every request at once.
+    '''
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD') or not hasattr(self.cache, 'get_stale'):
+            return super().process_request(request)
+
+        headers = StaleReads(self.cache)
+
+        cache_key = get_cache_key(request, self.key_prefix, 'GET', cache=headers)
+
+        if cache_key is None:
+            request._cache_update_cache = True
+            return None
+
+        response = self.cache.get_stale(cache_key)
+
+        if response is None and request.method == 'HEAD':
+            cache_key = get_cache_key(request, self.key_prefix, 'HEAD', cache=headers)
+            response = self.cache.get_stale(cache_key)
+
+        if response is None:
+            request._cache_update_cache = True
+            return None
+
+        request._cache_update_cache = False
+        return response
+
+
+def stale_cache_page(timeout, cache=None, key_prefix=None):
+    '''
+    Like cache_page, but serve expired responses while they are rebuilt,
+    per StaleCacheMiddleware.
+    '''
+    return decorator_from_middleware_with_args(StaleCacheMiddleware)(
+        cache_timeout=timeout, cache_alias=cache, key_prefix=key_prefix
     )
 
-    return employers
+
+def vintage_cache_page(timeout, scope, cache=None):
+    '''
+    Like cache_page, but prefix cache keys with the version of the data the
+    response is built from, per cache_key_prefix, so imports invalidate
+    only the responses they affect, and serve expired responses while they
+    are rebuilt, per StaleCacheMiddleware.
+    '''
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            key_prefix = cache_key_prefix(request, scope, kwargs)
+            cached_view = stale_cache_page(timeout, cache=cache, key_prefix=key_prefix)(view_func)
+            return cached_view(request, *args, **kwargs)
+
+        return wrapped_view
+
+    return decorator
+
+
+class SingleFlight(object):
+    '''
+    Coalesce concurrent computations of the same value, across workers, with
+    a lock in the given cache. The first request to take the lock computes
+    the value, and stores it in the cache for result_timeout seconds.
+    Concurrent requests wait up to wait seconds for the value, then compute
+    it themselves, e.g., if the request holding the lock failed.
+
+    Keys should name the version of the data the value is built from, so
+    values computed before an import are not returned after it.
+    '''
+    MISSING = object()
+
+    def __init__(self, cache='api', lock_timeout=30, wait=20, poll_interval=0.1, result_timeout=60):
+        self.cache_alias = cache
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.result_timeout = result_timeout
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def do(self, key, compute):
+        key = hashlib.md5(key.encode('utf-8')).hexdigest()
+
+        lock_key = 'single_flight.lock.{}'.format(key)
+        result_key = 'single_flight.result.{}'.format(key)
+
+        value = self.cache.get(result_key, self.MISSING)
+
+        if value is not self.MISSING:
+            return value
+
+        if self.cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                value = compute()
+                self.cache.set(result_key, value, self.result_timeout)
+                return value
+
+            finally:
+                self.cache.delete(lock_key)
+
+        # Other workers release the lock in the shared cache, so read it from
+        # there, rather than from the local tier of a TieredCache.
+        get_lock = getattr(self.cache, 'get_shared', self.cache.get)
+
+        deadline = time.monotonic() + self.wait
+
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+
+            value = self.cache.get(result_key, self.MISSING)
+
+            if value is not self.MISSING:
+                return value
+
+            # The request holding the lock finished without storing a value.
+            if get_lock(lock_key) is None:
+                break
+
+        return compute()
@@ -1,14 +1,17 @@
 import datetime
 from itertools import chain
-import csv
 
 from django.core.cache import caches
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.core.files.storage import default_storage
 from django.db.models import Max
+from django.middleware.gzip import re_accepts_gzip
 from django.http import JsonResponse, HttpResponse, \
-    HttpResponsePermanentRedirect, HttpResponseGone, StreamingHttpResponse
+    HttpResponsePermanentRedirect, HttpResponseGone, StreamingHttpResponse, \
+    FileResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.views.generic.base import TemplateView
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
@@ -20,9 +23,10 @@ import bleach
 from bga_database.chart_settings import BAR_HIGHLIGHT
 from bga_database.local_settings import CACHE_SECRET_KEY
 
-from data_import.models import StandardizedFile
+from data_import.utils import data_vintage
 
 from payroll.charts import ChartHelperMixin
+from payroll.exports import stream_salary_export, stored_salary_export
 from payroll.models import Person, Unit, Department, Employer
 from payroll.search import PayrollSearchMixin, FacetingMixin, \
     DisallowedSearchException
@@ -35,11 +39,7 @@ class IndexView(TemplateView, ChartHelperMixin):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        data_years = StandardizedFile.objects.distinct('reporting_year')\
-                                             .order_by('-reporting_year')\
-                                             .values_list('reporting_year', flat=True)
-
-        context['data_years'] = list(data_years)
+        context['data_years'] = data_vintage.data_years()
 
         context['show_donate_banner'] = Setting.get('PAYROLL_SHOW_DONATE_BANNER', False)
 
@@ -173,72 +173,37 @@ class PersonView(RedirectDispatchMixin, DetailView, ChartHelperMixin):
         return context
 
 
-class PsuedoBuffer:
-    """An object that implements just the write method of the file-like
-    interface.
-    """
-
-    def write(self, value):
-        """Write the value by returning it, instead of storing in a buffer."""
-        return value
-
-
 class DownloadView(TemplateView):
     def get(self, request, *args, **kwargs):
         slug = request.GET.get('employer')
         year = request.GET.get('year')
         employer = Employer.objects.get(slug=slug)
-        employer_salaries = employer.get_salaries(year=year).select_related(
-            'job',
-            'job__person',
-            'job__position',
-            'job__position__employer',
-            'job__position__employer__parent'
-        )
-
-        buffer = PsuedoBuffer()
-        headers = ['name',
-                   'unit',
-                   'department',
-                   'title',
-                   'tenure',
-                   'salary',
-                   'other']
-        dict_writer = csv.DictWriter(f=buffer, fieldnames=headers)
-
-        def row_generator():
-            for salary in employer_salaries:
-                name_kwargs = {
-                    'first_name': salary.job.person.first_name,
-                    'last_name': salary.job.person.last_name
-                }
-                name = '{first_name} {last_name}'.format(**name_kwargs)
-
-                start_date = salary.job.start_date.strftime('%m/%d/%Y') if salary.job.start_date else ''  # noqa
-
-                yield {
-                    'name': name,
-                    'unit': salary.job.position.employer.parent,
-                    'department': salary.job.position.employer,
-                    'title': salary.job.position.title,
-                    'tenure': start_date,
-                    'salary': salary.amount,
-                    'other': salary.extra_pay
-                }
-
-        # DictWriter.writeheader() doesn't work in python 3.5,
-        # so this workaround adds the header from dict_writer.fieldnames.
-        flat_writer = csv.writer(buffer)
-        rows = chain([flat_writer.writerow(dict_writer.fieldnames)],
-                     (dict_writer.writerow(row) for row in row_generator()))
-
-        response = StreamingHttpResponse(
-            rows,
-            content_type='text/csv'
-        )
 
         filename = '{employer}-{year}.csv'.format(employer=employer.name, year=year)  # noqa
-        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)  # noqa
+
+        accepts_gzip = re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+        stored_export = stored_salary_export(employer, year) if year and accepts_gzip else None
+
+        if stored_export:
+            # Serve the pre-generated export, gzipped, and let the client
+            # decompress it.
+            response = FileResponse(default_storage.open(stored_export),
+                                    as_attachment=True,
+                                    filename=filename,
+                                    content_type='text/csv')
+            response['Content-Encoding'] = 'gzip'
+
+        else:
+            response = StreamingHttpResponse(
+                stream_salary_export(employer, year=year),
+                content_type='text/csv'
+            )
+
+            response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)  # noqa
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
         return response
 
 
@@ -299,11 +264,7 @@ class SearchView(ListView, PayrollSearchMixin, FacetingMixin):
         context['facets'] = facets
         context['search_limit'] = settings.SEARCH_LIMIT
 
-        data_years = StandardizedFile.objects.distinct('reporting_year')\
-                                             .order_by('-reporting_year')\
-                                             .values_list('reporting_year', flat=True)
-
-        context['data_years'] = list(data_years)
+        context['data_years'] = data_vintage.data_years()
 
         context['captcha_site_key'] = getattr(settings, 'RECAPTCHA_PUBLIC_KEY')
 
@@ -0,0 +1,115 @@
+import csv
+import os
+import shutil
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+
+from data_import.utils import CsvMeta
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__),
+                       'fixtures',
+                       'standardized_data_sample.2018.csv')
+
+
+def test_trimmed_file():
+    with open(FIXTURE, 'rb') as f:
+        meta = CsvMeta(File(f))
+
+        # Decode in chunks smaller than a line, so rows span chunks.
+        meta.file.DEFAULT_CHUNK_SIZE = 7
+
+        trimmed = list(csv.reader(meta.trimmed_file().read().splitlines()))
+
+    with open(FIXTURE, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [CsvMeta._clean_field(field) for field in reader.fieldnames]
+
+        expected = [[row[field].strip() for field in CsvMeta.REQUIRED_FIELDS] for row in reader]
+
+    assert trimmed[0] == CsvMeta.REQUIRED_FIELDS
+    assert trimmed[1:] == expected
+    assert len(expected) == 54
+
+
+def test_file_encoding(settings):
+    settings.ENCODING_DETECTION_BYTES = 16
+
+    header = ','.join(CsvMeta.REQUIRED_FIELDS)
+    row = 'Chicago,Chicago,Peña,José,Clerk,Finance,1,2,3,2018\n'
+
+    encodings = {
+        (header + '\n' + row).encode('utf-8'): 'utf-8',
+        (header + '\n' + row).encode('utf-8-sig'): 'utf-8-sig',
+        (header + '\n' + row).encode('utf-16'): 'utf-16',
+    }
+
+    for content, encoding in encodings.items():
+        meta = CsvMeta(ContentFile(content, name='standardized.csv'))
+
+        assert meta.file_encoding == encoding
+        assert meta.field_names == CsvMeta.REQUIRED_FIELDS
+
+    # Detection stops at the byte budget, rather than reading the whole file.
+    content = ContentFile((header + '\n' + row * 1000).encode('utf-8'), name='standardized.csv')
+    content.DEFAULT_CHUNK_SIZE = len(header) + 1
+
+    meta = CsvMeta(content)
+
+    assert meta.file_encoding == 'utf-8'
+    assert next(meta.chunks, None) is not None
+
+
+def test_trim_extra_fields():
+    header = ','.join(CsvMeta.REQUIRED_FIELDS)
+
+    # Files with the same name, e.g., from different directories of a batch,
+    # are trimmed to different paths.
+    trimmed = []
+
+    for last_name in ('Peña', 'Smith'):
+        row = 'Chicago,Chicago,{},José,Clerk,Finance,1,2,3,2018\n'.format(last_name)
+        content = ContentFile((header + '\n' + row).encode('utf-8'), name='data/payroll.2018.csv')
+
+        trimmed.append(CsvMeta(content).trim_extra_fields())
+
+    try:
+        assert trimmed[0] != trimmed[1]
+        assert all(os.path.basename(path) == 'payroll.2018.csv' for path in trimmed)
+
+        for path, last_name in zip(trimmed, ('Peña', 'Smith')):
+            with open(path, encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+
+            assert [row['last_name'] for row in rows] == [last_name]
+
+    finally:
+        for path in trimmed:
+            shutil.rmtree(os.path.dirname(path))
+
+
+def test_file_encoding_after_sample(settings):
+    settings.ENCODING_DETECTION_BYTES = 1024
+
+    header = ','.join(CsvMeta.REQUIRED_FIELDS)
+    ascii_row = 'Chicago,Chicago,Smith,Joe,Clerk,Finance,1,2,3,2018\n'
+    latin_1_row = 'Chicago,Chicago,Peña,José,Clerk,Finance,1,2,3,2018\n'
+
+    # The first non-ASCII character comes after the sample the encoding is
+    # detected from.
+    content = ContentFile((header + '\n' + ascii_row * 100 + latin_1_row * 10).encode('latin-1'), name='standardized.csv')
+    content.DEFAULT_CHUNK_SIZE = 256
+
+    meta = CsvMeta(content)
+
+    assert meta.file_encoding == 'utf-8'
+
+    rows = list(meta.trimmed_rows())
+
+    # The encoding is detected from the whole file once the rest of the file
+    # does not decode, and rows are neither lost nor repeated.
+    assert meta.file_encoding != 'utf-8'
+    assert len(rows) == 110
+    assert rows[99][2:4] == ('Smith', 'Joe')
+    assert rows[100][2:4] == ('Peña', 'José')
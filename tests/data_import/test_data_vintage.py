@@ -0,0 +1,57 @@
+from django.core.cache import caches
+from django.test import override_settings
+
+from data_import.utils.data_vintage import DataVintageRegistry
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'data-vintage-test',
+    },
+}
+
+DUMMY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+def test_data_vintage_memoizes_until_bumped():
+    registry = DataVintageRegistry()
+    compute = Counter()
+
+    assert registry.get('data_years', compute) == 1
+    assert registry.get('data_years', compute) == 1
+
+    registry.bump()
+
+    assert registry.get('data_years', compute) == 2
+
+    # Clearing the cache, e.g., with the flush_cache view, also invalidates
+    # memoized values.
+    caches['default'].clear()
+
+    assert registry.get('data_years', compute) == 3
+
+
+@override_settings(CACHES=DUMMY_CACHES)
+def test_data_vintage_without_cache():
+    registry = DataVintageRegistry()
+    compute = Counter()
+
+    # The dummy cache backend does not retain the version token, so values
+    # are computed every time.
+    assert registry.get('data_years', compute) == 1
+    assert registry.get('data_years', compute) == 2
@@ -12,6 +12,7 @@ import pytest
 from django.db import connection
 
 from data_import import utils
+from payroll.models import Person
 
 
 @pytest.mark.django_db
@@ -24,6 +25,23 @@ def test_import_utility_init(raw_table_setup,
     imp = utils.ImportUtility(s_file_2018.id)
     imp.populate_models_from_raw_data()
 
+    # Each stage of the import is recorded in the run log.
+    logged_stages = set(s_file_2018.run_log.values_list('stage', flat=True))
+
+    assert {'insert_parent_employer', 'select_raw_person', 'insert_salary'} <= logged_stages
+
+    # Completed stages are checkpointed, so they are not repeated if the
+    # import is run again.
+    assert set(imp.POPULATE_STAGES + imp.SALARY_STAGES) <= imp.completed_stages()
+    assert not imp.run_stage('insert_salary')
+
+    # People with salaries in the file are recorded, so they can be reindexed.
+    changed_people = s_file_2018.changed_entities.filter(entity_type='person')
+    people_with_salaries = Person.objects.filter(jobs__salaries__vintage=s_file_2018.upload).distinct()
+
+    assert set(changed_people.values_list('entity_id', flat=True)) == \
+        set(people_with_salaries.values_list('id', flat=True))
+
     with connection.cursor() as cursor:
         # Do some validation on the individual model tables, so we have a
         # clue where things went wrong, when making changes to the queries.
@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+
+from bga_database.chart_settings import DISTRIBUTION_MAX, DISTRIBUTION_BIN_NUM
+from payroll.charts import ChartHelperMixin
+
+
+def width_bucket(salary):
+    '''
+    Python equivalent of WIDTH_BUCKET(salary, 0, DISTRIBUTION_MAX,
+    DISTRIBUTION_BIN_NUM), as used to bin salaries in EmployerYearStats.
+    '''
+    if salary < 0:
+        return 0
+    elif salary >= DISTRIBUTION_MAX:
+        return DISTRIBUTION_BIN_NUM + 1
+
+    return int(salary // (DISTRIBUTION_MAX / DISTRIBUTION_BIN_NUM)) + 1
+
+
+def precompute_bins(salaries):
+    salary_bins = [0] * (DISTRIBUTION_BIN_NUM + 2)
+
+    for salary in salaries:
+        salary_bins[width_bucket(salary)] += 1
+
+    return salary_bins
+
+
+def test_bin_precomputed_salary_data_matches_histogram():
+    helper = ChartHelperMixin()
+
+    random.seed(1)
+
+    salary_sets = [
+        # All salaries under the distribution max
+        [random.randint(0, DISTRIBUTION_MAX - 1) for _ in range(500)],
+        # Salaries exactly on the distribution max fall in the last bin...
+        [10000, 50000, DISTRIBUTION_MAX],
+        # ...unless there are salaries above it
+        [10000, DISTRIBUTION_MAX, DISTRIBUTION_MAX + 25000],
+        [random.randint(0, DISTRIBUTION_MAX * 2) for _ in range(500)],
+    ]
+
+    for salaries in salary_sets:
+        expected = helper.bin_salary_data(salaries)
+
+        precomputed = helper.bin_precomputed_salary_data(precompute_bins(salaries),
+                                                         np.amax(salaries))
+
+        assert precomputed == expected
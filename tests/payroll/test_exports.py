@@ -0,0 +1,83 @@
+import csv
+import gzip
+import io
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+import pytest
+
+from data_import.models import StandardizedFile
+from payroll.exports import export_path, stored_salary_export
+from payroll.models import EmployerYearStats
+
+
+@pytest.fixture
+def exported_salary(salary, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    salary = salary.build()
+
+    # The salary's file is imported, but the files built for its job,
+    # person, position and employer, which are more recent, are not.
+    s_file = salary.vintage.standardized_file.get()
+    s_file.status = StandardizedFile.State.COMPLETE
+    s_file.save()
+
+    EmployerYearStats.refresh()
+
+    call_command('build_exports', reporting_year=settings.DATA_YEAR, stdout=io.StringIO())
+
+    employer = salary.job.position.employer
+    employer.refresh_from_db()  # Get slug generated on insert
+
+    return employer, s_file
+
+
+def export_rows(employer):
+    return [
+        ['name', 'unit', 'department', 'title', 'tenure', 'salary', 'other'],
+        ['Joe Dirt', '', employer.name, 'Brewmaster', '05/05/2010', '25000.00', '2500.00'],
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_build_exports(exported_salary, transactional_db):
+    employer, s_file = exported_salary
+
+    # Exports are built from the most recent file that has been imported.
+    path = stored_salary_export(employer, settings.DATA_YEAR)
+
+    assert path == export_path(employer, settings.DATA_YEAR, s_file.id)
+
+    with default_storage.open(path) as f:
+        content = gzip.decompress(f.read()).decode('utf-8')
+
+    assert list(csv.reader(io.StringIO(content))) == export_rows(employer)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download_stored_export(exported_salary, client, transactional_db):
+    employer, _ = exported_salary
+
+    params = {'employer': employer.slug, 'year': settings.DATA_YEAR}
+
+    # Clients that accept gzip are served the stored export...
+    rv = client.get('/download/', params, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+    assert rv.status_code == 200
+    assert rv['Content-Encoding'] == 'gzip'
+
+    content = gzip.decompress(b''.join(rv.streaming_content)).decode('utf-8')
+
+    assert list(csv.reader(io.StringIO(content))) == export_rows(employer)
+
+    # ...while other clients are streamed the export from the database.
+    rv = client.get('/download/', params)
+
+    assert rv.status_code == 200
+    assert not rv.has_header('Content-Encoding')
+
+    content = b''.join(rv.streaming_content).decode('utf-8')
+
+    assert list(csv.reader(io.StringIO(content))) == export_rows(employer)
@@ -0,0 +1,85 @@
+import os
+
+from django.core.management.base import CommandError
+import pytest
+
+from data_import.models import StandardizedFile
+from payroll.management.commands.import_data import Command, validate_data_file
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'data_import', 'fixtures')
+
+
+def test_get_data_files(tmpdir):
+    for name in ('payroll.2018.csv', 'payroll.2017.CSV', 'notes.txt'):
+        tmpdir.join(name).write('')
+
+    command = Command()
+
+    # Data directories are imported in order of file name, taking the year
+    # from each name, and skipping files that are not CSVs...
+    assert command.get_data_files({'data_dir': str(tmpdir)}) == [
+        (str(tmpdir.join('payroll.2017.CSV')), '2017'),
+        (str(tmpdir.join('payroll.2018.csv')), '2018'),
+    ]
+
+    # ...unless a reporting year is given.
+    assert command.get_data_files({'data_dir': str(tmpdir), 'reporting_year': '2016'}) == [
+        (str(tmpdir.join('payroll.2017.CSV')), '2016'),
+        (str(tmpdir.join('payroll.2018.csv')), '2016'),
+    ]
+
+    # Manifests list files one per line, in order. Blank lines are skipped.
+    manifest = tmpdir.join('manifest.txt')
+    manifest.write('/data/payroll.2018.csv\n\n  /data/payroll.2017.csv  \n')
+
+    assert command.get_data_files({'manifest': str(manifest)}) == [
+        ('/data/payroll.2018.csv', '2018'),
+        ('/data/payroll.2017.csv', '2017'),
+    ]
+
+    empty_dir = tmpdir.mkdir('empty')
+
+    with pytest.raises(CommandError):
+        command.get_data_files({'data_dir': str(empty_dir)})
+
+
+def test_get_reporting_year():
+    command = Command()
+
+    assert command.get_reporting_year('/data/2019/IL-payroll-2018.csv') == '2018'
+
+    # Years are only taken from the file name, not the directory.
+    with pytest.raises(CommandError):
+        command.get_reporting_year('/data/2019/payroll.csv')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upload_removes_trimmed_files(mocker, settings, tmpdir, transactional_db):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    trimmed_files = []
+
+    def validate(data_files):
+        validated = [(validate_data_file(data_file), year) for data_file, year in data_files]
+        trimmed_files.extend(data_file for data_file, _ in validated)
+        return validated
+
+    mocker.patch('payroll.management.commands.import_data.copy_to_database')
+    mocker.patch('payroll.management.commands.import_data.ImportUtility')
+
+    command = Command()
+    command.data_files = [(os.path.join(FIXTURES, 'standardized_data_sample.2018.csv'), '2018')]
+
+    mocker.patch.object(command, 'validate', side_effect=validate)
+    mocker.patch.object(command, 'pre_import')
+    mocker.patch.object(command, 'post_import')
+
+    command.upload()
+
+    s_file, = StandardizedFile.objects.all()
+
+    # The trimmed copy is stored under the name of the data file, then
+    # removed, along with its temp directory.
+    assert os.path.basename(s_file.standardized_file.name) == 'standardized_data_sample.2018.csv'
+    assert not os.path.exists(os.path.dirname(trimmed_files[0]))
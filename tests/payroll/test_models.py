@@ -1,6 +1,9 @@
 import pytest
+from django.conf import settings
 from django.db.utils import IntegrityError
 
+from payroll.models import Employer, EmployerYearStats
+
 
 @pytest.mark.django_db
 def test_null_salary(salary):
@@ -20,3 +23,27 @@ def test_null_salary_extra_pay(salary):
     s = salary.build(extra_pay=None)
 
     assert s.amount == '25000'
+
+
+@pytest.mark.parametrize('entity_type,is_special,population,size_class', [
+    ('Municipal', True, 2700000, 'Large'),
+    ('Municipal', False, 49999, 'Medium'),
+    ('County', False, 24999, 'Small'),
+    ('Township', True, None, None),
+    ('School District', False, 100000, None),
+])
+def test_classify_size(entity_type, is_special, population, size_class):
+    assert Employer.classify_size(entity_type, is_special, population) == size_class
+
+
+@pytest.mark.django_db
+def test_employer_year_stats_before_refresh(salary):
+    s = salary.build()
+
+    # The view has not been refreshed since the salary was added, so its
+    # statistics are computed from the salaries of the employer.
+    stats = EmployerYearStats.for_employer(s.job.position.employer, settings.DATA_YEAR)
+
+    assert stats.headcount == 1
+    assert stats.total_pay == 27500
+    assert sum(stats.salary_bins) == 1
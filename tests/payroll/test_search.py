@@ -0,0 +1,245 @@
+import io
+import json
+
+from django.core.management import call_command
+from django.test import override_settings
+import pysolr
+import pytest
+
+from data_import.models import ChangedEntity
+from payroll.management.commands.build_solr_index import Command as BuildSolrIndex
+from payroll.models import EmployerYearStats, Job, Person, Salary
+from payroll.search import PayrollSearchMixin, FacetingMixin
+from payroll.utils import employers_from_slugs, employer_records
+
+
+class Search(PayrollSearchMixin, FacetingMixin):
+    pass
+
+
+def test_single_search_sort():
+    sort = PayrollSearchMixin()._single_search_sort(['unit', 'department', 'person'])
+
+    assert sort == ('query($unit_filter,0) desc,'
+                    'query($department_filter,0) desc,'
+                    'expenditure_d desc,'
+                    'salary_d desc')
+
+
+def test_single_search(mocker):
+    search = Search()
+
+    response = {
+        'response': {
+            'numFound': 40,
+            'docs': [
+                {'id': 'unit.1.2018', 'name': 'Chicago'},
+                {'id': 'department.2.2018', 'name': 'Chicago Police'},
+            ],
+        },
+        'facets': {
+            'count': 40,
+            'unit': {
+                'count': 1,
+                'expenditure_d_0': {'count': 1},
+                'headcount_i_3': {'count': 1},
+                'pivot_0': {
+                    'buckets': [{
+                        'val': 'Municipal',
+                        'count': 1,
+                        'size_class_s_fct': {
+                            'buckets': [{'val': 'Large', 'count': 1}],
+                        },
+                    }],
+                },
+            },
+            'department': {
+                'count': 4,
+                'parent_s_fct': {
+                    'buckets': [{'val': 'Chicago', 'count': 4}],
+                },
+            },
+            'person': {
+                'count': 35,
+            },
+        },
+    }
+
+    search.searcher = mocker.MagicMock()
+    search.searcher.search.return_value = pysolr.Results(response)
+
+    results = search.search({'name': 'chicago', 'year': '2018'}, pagesize=2)
+
+    assert search.searcher.search.call_count == 1
+    assert len(results) == 40
+    assert [result['id'] for result in results] == ['unit.1.2018', 'department.2.2018']
+
+    query_string, search_kwargs = search.searcher.search.call_args
+    json_facets = json.loads(search_kwargs['json.facet'])
+
+    assert json_facets['person']['q'] == 'id:person*'
+    assert json_facets['unit']['facet']['expenditure_d_1']['q'] == 'expenditure_d:[500000 TO 1500000}'
+
+    # Facets are only returned for entity types with results on the page.
+    facets = search.parse_facets(search.facets)
+
+    assert set(facets) == {'unit', 'department'}
+
+    assert facets['unit']['taxonomy_s_fct,size_class_s_fct'] == [{
+        'value': 'Municipal',
+        'count': 1,
+        'pivot': [{'value': 'Large', 'count': 1}],
+    }]
+
+    assert facets['unit']['expenditure_d'][0] == {'value': '[0,500000)', 'count': 1}
+    assert facets['department']['parent_s_fct'] == [{'value': 'Chicago', 'count': 4}]
+
+
+def test_page_plan():
+    entity_edges = [('unit', 3), ('department', 10), ('person', 100)]
+
+    plan = PayrollSearchMixin()._page_plan(entity_edges, pagesize=5, offset=0)
+    assert plan == [('unit', 0, 5), ('department', 0, 2)]
+
+    plan = PayrollSearchMixin()._page_plan(entity_edges, pagesize=5, offset=10)
+    assert plan == [('department', 7, 5), ('person', 0, 2)]
+
+
+def test_index_partitions(mocker):
+    command = BuildSolrIndex()
+    command.reporting_years = [2017, 2018]
+    command.partitions = 2
+    command.entity_ids = None
+
+    mocker.patch.object(Person.objects, 'aggregate', return_value={'id__min': 1, 'id__max': 10})
+
+    # People are split into ranges of IDs within each year...
+    assert command._partitions('person') == [
+        (2017, (1, 5)),
+        (2017, (6, 10)),
+        (2018, (1, 5)),
+        (2018, (6, 10)),
+    ]
+
+    # ...and employers are split by year.
+    assert command._partitions('unit') == [(2017, None), (2018, None)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_index_changed_entities(salary, mocker, transactional_db):
+    changed = salary.build()
+
+    # A coworker whose salary the file did not change.
+    coworker = Person.objects.create(first_name='Jane', last_name='Dirt', vintage=changed.vintage)
+    coworker_job = Job.objects.create(person=coworker, position=changed.job.position, vintage=changed.vintage)
+    Salary.objects.create(job=coworker_job, amount='30000', extra_pay='0', vintage=changed.vintage)
+
+    EmployerYearStats.refresh()
+
+    s_file = changed.vintage.standardized_file.get()
+    year = s_file.reporting_year
+
+    ChangedEntity.record_salaries(s_file.id, Salary.objects.filter(id=changed.id))
+
+    # A person removed by an amendment, who has no salaries to index.
+    ChangedEntity.objects.create(standardized_file=s_file, entity_type='person', entity_id=0)
+
+    solr = mocker.patch('payroll.management.commands.build_solr_index.pysolr.Solr').return_value
+
+    call_command('build_solr_index', s_file_id=s_file.id, stdout=io.StringIO())
+
+    unit_id = changed.job.position.employer_id
+    person_id = changed.job.person_id
+
+    # Documents for the changed entities are dropped by ID, without
+    # committing...
+    deleted = [document_id for call in solr.delete.call_args_list for document_id in call[1]['id']]
+
+    assert sorted(deleted) == sorted([
+        'unit.{0}.{1}'.format(unit_id, year),
+        'person.{0}.{1}'.format(person_id, year),
+        'person.0.{}'.format(year),
+    ])
+    assert all(call[1]['commit'] is False for call in solr.delete.call_args_list)
+
+    # ...and only they are added back, if they still have salaries...
+    added = [document['id'] for call in solr.add.call_args_list for document in call[0][0]]
+
+    assert sorted(added) == sorted(['unit.{0}.{1}'.format(unit_id, year), 'person.{0}.{1}'.format(person_id, year)])
+    assert 'person.{0}.{1}'.format(coworker.id, year) not in added
+    assert all(call[1]['commit'] is False for call in solr.add.call_args_list)
+
+    # ...then the changes are committed at once.
+    solr.commit.assert_called_once_with()
+    assert solr.method_calls[-1] == mocker.call.commit()
+
+
+def test_concurrent_search_partial_results(mocker):
+    search = Search()
+    search.single_query = False
+
+    # Searches for departments fail, or only their page queries fail.
+    fail_counts = True
+
+    def mock_search(query_string, **kwargs):
+        if 'id:department*' in query_string and (fail_counts or kwargs['rows'] != 0):
+            raise pysolr.SolrError('Connection to server timed out')
+
+        entity_type = query_string.split('id:')[-1].rstrip('*')
+
+        if kwargs['rows'] == 0:
+            docs = []
+        else:
+            docs = [{'id': '{}.1.2018'.format(entity_type), 'employer_ss': []}]
+
+        return pysolr.Results({'response': {'numFound': 1, 'docs': docs}})
+
+    search.searcher = mocker.MagicMock()
+    search.searcher.search.side_effect = mock_search
+
+    results = search.search({'name': 'chicago', 'year': '2018'}, pagesize=25)
+
+    # Departments are left out of the results, rather than failing the search.
+    assert len(results) == 2
+    assert [result['id'] for result in results] == ['unit.1.2018', 'person.1.2018']
+
+    fail_counts = False
+
+    results = search.search({'name': 'chicago', 'year': '2018'}, pagesize=25)
+
+    # Hits of entity types whose page of results could not be retrieved are
+    # left out of the total, too.
+    assert len(results) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_employers_from_slugs(employer, django_assert_num_queries, transactional_db):
+    unit = employer.build()
+    department = employer.build(name='Brew Staff', parent=unit)
+
+    unit.refresh_from_db()  # Get slugs generated on insert
+    department.refresh_from_db()
+
+    locmem_caches = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+    with override_settings(CACHES=locmem_caches):
+        # Misses are fetched in a single query...
+        with django_assert_num_queries(1):
+            employers = employers_from_slugs([unit.slug, department.slug])
+
+        assert str(employers[unit.slug]) == 'Half Acre'
+        assert str(employers[department.slug]) == 'Half Acre Brew Staff'
+        assert employers[department.slug].endpoint == 'department'
+
+        # ...and hits are served from the cache.
+        with django_assert_num_queries(0):
+            employers_from_slugs([unit.slug, department.slug])
+
+        employer_records.bump()
+
+        with django_assert_num_queries(1):
+            employers_from_slugs([unit.slug])
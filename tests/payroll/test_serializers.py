@@ -0,0 +1,23 @@
+from django.conf import settings
+import pytest
+
+from payroll.models import EmployerYearStats, SalaryPercentile
+from payroll.serializers import PersonSerializer
+
+
+@pytest.mark.django_db(transaction=True)
+def test_person_serializer_queries(salary, django_assert_num_queries, transactional_db):
+    salary = salary.build()
+    person = salary.job.person
+
+    EmployerYearStats.refresh()
+    SalaryPercentile.refresh()
+
+    # The salary history, whether the employer is comparable, the employer
+    # statistics, coworkers and the source file.
+    with django_assert_num_queries(5):
+        data = PersonSerializer(person, context={'data_year': settings.DATA_YEAR}).data
+
+    assert data['current_salary'] == 27500
+    assert data['current_employer']['endpoint'] == 'unit'
+    assert [job['data_year'] for job in data['all_jobs']] == [settings.DATA_YEAR]
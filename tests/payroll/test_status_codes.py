@@ -1,6 +1,12 @@
+import csv
+import io
+
+from django.conf import settings
+from django.test import override_settings
 import pytest
 
-from payroll.models import Employer, Person
+from payroll.models import Employer, EmployerYearStats, Person, Salary, \
+    SalaryPercentile
 
 
 @pytest.mark.django_db(transaction=True)
@@ -64,3 +70,55 @@ def test_person(salary, client, transactional_db):
     rv = client.get('/people/{}/'.format(p.slug))
 
     assert rv.status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_person_api_data_years(salary, standardized_file, client, settings, tmpdir, transactional_db):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    salary = salary.build()
+
+    # Give the person a salary for the year before, too.
+    previous_year = settings.DATA_YEAR - 1
+    s_file = standardized_file.build(reporting_year=previous_year)
+    Salary.objects.create(job=salary.job, amount='20000', extra_pay='0', vintage=s_file.upload)
+
+    EmployerYearStats.refresh()
+    SalaryPercentile.refresh()
+
+    person = salary.job.person
+    person.refresh_from_db()  # Get slug generated on insert
+
+    # Cache computed responses, so responses for one year could be returned
+    # for the other.
+    caches = {
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'person-api-test'}
+        for alias in ('default', 'api', 'vary_on_setting')
+    }
+
+    with override_settings(CACHES=caches):
+        current_salaries = [
+            client.get('/people/{}/'.format(person.slug), {'data_year': year}).json()['current_salary']
+            for year in (previous_year, settings.DATA_YEAR)
+        ]
+
+    assert current_salaries == [20000, 27500]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download(salary, client, transactional_db):
+    salary = salary.build()
+
+    employer = salary.job.position.employer
+    employer.refresh_from_db()  # Get slug generated on insert
+
+    rv = client.get('/download/', {'employer': employer.slug, 'year': settings.DATA_YEAR})
+
+    assert rv.status_code == 200
+
+    content = b''.join(rv.streaming_content).decode('utf-8')
+
+    assert list(csv.reader(io.StringIO(content))) == [
+        ['name', 'unit', 'department', 'title', 'tenure', 'salary', 'other'],
+        ['Joe Dirt', '', employer.name, 'Brewmaster', '05/05/2010', '25000.00', '2500.00'],
+    ]
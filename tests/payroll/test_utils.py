@@ -0,0 +1,236 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+import pytest
+
+from bga_database.cache import ADD_SCRIPT, HEADER, TieredCache
+from data_import.models import ImportCheckpoint, StandardizedFile
+from payroll.utils import SingleFlight, cache_key_prefix, vintage_cache_page
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vintage-cache-page-test',
+    },
+    # The debug toolbar keeps the caches it instruments for cache_page, so
+    # use an alias no earlier request could have instrumented.
+    'vintage_cache_page': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vintage-cache-page-test',
+    },
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+def test_vintage_cache_page(mocker):
+    versions = {2017: 1, 2018: 2}
+
+    mocker.patch('payroll.utils.data_vintage.latest_imported_file',
+                 side_effect=lambda year: versions[year])
+
+    calls = []
+
+    @vintage_cache_page(60, 'year', cache='vintage_cache_page')
+    def view(request, slug=None):
+        calls.append(request.GET['data_year'])
+        return HttpResponse('ok')
+
+    factory = RequestFactory()
+
+    for year in ('2017', '2018', '2017', '2018'):
+        view(factory.get('/units/chicago/', {'data_year': year}), slug='chicago')
+
+    # Responses are cached...
+    assert calls == ['2017', '2018']
+
+    # ...until an import changes the data for their year.
+    versions[2018] = 3
+
+    for year in ('2017', '2018'):
+        view(factory.get('/units/chicago/', {'data_year': year}), slug='chicago')
+
+    assert calls == ['2017', '2018', '2018']
+
+
+@pytest.mark.django_db
+def test_cache_key_prefix_leaves_out_unimported_files(standardized_file):
+    imported = standardized_file.build(status=StandardizedFile.State.COMPLETE)
+
+    request = RequestFactory().get('/units/chicago/', {'data_year': settings.DATA_YEAR})
+
+    def prefixes():
+        return cache_key_prefix(request, 'year', {}), cache_key_prefix(request, 'data', {})
+
+    expected = ('year.{0}.{1}'.format(settings.DATA_YEAR, imported.id), 'data.{}'.format(imported.id))
+
+    assert prefixes() == expected
+
+    # A file that has been uploaded, but not imported, does not change the
+    # keys of responses, which are still built from the data before it...
+    uploaded = standardized_file.build()
+
+    assert prefixes() == expected
+
+    # ...until its salaries are inserted.
+    ImportCheckpoint.objects.create(standardized_file=uploaded, stage='insert_salary')
+
+    assert prefixes() == ('year.{0}.{1}'.format(settings.DATA_YEAR, uploaded.id), 'data.{}'.format(uploaded.id))
+
+
+class FakeRedis(object):
+    '''
+    Just enough of a Redis client for TieredCache, without expiry.
+    '''
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return False
+
+        self.values[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def register_script(self, script):
+        # TieredCache only registers ADD_SCRIPT.
+        def add(keys, args):
+            key, refresh_key = keys
+            record, now, _ = args
+
+            if key in self.values:
+                expires_at, _ = HEADER.unpack_from(self.values[key])
+
+                if not expires_at or expires_at > float(now):
+                    return 0
+
+            self.values[key] = record
+            self.values.pop(refresh_key, None)
+
+            return 1
+
+        return add
+
+    def pipeline(self, transaction=True):
+        results = []
+
+        class Pipeline(object):
+            def set(pipeline, *args, **kwargs):
+                results.append(self.set(*args, **kwargs))
+
+            def delete(pipeline, *args):
+                results.append(self.delete(*args))
+
+            def execute(pipeline):
+                return results
+
+        return Pipeline()
+
+
+def test_tiered_cache_serves_stale_values(mocker):
+    now = mocker.patch('bga_database.cache.time.time', return_value=1000)
+
+    cache = TieredCache('redis://fake-redis/0', {
+        'KEY_PREFIX': 'test',
+        'OPTIONS': {'COMPRESS_MIN_SIZE': 10},
+    })
+    cache.client = FakeRedis()
+    cache.add_script = cache.client.register_script(ADD_SCRIPT)
+
+    value = 'salary' * 100
+
+    cache.set('unit', value, 60)
+
+    # Large values are compressed in Redis.
+    record = cache.client.get(cache.make_key('unit'))
+    assert len(record) < len(value)
+    assert cache.get('unit') == value
+
+    # Unexpired values cannot be added over.
+    assert not cache.add('unit', 'new salary', 60)
+
+    # Once the value expires, get treats it as missing, while the first
+    # request to rebuild it gets a miss, and other requests are served the
+    # stale value...
+    now.return_value = 1100
+
+    assert cache.get('unit') is None
+    assert cache.get_stale('unit') is None
+    assert cache.get_stale('unit') == value
+
+    # ...until it is replaced.
+    assert cache.add('unit', 'new salary', 60)
+
+    assert cache.get('unit') == 'new salary'
+    assert cache.get_stale('unit') == 'new salary'
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+def test_single_flight():
+    single_flight = SingleFlight(cache='default', poll_interval=0.01)
+
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'median_salary': 50000}
+
+    results = []
+
+    def request():
+        results.append(single_flight.do('/units/chicago/', compute))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # Concurrent requests wait for the value computed by the first.
+    assert calls == [1]
+    assert results == [{'median_salary': 50000}] * 4
+
+
+def test_single_flight_reads_shared_lock(mocker):
+    cache = TieredCache('redis://fake-redis/0', {'KEY_PREFIX': 'single_flight'})
+    cache.client = FakeRedis()
+    cache.add_script = cache.client.register_script(ADD_SCRIPT)
+
+    mocker.patch('payroll.utils.caches', {'api': cache})
+
+    single_flight = SingleFlight(cache='api', wait=5, poll_interval=0.01)
+
+    lock_key = 'single_flight.lock.{}'.format(hashlib.md5(b'/units/chicago/').hexdigest())
+
+    # Another worker holds the lock, then releases it in Redis without
+    # storing a value. The release is not seen by the local tier...
+    assert cache.add(lock_key, 1, 30)
+
+    release = threading.Timer(0.05, cache.client.delete, args=[cache.make_key(lock_key)])
+    release.start()
+
+    started = time.monotonic()
+
+    assert single_flight.do('/units/chicago/', lambda: {'median_salary': 50000}) == {'median_salary': 50000}
+
+    release.join()
+
+    # ...so the lock is read from Redis, and the waiting request computes the
+    # value as soon as the lock is released, rather than waiting it out.
+    assert time.monotonic() - started < 1
+    assert cache.get(lock_key) == 1
+    assert cache.get_shared(lock_key) is None
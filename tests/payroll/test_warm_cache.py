@@ -0,0 +1,88 @@
+import io
+
+from django.core.management import call_command
+import pytest
+
+from payroll.models import EmployerYearStats, Job, Person, Salary
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.mark.django_db(transaction=True)
+def test_warm_cache(salary, employer, mocker, settings, transactional_db):
+    top_salary = salary.build()
+
+    unit = top_salary.job.position.employer
+    person = top_salary.job.person
+
+    # A second salary for the same person, who should be warmed once...
+    Salary.objects.create(job=top_salary.job, amount='20000', extra_pay='0', vintage=top_salary.vintage)
+
+    # ...and a less paid coworker, who is past the number of people to warm.
+    coworker = Person.objects.create(first_name='Jane', last_name='Dirt', vintage=top_salary.vintage)
+    coworker_job = Job.objects.create(person=coworker, position=top_salary.job.position, vintage=top_salary.vintage)
+    Salary.objects.create(job=coworker_job, amount='10000', extra_pay='0', vintage=top_salary.vintage)
+
+    # A department without salaries in the year has a page, but no API
+    # response to warm.
+    department = employer.build(name='Brew Staff', parent=unit)
+
+    EmployerYearStats.refresh()
+
+    for instance in (unit, department, person):
+        instance.refresh_from_db()  # Get slug generated on insert
+
+    settings.WARM_CACHE_URL = 'https://warm.example.org'
+    settings.SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+    failing_url = '/person/{}/'.format(person.slug)
+
+    clients = []
+    requests = []
+
+    class FakeClient(object):
+        def __init__(self, **defaults):
+            clients.append(defaults)
+
+        def get(self, path, secure=False):
+            requests.append((path, secure))
+            return FakeResponse(500 if path == failing_url else 200)
+
+    mocker.patch('payroll.management.commands.warm_cache.Client', FakeClient)
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+
+    call_command('warm_cache',
+                 data_year=settings.DATA_YEAR,
+                 people=1,
+                 workers=1,
+                 stdout=stdout,
+                 stderr=stderr)
+
+    year = settings.DATA_YEAR
+
+    # Paths are requested in order of priority, with API responses only for
+    # employers with salaries in the year, and each person once.
+    assert [path for path, _ in requests] == [
+        '/',
+        '/index/?data_year={}'.format(year),
+        '/unit/{}/'.format(unit.slug),
+        '/units/{0}/?data_year={1}'.format(unit.slug, year),
+        '/department/{}/'.format(department.slug),
+        '/person/{}/'.format(person.slug),
+        '/people/{0}/?data_year={1}'.format(person.slug, year),
+    ]
+
+    # Requests are made with the host and scheme of WARM_CACHE_URL.
+    assert all(secure for _, secure in requests)
+    assert all(client == {'HTTP_HOST': 'warm.example.org', 'HTTP_X_FORWARDED_PROTO': 'https'}
+               for client in clients)
+
+    # Error responses are reported as failures.
+    assert 'Warmed 7 URLs' in stdout.getvalue()
+    assert '1 failed' in stdout.getvalue()
+    assert 'Could not warm {}: status 500'.format(failing_url) in stderr.getvalue()